@@ -1,9 +1,14 @@
 import ast
 from dataclasses import dataclass, field
-from typing import List, Set, Dict, Optional, Any, Tuple
+from typing import List, Set, Dict, Optional, Any, Tuple, Iterator
 from collections import defaultdict
+from array import array
 import json
 import random
+import hashlib
+import re
+import textwrap
+import threading
 
 
 @dataclass
@@ -44,6 +49,438 @@ class ASTNode:
         """Check if node is a terminal node with a meaningful value"""
         return bool(self.value)
 
+# Node type names are interned process-wide so type ids are stable across trees
+NODE_TYPES: List[str] = []
+_NODE_TYPE_IDS: Dict[str, int] = {}
+_NODE_TYPE_LOCK = threading.Lock()
+
+def node_type_id(name: str) -> int:
+    """Return the interned id for an AST node type name"""
+    type_id = _NODE_TYPE_IDS.get(name)
+    if type_id is None:
+        with _NODE_TYPE_LOCK:
+            type_id = _NODE_TYPE_IDS.get(name)
+            if type_id is None:
+                type_id = len(NODE_TYPES)
+                NODE_TYPES.append(name)
+                _NODE_TYPE_IDS[name] = type_id
+    return type_id
+
+for _name in sorted(dir(ast)):
+    _cls = getattr(ast, _name)
+    if isinstance(_cls, type) and issubclass(_cls, ast.AST):
+        node_type_id(_name)
+
+def terminal_value(node: ast.AST) -> str:
+    """Same values as ASTNode._extract_value; ast.Num and ast.Str are always Constant nodes now"""
+    if isinstance(node, ast.Name):
+        return node.id
+    elif isinstance(node, ast.Constant):
+        return str(node.value)
+    return ""
+
+class CompactAST:
+    """Array-backed tree with one entry per AST node, in preorder.
+
+    Node i's subtree occupies indices [i, end[i]), so its first child is i + 1
+    and the sibling after child c is end[c]. value_id indexes into `values`,
+    where 0 is the empty value of non-terminal nodes.
+
+    With positions, lineno/col_offset/end_lineno/end_col_offset hold each
+    node's source span as in `ast` (1-based lines, UTF-8 byte columns), or -1
+    for nodes without one; otherwise they are empty.
+    """
+    __slots__ = ("parent", "depth", "child_id", "type_id", "value_id", "end", "values",
+                 "lineno", "col_offset", "end_lineno", "end_col_offset")
+    POSITIONS = ("lineno", "col_offset", "end_lineno", "end_col_offset")
+
+    def __init__(self):
+        self.parent = array("i")
+        self.depth = array("i")
+        self.child_id = array("i")
+        self.type_id = array("i")
+        self.value_id = array("i")
+        self.end = array("i")
+        self.values: List[str] = [""]
+        self.lineno = array("i")
+        self.col_offset = array("i")
+        self.end_lineno = array("i")
+        self.end_col_offset = array("i")
+
+    @property
+    def has_positions(self) -> bool:
+        return len(self.lineno) == len(self.parent)
+
+    @classmethod
+    def from_ast(cls, tree: ast.AST, max_nodes: Optional[int] = None, positions: bool = False) -> "CompactAST":
+        """Convert a parsed tree iteratively, so deep nesting can't hit the recursion limit.
+
+        Raises ValueError if the tree has more than max_nodes nodes.
+        """
+        nodes = cls()
+        position_columns = [getattr(nodes, name) for name in cls.POSITIONS] if positions else []
+        value_ids = {"": 0}
+        stack = [(tree, -1, 0, 0)]
+        while stack:
+            ast_node, parent, child_id, depth = stack.pop()
+            index = len(nodes.parent)
+            if max_nodes is not None and index >= max_nodes:
+                raise ValueError(f"Code is too large: more than {max_nodes} syntax tree nodes")
+            nodes.parent.append(parent)
+            nodes.depth.append(depth)
+            nodes.child_id.append(child_id)
+            nodes.type_id.append(node_type_id(type(ast_node).__name__))
+
+            value = terminal_value(ast_node)
+            value_id = value_ids.get(value)
+            if value_id is None:
+                value_id = value_ids[value] = len(nodes.values)
+                nodes.values.append(value)
+            nodes.value_id.append(value_id)
+            if positions:
+                lineno = getattr(ast_node, "lineno", None)
+                if lineno is None:
+                    for column in position_columns:
+                        column.append(-1)
+                else:
+                    # Nodes with a start position always carry the end position too
+                    nodes.lineno.append(lineno)
+                    nodes.col_offset.append(ast_node.col_offset)
+                    nodes.end_lineno.append(ast_node.end_lineno)
+                    nodes.end_col_offset.append(ast_node.end_col_offset)
+
+            children = list(ast.iter_child_nodes(ast_node))
+            for i in range(len(children) - 1, -1, -1):
+                stack.append((children[i], index, i, depth + 1))
+
+        # Subtree ends, propagated bottom-up
+        nodes.end = array("i", range(1, len(nodes.parent) + 1))
+        for index in range(len(nodes.parent) - 1, 0, -1):
+            parent = nodes.parent[index]
+            if nodes.end[index] > nodes.end[parent]:
+                nodes.end[parent] = nodes.end[index]
+        return nodes
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def is_terminal(self, index: int) -> bool:
+        return self.value_id[index] != 0
+
+    def children(self, index: int) -> Iterator[int]:
+        child = index + 1
+        while child < self.end[index]:
+            yield child
+            child = self.end[child]
+
+    def node_lines(self, line_offset: int = 0) -> array:
+        """Source line of every node, inherited from the nearest ancestor for nodes without one.
+
+        line_offset is subtracted, e.g. 1 for a snippet that was parsed wrapped in a function.
+        """
+        if not self.has_positions:
+            raise ValueError("CompactAST was built without positions")
+        lines = array("i", self.lineno)
+        for index in range(len(lines)):
+            if lines[index] < 0:
+                parent = self.parent[index]
+                lines[index] = lines[parent] if parent >= 0 else -1
+            elif line_offset:
+                lines[index] -= line_offset
+        return lines
+
+    def covered_roots(self, start: Tuple[int, int], stop: Tuple[int, int]) -> List[int]:
+        """Outermost nodes whose source span lies within [start, stop), as (line, byte column)"""
+        if not self.has_positions:
+            raise ValueError("CompactAST was built without positions")
+        roots = []
+        index = 0
+        while index < len(self.parent):
+            if self.lineno[index] < 0:
+                # No span of its own (module, arguments, operators), look inside
+                index += 1
+                continue
+            node_start = (self.lineno[index], self.col_offset[index])
+            node_stop = (self.end_lineno[index], self.end_col_offset[index])
+            if start <= node_start and node_stop <= stop:
+                roots.append(index)
+                index = self.end[index]
+            elif node_start < stop and start < node_stop:
+                index += 1
+            else:
+                index = self.end[index]
+        return roots
+
+    def subtree(self, roots: List[int]) -> "CompactAST":
+        """Copy the subtrees at roots under a new Module root, as if they were parsed on their own"""
+        nodes = CompactAST()
+        value_ids = {0: 0}
+        columns = [name for name in self.POSITIONS if self.has_positions]
+        nodes.parent.append(-1)
+        nodes.depth.append(0)
+        nodes.child_id.append(0)
+        nodes.type_id.append(node_type_id("Module"))
+        nodes.value_id.append(0)
+        nodes.end.append(0)
+        for name in columns:
+            getattr(nodes, name).append(-1)
+
+        for child_id, root in enumerate(roots):
+            stop = self.end[root]
+            offset = len(nodes.parent) - root
+            depth_offset = self.depth[root] - 1
+            nodes.parent.append(0)
+            nodes.parent.extend(array("i", (parent + offset for parent in self.parent[root + 1:stop])))
+            nodes.depth.extend(array("i", (depth - depth_offset for depth in self.depth[root:stop])))
+            nodes.child_id.append(child_id)
+            nodes.child_id.extend(self.child_id[root + 1:stop])
+            nodes.type_id.extend(self.type_id[root:stop])
+            nodes.end.extend(array("i", (end + offset for end in self.end[root:stop])))
+            for name in columns:
+                getattr(nodes, name).extend(getattr(self, name)[root:stop])
+            for value_id in self.value_id[root:stop]:
+                new_id = value_ids.get(value_id)
+                if new_id is None:
+                    new_id = value_ids[value_id] = len(nodes.values)
+                    nodes.values.append(self.values[value_id])
+                nodes.value_id.append(new_id)
+        nodes.end[0] = len(nodes.parent)
+        return nodes
+
+def canonical_key(tree) -> str:
+    """Stable key for a parsed tree that ignores formatting, comments and positions.
+
+    Two snippets with the same key produce the same path contexts. Accepts an
+    ast tree or a CompactAST.
+    """
+    nodes = tree if isinstance(tree, CompactAST) else CompactAST.from_ast(tree)
+    digest = hashlib.blake2b(digest_size=16)
+    for column in (nodes.parent, nodes.type_id, nodes.value_id):
+        digest.update(column.tobytes())
+    digest.update(array("i", map(len, nodes.values)).tobytes())
+    digest.update("".join(nodes.values).encode("utf-8", "surrogatepass"))
+    return digest.hexdigest()
+
+def parse_file(code: str) -> ast.AST:
+    """Parse a whole file, without the snippet fallback, so positions match the source"""
+    try:
+        return ast.parse(code)
+    except RecursionError:
+        raise ValueError("Could not parse code: nested too deeply")
+    except SyntaxError as e:
+        raise ValueError(f"Could not parse code: {e}")
+
+def source_lines(code: str) -> List[str]:
+    """Split source into lines the way the tokenizer counts them, unlike str.splitlines"""
+    return re.split(r"\r\n?|\n", code)
+
+def char_column(line: str, byte_column: int) -> int:
+    """Convert an ast UTF-8 byte column on a line to a character column"""
+    return len(line.encode("utf-8")[:byte_column].decode("utf-8", "ignore"))
+
+@dataclass
+class FunctionUnit:
+    """One function or method of a file, with its source span and own tree.
+
+    Lines are 1-based and columns 0-based characters. `name` is dotted by
+    enclosing classes and functions, e.g. "Graph.bfs".
+    """
+    name: str
+    start_line: int
+    start_column: int
+    end_line: int
+    end_column: int
+    tree: "CompactAST"
+
+def split_functions(code: str, max_nodes: Optional[int] = None) -> List[FunctionUnit]:
+    """Parse a file once and cut out every function and method, nested ones included"""
+    tree = parse_file(code)
+    nodes = CompactAST.from_ast(tree, max_nodes, positions=True)
+    lines = source_lines(code)
+
+    # Same preorder as CompactAST.from_ast, so the i-th function found here is
+    # the i-th function node there
+    found = []
+    stack = [(tree, "")]
+    while stack:
+        node, scope = stack.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            name = scope + node.name
+            if not isinstance(node, ast.ClassDef):
+                found.append((name, node))
+            scope = name + "."
+        children = list(ast.iter_child_nodes(node))
+        for i in range(len(children) - 1, -1, -1):
+            stack.append((children[i], scope))
+
+    function_types = {node_type_id("FunctionDef"), node_type_id("AsyncFunctionDef")}
+    indices = [index for index in range(len(nodes)) if nodes.type_id[index] in function_types]
+    return [
+        FunctionUnit(
+            name=name,
+            start_line=node.lineno,
+            start_column=char_column(lines[node.lineno - 1], node.col_offset),
+            end_line=node.end_lineno,
+            end_column=char_column(lines[node.end_lineno - 1], node.end_col_offset),
+            tree=nodes.subtree([index])
+        )
+        for (name, node), index in zip(found, indices)
+    ]
+
+@dataclass
+class ExtractionStats:
+    """Work done extracting one snippet, reported back for metrics.
+
+    Extraction may run in a worker process, so the counts travel with the
+    result and are recorded by the serving process. parse_seconds is None for
+    snippets that arrived already parsed.
+    """
+    terminals: int = 0
+    pairs: int = 0
+    contexts: int = 0
+    visits: int = 0
+    fallback: bool = False
+    parse_seconds: Optional[float] = None
+    extract_seconds: float = 0.0
+
+@dataclass
+class ContextIds:
+    """Vocabulary ids of extracted path contexts, one entry per context.
+
+    start_nodes and end_nodes are the CompactAST indices of each context's
+    terminals, to map contexts back to source.
+    """
+    start_tokens: array
+    paths: array
+    end_tokens: array
+    start_nodes: array = field(default_factory=lambda: array("i"))
+    end_nodes: array = field(default_factory=lambda: array("i"))
+    stats: Optional[ExtractionStats] = field(default=None, compare=False)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+class CompiledVocabulary:
+    """Token and path vocabularies compiled for fused id extraction.
+
+    Path strings are parsed once into a trie keyed by (direction, node type id),
+    so extraction can look path ids up while it walks the tree instead of
+    building path strings. Each trie node is a dict of edge -> child, with the
+    path id (if any) stored under PATH_ID.
+    """
+    UP, TOP, DOWN = 0, 1, 2
+    PATH_ID = -1
+    _PATH_PART = re.compile(r"([\^_]?)\(([^()]*)\)")
+
+    def __init__(self, token_to_idx: Dict[str, int], path_to_idx: Dict[str, int], unk_token: str = "<UNK>"):
+        self.token_to_idx = token_to_idx
+        self.unk_token_index = token_to_idx[unk_token]
+        self.unk_path_index = path_to_idx[unk_token]
+        self.path_trie: Dict[int, Any] = {}
+        for path, index in path_to_idx.items():
+            edges = self._path_edges(path)
+            if edges is None:
+                continue
+            node = self.path_trie
+            for edge in edges:
+                node = node.setdefault(edge, {})
+            node[self.PATH_ID] = index
+
+    @classmethod
+    def from_vocab(cls, vocab) -> "CompiledVocabulary":
+        """Compile a VocabularyBuilder"""
+        return cls(vocab.token_to_idx, vocab.path_to_idx, vocab.unk_token)
+
+    @classmethod
+    def edge(cls, direction: int, type_id: int) -> int:
+        return type_id * 3 + direction
+
+    def _path_edges(self, path: str) -> Optional[List[int]]:
+        """Parse '(A)^(B)_(C)' into trie edges, or None if it isn't a path"""
+        parts = self._PATH_PART.findall(path)
+        if not parts or "".join(f"{sep}({name})" for sep, name in parts) != path:
+            return None
+        seps = [sep for sep, _ in parts[1:]]
+        ups = seps.count(PathContextExtractor.UP_SYMBOL)
+        if seps[:ups] != [PathContextExtractor.UP_SYMBOL] * ups or parts[0][0]:
+            return None
+        edges = [self.edge(self.UP, node_type_id(name)) for _, name in parts[:ups]]
+        edges.append(self.edge(self.TOP, node_type_id(parts[ups][1])))
+        edges.extend(self.edge(self.DOWN, node_type_id(name)) for _, name in parts[ups + 1:])
+        return edges
+
+    def token_index(self, token: str) -> int:
+        return self.token_to_idx.get(token, self.unk_token_index)
+
+@dataclass(frozen=True)
+class ContextSampling:
+    """Which valid path contexts are kept once there are more than MAX_CONTEXTS, and how much work is allowed.
+
+    "first" keeps the first contexts in file order. "reservoir" visits start
+    terminals in a shuffled order and keeps a uniform sample of every valid
+    pair seen, so long files are covered end to end. It is seeded, so the same
+    tree always gives the same contexts, and returns them in file order.
+    Either way extraction stops after max_pairs valid pairs or max_visits
+    node visits (None for no limit), which bounds latency on huge inputs.
+    """
+    mode: str = "first"
+    seed: int = 0
+    max_pairs: Optional[int] = None
+    max_visits: Optional[int] = None
+
+    MODES = ("first", "reservoir")
+
+    def __post_init__(self):
+        if self.mode not in self.MODES:
+            raise ValueError(f"Unknown sampling mode {self.mode!r}, expected one of {self.MODES}")
+
+class _ContextSampler:
+    """Per-extraction state of a ContextSampling: which slot each valid pair goes to"""
+
+    def __init__(self, sampling: ContextSampling, limit: int):
+        self.limit = limit
+        self.reservoir = sampling.mode == "reservoir"
+        self.rng = random.Random(sampling.seed)
+        self.max_pairs = sampling.max_pairs
+        self.max_visits = sampling.max_visits
+        self.kept = 0
+        self.seen = 0
+        self.visits = 0
+        self.terminals = 0
+        self.done = limit <= 0
+
+    def start_order(self, nodes: CompactAST) -> List[int]:
+        terminals = [index for index in range(len(nodes)) if nodes.value_id[index]]
+        self.terminals = len(terminals)
+        if self.reservoir:
+            self.rng.shuffle(terminals)
+        return terminals
+
+    def offer(self) -> int:
+        """Account for one more valid pair; return the slot to store it in, or -1 to drop it"""
+        self.seen += 1
+        if self.max_pairs is not None and self.seen >= self.max_pairs:
+            self.done = True
+        if self.kept < self.limit:
+            self.kept += 1
+            if self.kept == self.limit and not self.reservoir:
+                self.done = True
+            return self.kept - 1
+        slot = self.rng.randrange(self.seen)
+        return slot if slot < self.limit else -1
+
+    def add_visits(self, visits: int) -> None:
+        self.visits += visits
+        if self.max_visits is not None and self.visits >= self.max_visits:
+            self.done = True
+
+    def file_order(self, start_nodes, end_nodes) -> List[int]:
+        """Slots sorted back into file order"""
+        slots = range(self.kept)
+        if not self.reservoir:
+            return list(slots)
+        return sorted(slots, key=lambda slot: (start_nodes[slot], end_nodes[slot]))
+
 class PathContextExtractor:
     LPAREN = "("
     RPAREN = ")"
@@ -55,47 +492,233 @@ class PathContextExtractor:
     MAX_PATH_WIDTH = 2
     MAX_CONTEXTS = 200  # Maximum number of contexts to extract per method
     
-    def __init__(self):
+    def __init__(self, sampling: ContextSampling = ContextSampling()):
         self.ast_nodes: List[ASTNode] = []
+        self.sampling = sampling
     
-    def extract_path_contexts(self, code: str) -> List[PathContext]:
-        """Extract path contexts from code snippet"""
+    def parse(self, code: str) -> ast.AST:
+        """Parse code snippet, falling back to wrapping it in a function"""
+        return self.parse_snippet(code)[0]
+
+    def parse_snippet(self, code: str) -> Tuple[ast.AST, int]:
+        """Like parse, also returning how many lines the fallback wrapper added"""
         try:
-            tree = ast.parse(code)
-            return self._generate_path_contexts(tree)
+            return ast.parse(code), 0
+        except RecursionError:
+            raise ValueError("Could not parse code: nested too deeply")
         except SyntaxError:
             # Try wrapping in a function if it's a code snippet
-            wrapped_code = f"def wrapper():\n{code}"
+            wrapped_code = "def wrapper():\n" + textwrap.indent(textwrap.dedent(code), "    ")
             try:
-                tree = ast.parse(wrapped_code)
-                return self._generate_path_contexts(tree)
+                return ast.parse(wrapped_code), 1
             except SyntaxError as e:
                 raise ValueError(f"Could not parse code: {e}")
+
+    def extract_path_contexts(self, code: str) -> List[PathContext]:
+        """Extract path contexts from code snippet"""
+        return self.generate_path_contexts(self.parse(code))
+
+    def extract_path_contexts_from_tree(self, tree) -> List[Dict[str, str]]:
+        """Extract path contexts from an ast tree or CompactAST as collate-ready dicts"""
+        final = []
+        for context in self.generate_path_contexts(tree):
+            final.append({
+                "start_token": context.start_token,
+                "path": context.path,
+                "end_token": context.end_token
+            })
+        return final
+
     def extract_path_contexts_for_classification(self, code):
-        try:
-            tree = ast.parse(code)
-            contexts = self._generate_path_contexts(tree)
-            final = []
-            for context in contexts:
-                final.append({
-                    "start_token": context.start_token,
-                    "path": context.path,
-                    "end_token": context.end_token
-                })
-            return final
-        
-        except SyntaxError:
-            # Try wrapping in a function if it's a code snippet
-            wrapped_code = f"def wrapper():\n{code}"
-            try:
-                tree = ast.parse(wrapped_code)
-                return self._generate_path_contexts(tree)
-            except SyntaxError as e:
-                raise ValueError(f"Could not parse code: {e}")
+        """Extract path contexts as the dicts expected by collate_path_contexts"""
+        return self.extract_path_contexts_from_tree(self.parse(code))
 
     
-    def _generate_path_contexts(self, tree: ast.AST) -> List[PathContext]:
-        # Convert AST to our custom nodes with parent links
+    def generate_path_contexts(self, tree) -> List[PathContext]:
+        """Path contexts of an ast tree or CompactAST, in file order"""
+        nodes = tree if isinstance(tree, CompactAST) else CompactAST.from_ast(tree)
+        values = nodes.values
+        sampler = _ContextSampler(self.sampling, self.MAX_CONTEXTS)
+        
+        # Generate path contexts in the same (start, end) order as the all-pairs scan,
+        # but only visiting end nodes that can satisfy the length and width limits
+        kept: List[Tuple[int, int, str]] = []
+        for start in sampler.start_order(nodes):
+            if sampler.done:
+                break
+            for end, path in self._generate_paths_from(nodes, start, sampler):
+                slot = sampler.offer()
+                if slot == len(kept):
+                    kept.append((start, end, path))
+                elif slot >= 0:
+                    kept[slot] = (start, end, path)
+                if sampler.done:
+                    break
+        
+        starts = [start for start, _, _ in kept]
+        ends = [end for _, end, _ in kept]
+        return [
+            PathContext(
+                start_token=values[nodes.value_id[kept[slot][0]]],
+                path=kept[slot][2],
+                end_token=values[nodes.value_id[kept[slot][1]]]
+            )
+            for slot in sampler.file_order(starts, ends)
+        ]
+
+    def _generate_paths_from(self, nodes: CompactAST, start: int, sampler: _ContextSampler) -> Iterator[Tuple[int, str]]:
+        """Yield (end, path) for every valid path to a later terminal, in file order.
+
+        Each ancestor of start within MAX_PATH_LENGTH is tried as the common
+        ancestor. Below it, only the next MAX_PATH_WIDTH siblings of the branch
+        holding start can satisfy the width limit (earlier siblings come before
+        start in file order), and they are only walked down as far as the
+        remaining path length allows. The common ancestor is known by
+        construction, so no per-pair ancestor search is needed. Stops early
+        once the sampler's work budget is spent.
+        """
+        up_path = ""
+        node, branch, distance = start, -1, 0
+        while node >= 0 and distance < self.MAX_PATH_LENGTH:
+            prefix = f"{up_path}{self.LPAREN}{NODE_TYPES[nodes.type_id[node]]}{self.RPAREN}"
+            if branch < 0:
+                # Paths down into start's own subtree have no width limit
+                child, width = node + 1, len(nodes)
+            else:
+                child, width = nodes.end[branch], self.MAX_PATH_WIDTH
+            
+            remaining = self.MAX_PATH_LENGTH - distance - 1
+            stop = nodes.end[node]
+            while child < stop and width > 0:
+                yield from self._generate_downward_paths(nodes, child, prefix, remaining, sampler)
+                if sampler.done:
+                    return
+                child = nodes.end[child]
+                width -= 1
+            
+            up_path = prefix + self.UP_SYMBOL
+            branch, node = node, nodes.parent[node]
+            distance += 1
+
+    def _generate_downward_paths(self, nodes: CompactAST, root: int, prefix: str, depth_budget: int,
+                                 sampler: _ContextSampler) -> Iterator[Tuple[int, str]]:
+        """Yield (terminal, path) for terminals at most depth_budget levels below root, in file order"""
+        base = nodes.depth[root]
+        parts: List[str] = []
+        node, stop = root, nodes.end[root]
+        visits = 0
+        while node < stop:
+            visits += 1
+            level = nodes.depth[node] - base
+            if level > depth_budget:
+                # Skip the whole subtree, it is too deep
+                node = nodes.end[node]
+                continue
+            del parts[level:]
+            parts.append(f"{self.DOWN_SYMBOL}{self.LPAREN}{NODE_TYPES[nodes.type_id[node]]}{self.RPAREN}")
+            if nodes.value_id[node]:
+                yield node, prefix + "".join(parts)
+                if sampler.done:
+                    break
+            node += 1
+        sampler.add_visits(visits)
+
+    def extract_context_ids(self, tree, vocab: CompiledVocabulary) -> ContextIds:
+        """Fused extraction straight to vocabulary ids.
+
+        Produces the same contexts as generate_path_contexts, but looks each path
+        up in the compiled path trie while walking the tree and writes ids into
+        preallocated buffers, without building path strings or dicts.
+        """
+        nodes = tree if isinstance(tree, CompactAST) else CompactAST.from_ast(tree)
+        parent, depth, end = nodes.parent, nodes.depth, nodes.end
+        type_id, value_id = nodes.type_id, nodes.value_id
+        token_ids = [vocab.token_index(value) for value in nodes.values]
+        unk_path = vocab.unk_path_index
+        path_id_key = vocab.PATH_ID
+        up_edge, top_edge, down_edge = vocab.UP, vocab.TOP, vocab.DOWN
+
+        limit = self.MAX_CONTEXTS
+        sampler = _ContextSampler(self.sampling, limit)
+        offer = sampler.offer
+        start_buffer = array("q", bytes(8 * limit))
+        path_buffer = array("q", bytes(8 * limit))
+        end_buffer = array("q", bytes(8 * limit))
+        start_nodes = array("i", bytes(4 * limit))
+        end_nodes = array("i", bytes(4 * limit))
+
+        for start in sampler.start_order(nodes):
+            if sampler.done:
+                break
+            start_token = token_ids[value_id[start]]
+
+            # Same walk as _generate_paths_from, carrying trie cursors instead of strings;
+            # a None cursor means the path is already outside the vocabulary
+            up_cursor = vocab.path_trie
+            node, branch, distance = start, -1, 0
+            while node >= 0 and distance < self.MAX_PATH_LENGTH and not sampler.done:
+                node_type = type_id[node] * 3
+                top_cursor = up_cursor.get(node_type + top_edge) if up_cursor is not None else None
+                if branch < 0:
+                    child, width = node + 1, len(nodes)
+                else:
+                    child, width = end[branch], self.MAX_PATH_WIDTH
+
+                remaining = self.MAX_PATH_LENGTH - distance - 1
+                stop = end[node]
+                while child < stop and width > 0:
+                    base = depth[child]
+                    cursors = [top_cursor]
+                    scan, scan_stop = child, end[child]
+                    visits = 0
+                    while scan < scan_stop:
+                        visits += 1
+                        level = depth[scan] - base
+                        if level > remaining:
+                            scan = end[scan]
+                            continue
+                        del cursors[level + 1:]
+                        cursor = cursors[level]
+                        if cursor is not None:
+                            cursor = cursor.get(type_id[scan] * 3 + down_edge)
+                        cursors.append(cursor)
+                        if value_id[scan]:
+                            slot = offer()
+                            if slot >= 0:
+                                start_buffer[slot] = start_token
+                                path_buffer[slot] = cursor.get(path_id_key, unk_path) if cursor is not None else unk_path
+                                end_buffer[slot] = token_ids[value_id[scan]]
+                                start_nodes[slot] = start
+                                end_nodes[slot] = scan
+                            if sampler.done:
+                                break
+                        scan += 1
+                    if sampler.done:
+                        break
+                    sampler.add_visits(visits)
+                    if sampler.done:
+                        break
+                    child = end[child]
+                    width -= 1
+
+                if up_cursor is not None:
+                    up_cursor = up_cursor.get(node_type + up_edge)
+                branch, node = node, parent[node]
+                distance += 1
+
+        order = sampler.file_order(start_nodes, end_nodes)
+        if order != list(range(len(order))):
+            columns = (start_buffer, path_buffer, end_buffer, start_nodes, end_nodes)
+            start_buffer, path_buffer, end_buffer, start_nodes, end_nodes = (
+                array(column.typecode, (column[slot] for slot in order)) for column in columns
+            )
+        count = sampler.kept
+        del start_buffer[count:], path_buffer[count:], end_buffer[count:], start_nodes[count:], end_nodes[count:]
+        stats = ExtractionStats(terminals=sampler.terminals, pairs=sampler.seen, contexts=count, visits=sampler.visits)
+        return ContextIds(start_buffer, path_buffer, end_buffer, start_nodes, end_nodes, stats)
+
+    def _generate_path_contexts_reference(self, tree: ast.AST) -> List[PathContext]:
+        """Original all-pairs extraction, the reference of tests/test_extraction_equivalence.py"""
         self.ast_nodes = []
         self._convert_ast_to_nodes(tree)
         
@@ -180,12 +803,15 @@ class PathContextExtractor:
         return "".join(path_parts)
     
 
-def load_data_and_extract_contexts(json_filepath: str) -> Dict[int, List[PathContext]]:
-    """Load data from JSON file and extract path contexts for each code snippet"""
+def load_data_and_extract_contexts(json_filepath: str, sampling: ContextSampling = ContextSampling()) -> Dict[int, List[PathContext]]:
+    """Load data from JSON file and extract path contexts for each code snippet.
+
+    Train with the same sampling the model will be served with.
+    """
     with open(json_filepath, 'r') as file:
         data = json.load(file)
     
-    extractor = PathContextExtractor()
+    extractor = PathContextExtractor(sampling)
     contexts_by_code_id = {}
     
     for item in data:
@@ -198,9 +824,13 @@ def load_data_and_extract_contexts(json_filepath: str) -> Dict[int, List[PathCon
     
     return contexts_by_code_id
 
-def transform_to_training_data(json_filepath: str, output_filepath: str) -> None:
-    """Transform data from JSON file into training data structure and write to output file"""
-    contexts_by_code_id = load_data_and_extract_contexts(json_filepath)
+def transform_to_training_data(json_filepath: str, output_filepath: str, sampling: ContextSampling = ContextSampling()) -> None:
+    """Transform data from JSON file into training data structure and write to output file.
+
+    Holds the whole dataset in memory and extracts serially, so it only suits
+    small datasets; training_data.py builds sharded output in parallel.
+    """
+    contexts_by_code_id = load_data_and_extract_contexts(json_filepath, sampling)
     
     training_data = []
     for code_id, contexts in contexts_by_code_id.items():
@@ -0,0 +1,200 @@
+import torch
+from typing import List, Dict
+from sklearn.metrics.pairwise import cosine_similarity
+import numpy as np
+from Embedding import CodeEmbedding, VocabularyBuilder, collate_path_contexts
+
+
+def compare_code_vectors(
+    context_list: List[List[Dict]], 
+    model: CodeEmbedding,
+    vocab_builder: VocabularyBuilder,
+    visualize: bool = True
+) -> Dict:
+    """
+    Compare multiple code snippets using their vector representations
+    Args:
+        context_list: List of context lists, one for each code snippet
+        model: Trained CodeEmbedding model
+        vocab_builder: Vocabulary builder instance
+        visualize: Whether to show visualization plots
+    Returns:
+        Dictionary containing vectors and similarity matrix
+    """
+    # Get embeddings for each code snippet
+    vectors = []
+    for contexts in context_list:
+        batch_data = collate_path_contexts([contexts], vocab_builder)
+        with torch.no_grad():
+            code_vector, _ = model(
+                batch_data['start_tokens'],
+                batch_data['paths'],
+                batch_data['end_tokens'],
+                batch_data['mask']
+            )
+            vectors.append(code_vector[0].numpy())
+    
+    vectors = np.stack(vectors)
+    
+    # Calculate similarity matrix
+    similarity_matrix = cosine_similarity(vectors)
+    
+    if visualize:
+        # Plotting libraries are only needed here, so load them on demand
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
+        # Plot vectors
+        plt.figure(figsize=(10, 6))
+        plt.imshow(vectors, aspect='auto', cmap='viridis')
+        plt.colorbar()
+        plt.title("Code Vectors Comparison")
+        plt.xlabel("Embedding Dimension")
+        plt.ylabel("Code Snippets")
+        plt.show()
+
+        # Plot similarity matrix
+        plt.figure(figsize=(8, 6))
+        sns.heatmap(similarity_matrix, 
+                   annot=True, 
+                   cmap='coolwarm',
+                   xticklabels=[f"Code {i+1}" for i in range(len(context_list))],
+                   yticklabels=[f"Code {i+1}" for i in range(len(context_list))])
+        plt.title("Cosine Similarity Matrix")
+        plt.show()
+    
+    return {
+        'vectors': vectors,
+        'similarity_matrix': similarity_matrix
+    }
+
+# Example usage:
+# if __name__ == "__main__":
+ 
+
+# path_contexts = [
+#     {'start_token': 'z', 'path': '(Name)^(Assign)_(BinOp)_(Name)', 'end_token': 'x'},
+#     {'start_token': 'z', 'path': '(Name)^(Assign)_(BinOp)_(Name)', 'end_token': 'y'},
+#     {'start_token': 'z', 'path': '(Name)^(Assign)^(FunctionDef)_(Return)_(BinOp)_(Name)', 'end_token': 'z'},
+#     {'start_token': 'z', 'path': '(Name)^(Assign)^(FunctionDef)_(Return)_(BinOp)_(Constant)', 'end_token': '2'},
+#     {'start_token': 'x', 'path': '(Name)^(BinOp)_(Name)', 'end_token': 'y'},
+#     {'start_token': 'x', 'path': '(Name)^(BinOp)^(Assign)^(FunctionDef)_(Return)_(BinOp)_(Name)', 'end_token': 'z'},
+#     {'start_token': 'x', 'path': '(Name)^(BinOp)^(Assign)^(FunctionDef)_(Return)_(BinOp)_(Constant)', 'end_token': '2'},
+#     {'start_token': 'y', 'path': '(Name)^(BinOp)^(Assign)^(FunctionDef)_(Return)_(BinOp)_(Name)', 'end_token': 'z'},
+#     {'start_token': 'y', 'path': '(Name)^(BinOp)^(Assign)^(FunctionDef)_(Return)_(BinOp)_(Constant)', 'end_token': '2'},
+#     {'start_token': 'z', 'path': '(Name)^(BinOp)_(Constant)', 'end_token': '2'}
+# ]
+
+# # Create vocabulary
+# vocab_builder = VocabularyBuilder()
+# vocab_builder.build_vocab(path_contexts)
+
+# # Initialize model
+# model = CodeEmbedding(
+#     token_vocab_size=len(vocab_builder.token_to_idx),
+#     path_vocab_size=len(vocab_builder.path_to_idx),
+#     embedding_dim=128
+# )
+
+# # Prepare batch
+# batch_data = collate_path_contexts([path_contexts], vocab_builder)
+
+# # Get code vectors
+# code_vectors, attention_weights = model(
+#     batch_data['start_tokens'],
+#     batch_data['paths'],
+#     batch_data['end_tokens'],
+#     batch_data['mask']
+# )
+
+# # # Convert code vectors to numpy array for visualization
+# code_vectors_np = code_vectors.detach().numpy()
+
+# # Plot the code vectors
+# plt.figure(figsize=(10, 6))
+# plt.imshow(code_vectors_np, aspect='auto', cmap='viridis')
+# plt.colorbar()
+# plt.title("Code Vectors")
+# plt.xlabel("Embedding Dimension")
+# plt.ylabel("Code Snippets")
+# plt.show()
+
+# # Function to visualize attention weights
+# def visualize_attention(attention_weights, context_count):
+#     print("Attention Weights Shape:", attention_weights.shape)
+#     print("Context Count:", context_count)
+#     plt.figure(figsize=(10, 4))
+#     plt.bar(range(context_count), attention_weights.cpu().detach().numpy()[:context_count])
+#     plt.title("Attention Weights")
+#     plt.xlabel("Context Index")
+#     plt.ylabel("Weight")
+#     plt.show()
+
+# # Visualize attention weights for the first example in the batch
+# attention_weights_example = attention_weights[0]
+# context_count_example = batch_data['mask'][0].sum().item()
+# visualize_attention(attention_weights_example, context_count_example)
+# from sklearn.metrics.pairwise import cosine_similarity
+# import seaborn as sns
+
+# # Calculate cosine similarity
+# cos_sim = cosine_similarity(code_vectors_np)
+
+# # Plot cosine similarity matrix
+# plt.figure(figsize=(10, 8))
+# sns.heatmap(cos_sim, annot=True, cmap='coolwarm', xticklabels=False, yticklabels=False)
+# plt.title("Cosine Similarity Between Code Vectors")
+# plt.show()
+
+
+
+
+
+# Example diverse path contexts from different pieces of code
+# path_contexts_1 = [
+#     {'start_token': 'a', 'path': '(Name)^(Assign)_(BinOp)_(Name)', 'end_token': 'b'},
+#     {'start_token': 'a', 'path': '(Name)^(Assign)_(BinOp)_(Name)', 'end_token': 'c'}
+# ]
+
+# path_contexts_2 = [
+#     {'start_token': 'a', 'path': '(Name)^(Assign)_(BinOp)_(Name)', 'end_token': 'b'},
+#     {'start_token': 'a', 'path': '(Name)^(Assign)_(BinOp)_(Name)', 'end_token': 'c'}
+# ]
+
+# # Combine path contexts from different pieces of code
+# combined_path_contexts = [path_contexts_1, path_contexts_2]
+
+# # Create vocabulary
+# vocab_builder = VocabularyBuilder()
+# for contexts in combined_path_contexts:
+#     vocab_builder.build_vocab(contexts)
+
+# # Initialize model
+# model = CodeEmbedding(
+#     token_vocab_size=len(vocab_builder.token_to_idx),
+#     path_vocab_size=len(vocab_builder.path_to_idx),
+#     embedding_dim=128
+# )
+
+# # Prepare batch
+# batch_data = collate_path_contexts(combined_path_contexts, vocab_builder)
+
+# # Get code vectors
+# code_vectors, attention_weights = model(
+#     batch_data['start_tokens'],
+#     batch_data['paths'],
+#     batch_data['end_tokens'],
+#     batch_data['mask']
+# )
+
+# # Convert code vectors to numpy array for visualization
+# code_vectors_np = code_vectors.detach().numpy()
+
+# # Calculate cosine similarity
+# cos_sim = cosine_similarity(code_vectors_np)
+
+# # Plot cosine similarity matrix
+# plt.figure(figsize=(10, 8))
+# sns.heatmap(cos_sim, annot=True, cmap='coolwarm', xticklabels=False, yticklabels=False)
+# plt.title("Cosine Similarity Between Code Vectors")
+# plt.show()
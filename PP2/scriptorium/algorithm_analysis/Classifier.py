@@ -1,5 +1,9 @@
+import copy
+import warnings
+import torch
 import torch.nn as nn
-from Embedding import CodeEmbedding
+from typing import Dict
+from Embedding import CodeEmbedding, Int8ProjectedCodeEmbedding, ProjectedCodeEmbedding
 
 class ImprovedCodeClassifier(nn.Module):
     def __init__(
@@ -42,6 +46,11 @@ class ImprovedCodeClassifier(nn.Module):
         )
         
     def forward(self, start_tokens, paths, end_tokens, mask=None):
+        logits, attention_weights, _ = self.classify(start_tokens, paths, end_tokens, mask)
+        return logits, attention_weights
+
+    def classify(self, start_tokens, paths, end_tokens, mask=None):
+        """Single forward pass returning logits, attention weights and the code vector"""
         code_vector, attention_weights = self.code_embedding(
             start_tokens, paths, end_tokens, mask
         )
@@ -52,7 +61,78 @@ class ImprovedCodeClassifier(nn.Module):
         # Get class logits
         logits = self.classifier(transformed.squeeze(1))
         
-        return logits, attention_weights
+        return logits, attention_weights, code_vector
+
+    def optimized_for_inference(self) -> "ImprovedCodeClassifier":
+        """Return an eval-only copy with the embedding projection precomputed
+        and the transformer layers folded into dense operations.
+
+        Check the copy against this model with max_output_difference before use.
+        """
+        optimized = copy.deepcopy(self).eval()
+        optimized.code_embedding = ProjectedCodeEmbedding(self.code_embedding)
+
+        # The transformer only ever sees one token per example
+        folded = [FoldedEncoderLayer(layer) for layer in self.transformer.layers]
+        if self.transformer.norm is not None:
+            folded.append(copy.deepcopy(self.transformer.norm))
+        optimized.transformer = nn.Sequential(*folded)
+        return optimized
+
+    def quantized_for_inference(self, quantize_embeddings: bool = False) -> "ImprovedCodeClassifier":
+        """Return an optimized copy with int8 dynamically quantized Linear layers.
+
+        With quantize_embeddings the projected embedding tables are stored as
+        int8 too. Quantization is lossy, so check the copy's accuracy (see
+        quantization_gate.py) before serving it.
+        """
+        optimized = self.optimized_for_inference()
+        if quantize_embeddings:
+            optimized.code_embedding = Int8ProjectedCodeEmbedding(self.code_embedding)
+        with warnings.catch_warnings():
+            # torch.ao.quantization is deprecated in favour of torchao, but still works
+            warnings.simplefilter('ignore', DeprecationWarning)
+            warnings.simplefilter('ignore', UserWarning)
+            return torch.ao.quantization.quantize_dynamic(optimized, {nn.Linear}, dtype=torch.qint8)
+
+class FoldedEncoderLayer(nn.Module):
+    """TransformerEncoderLayer specialised to sequences of length one.
+
+    With a single token, softmax attention puts all weight on that token, so
+    self-attention is just out_proj(v_proj(x)): one affine map. The Q/K
+    projections, softmax and head splitting drop out, and for post-norm layers
+    the residual connection is folded into the same weight.
+    """
+    def __init__(self, layer: nn.TransformerEncoderLayer):
+        super().__init__()
+        attention = layer.self_attn
+        dim = attention.embed_dim
+        self.norm_first = layer.norm_first
+
+        with torch.no_grad():
+            w_v = attention.in_proj_weight[2 * dim:]
+            b_v = attention.in_proj_bias[2 * dim:]
+            w_o, b_o = attention.out_proj.weight, attention.out_proj.bias
+            weight = w_o @ w_v
+            if not self.norm_first:
+                weight += torch.eye(dim, dtype=weight.dtype, device=weight.device)
+            self.attention = nn.Linear(dim, dim)
+            self.attention.weight.copy_(weight)
+            self.attention.bias.copy_(w_o @ b_v + b_o)
+
+        self.linear1 = copy.deepcopy(layer.linear1)
+        self.linear2 = copy.deepcopy(layer.linear2)
+        self.norm1 = copy.deepcopy(layer.norm1)
+        self.norm2 = copy.deepcopy(layer.norm2)
+        self.activation = layer.activation
+
+    def forward(self, x):
+        if self.norm_first:
+            x = x + self.attention(self.norm1(x))
+            return x + self.linear2(self.activation(self.linear1(self.norm2(x))))
+
+        x = self.norm1(self.attention(x))
+        return self.norm2(x + self.linear2(self.activation(self.linear1(x))))
 
 class ResidualBlock(nn.Module):
     def __init__(self, dim):
@@ -67,3 +147,30 @@ class ResidualBlock(nn.Module):
         
     def forward(self, x):
         return x + self.layers(x)
+
+
+def make_probe_batch(
+    token_vocab_size: int,
+    path_vocab_size: int,
+    batch_size: int = 16,
+    max_contexts: int = 200,
+    seed: int = 0
+) -> Dict[str, torch.Tensor]:
+    """Random but reproducible batch of ids with ragged lengths, for parity checks"""
+    generator = torch.Generator().manual_seed(seed)
+    shape = (batch_size, max_contexts)
+    lengths = torch.randint(1, max_contexts + 1, (batch_size, 1), generator=generator)
+    return {
+        'start_tokens': torch.randint(0, token_vocab_size, shape, generator=generator),
+        'paths': torch.randint(0, path_vocab_size, shape, generator=generator),
+        'end_tokens': torch.randint(0, token_vocab_size, shape, generator=generator),
+        'mask': torch.arange(max_contexts) < lengths
+    }
+
+def max_output_difference(reference: nn.Module, candidate: nn.Module, batch: Dict[str, torch.Tensor]) -> float:
+    """Largest absolute difference in logits, attention weights and code vectors"""
+    args = (batch['start_tokens'], batch['paths'], batch['end_tokens'], batch['mask'])
+    with torch.no_grad():
+        expected = reference.classify(*args)
+        actual = candidate.classify(*args)
+    return max((a - e).abs().max().item() for a, e in zip(actual, expected))
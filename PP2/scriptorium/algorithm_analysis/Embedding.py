@@ -3,10 +3,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 from typing import List, Dict
 from dataclasses import dataclass
-import matplotlib.pyplot as plt
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
-import seaborn as sns
 
 @dataclass
 class PathContext:
@@ -74,6 +71,76 @@ class CodeEmbedding(nn.Module):
         
         return code_vector, attention_weights
 
+class ProjectedCodeEmbedding(nn.Module):
+    """Inference-only CodeEmbedding with context_transform folded into the tables.
+
+    context_transform's Linear(3 * d, d) splits into three d x d blocks acting on
+    the start, path and end embeddings, so every vocabulary row can be projected
+    once up front. Each context then costs three gathers, an add and a tanh:
+    combined = tanh(S[start] + P[path] + E[end]), with the bias folded into P.
+    Dropout is the identity at inference time, so it is dropped.
+    """
+    def __init__(self, embedding: CodeEmbedding):
+        super().__init__()
+        linear = embedding.context_transform[0]
+        embedding_dim = embedding.token_embedding.embedding_dim
+        with torch.no_grad():
+            w_start, w_path, w_end = linear.weight.split(embedding_dim, dim=1)
+            token_weight = embedding.token_embedding.weight
+            self.register_buffer('start_table', token_weight @ w_start.T)
+            self.register_buffer('path_table', torch.addmm(linear.bias, embedding.path_embedding.weight, w_path.T))
+            self.register_buffer('end_table', token_weight @ w_end.T)
+            self.register_buffer('attention', embedding.attention.detach().clone())
+
+    def forward(self,
+                start_tokens: torch.Tensor,    # Shape: [batch_size, max_contexts]
+                paths: torch.Tensor,           # Shape: [batch_size, max_contexts]
+                end_tokens: torch.Tensor,      # Shape: [batch_size, max_contexts]
+                mask: torch.Tensor = None):    # Shape: [batch_size, max_contexts]
+        combined = torch.tanh(
+            self._lookup(start_tokens, 'start')
+            + self._lookup(paths, 'path')
+            + self._lookup(end_tokens, 'end')
+        )  # [batch_size, max_contexts, embed_dim]
+        
+        # Calculate attention weights
+        attention_weights = torch.matmul(combined, self.attention)  # [batch_size, max_contexts]
+        
+        if mask is not None:
+            attention_weights = attention_weights.masked_fill(~mask, float('-inf'))
+            
+        attention_weights = F.softmax(attention_weights, dim=-1)  # [batch_size, max_contexts]
+        
+        # Apply attention to get final code vector
+        code_vector = torch.sum(
+            combined * attention_weights.unsqueeze(-1),
+            dim=1
+        )  # [batch_size, embed_dim]
+        
+        return code_vector, attention_weights
+
+    def _lookup(self, ids: torch.Tensor, table: str) -> torch.Tensor:
+        return F.embedding(ids, getattr(self, f'{table}_table'))
+
+class Int8ProjectedCodeEmbedding(ProjectedCodeEmbedding):
+    """ProjectedCodeEmbedding with its tables stored as symmetric per-row int8.
+
+    Rows are dequantized with their own scale after the gather, so only the
+    looked-up rows are ever expanded back to float.
+    """
+    def __init__(self, embedding: CodeEmbedding):
+        super().__init__(embedding)
+        with torch.no_grad():
+            for table in ('start', 'path', 'end'):
+                weight = getattr(self, f'{table}_table')
+                scale = weight.abs().amax(dim=1).clamp(min=1e-12) / 127
+                self.register_buffer(f'{table}_table', torch.round(weight / scale.unsqueeze(1)).to(torch.int8))
+                self.register_buffer(f'{table}_scale', scale)
+
+    def _lookup(self, ids: torch.Tensor, table: str) -> torch.Tensor:
+        rows = getattr(self, f'{table}_table')[ids].to(torch.float32)
+        return rows * getattr(self, f'{table}_scale')[ids].unsqueeze(-1)
+
 class VocabularyBuilder:
     def __init__(self, pad_token="<PAD>", unk_token="<UNK>"):
         self.pad_token = pad_token
@@ -107,217 +174,76 @@ def collate_path_contexts(
     vocab: VocabularyBuilder,
     max_contexts: int = 200
 ) -> Dict[str, torch.Tensor]:
-    batch_size = len(path_contexts)
-    
-    # Initialize tensors
-    start_tokens = torch.zeros(batch_size, max_contexts, dtype=torch.long)
-    paths = torch.zeros(batch_size, max_contexts, dtype=torch.long)
-    end_tokens = torch.zeros(batch_size, max_contexts, dtype=torch.long)
-    mask = torch.zeros(batch_size, max_contexts, dtype=torch.bool)
-    
-    # Fill tensors
-    for i, contexts in enumerate(path_contexts):
-        contexts = contexts[:max_contexts]  # Limit number of contexts
-        for j, context in enumerate(contexts):
-            start_tokens[i, j] = vocab.get_token_index(context["start_token"])
-            paths[i, j] = vocab.get_path_index(context["path"])
-            end_tokens[i, j] = vocab.get_token_index(context["end_token"])
-            mask[i, j] = True
-            
-    return {
-        'start_tokens': start_tokens,
-        'paths': paths,
-        'end_tokens': end_tokens,
-        'mask': mask
-    }
-
+    """Collate path context dicts into padded id tensors.
 
-def compare_code_vectors(
-    context_list: List[List[Dict]], 
-    model: CodeEmbedding,
-    vocab_builder: VocabularyBuilder,
-    visualize: bool = True
-) -> Dict:
+    Vocabulary lookups are done in one pass over the whole batch, and tensors
+    are padded only to the longest example (capped at max_contexts).
     """
-    Compare multiple code snippets using their vector representations
-    Args:
-        context_list: List of context lists, one for each code snippet
-        model: Trained CodeEmbedding model
-        vocab_builder: Vocabulary builder instance
-        visualize: Whether to show visualization plots
-    Returns:
-        Dictionary containing vectors and similarity matrix
+    contexts = [example[:max_contexts] for example in path_contexts]
+    flat = [context for example in contexts for context in example]
+    lengths = np.array([len(example) for example in contexts], dtype=np.int64)
+
+    token_to_idx, path_to_idx = vocab.token_to_idx, vocab.path_to_idx
+    unk_token = token_to_idx[vocab.unk_token]
+    unk_path = path_to_idx[vocab.unk_token]
+    columns = [
+        np.fromiter((token_to_idx.get(c["start_token"], unk_token) for c in flat), dtype=np.int64, count=len(flat)),
+        np.fromiter((path_to_idx.get(c["path"], unk_path) for c in flat), dtype=np.int64, count=len(flat)),
+        np.fromiter((token_to_idx.get(c["end_token"], unk_token) for c in flat), dtype=np.int64, count=len(flat)),
+    ]
+    return _pad_batch(columns, lengths)
+
+def collate_context_ids(
+    context_ids: List,
+    max_contexts: int = 200
+) -> Dict[str, torch.Tensor]:
+    """Collate ContextIds from PathContextExtractor.extract_context_ids.
+
+    Ids are already vocabulary indices, so the extraction buffers are
+    concatenated as-is and padded to the longest example (capped at max_contexts).
     """
-    # Get embeddings for each code snippet
-    vectors = []
-    for contexts in context_list:
-        batch_data = collate_path_contexts([contexts], vocab_builder)
-        with torch.no_grad():
-            code_vector, _ = model(
-                batch_data['start_tokens'],
-                batch_data['paths'],
-                batch_data['end_tokens'],
-                batch_data['mask']
-            )
-            vectors.append(code_vector[0].numpy())
-    
-    vectors = np.stack(vectors)
-    
-    # Calculate similarity matrix
-    similarity_matrix = cosine_similarity(vectors)
-    
-    if visualize:
-        # Plot vectors
-        plt.figure(figsize=(10, 6))
-        plt.imshow(vectors, aspect='auto', cmap='viridis')
-        plt.colorbar()
-        plt.title("Code Vectors Comparison")
-        plt.xlabel("Embedding Dimension")
-        plt.ylabel("Code Snippets")
-        plt.show()
+    lengths = np.array([min(len(contexts), max_contexts) for contexts in context_ids], dtype=np.int64)
+    columns = [
+        np.concatenate([
+            np.frombuffer(getattr(contexts, field), dtype=np.int64, count=n)
+            for contexts, n in zip(context_ids, lengths)
+        ]) if len(context_ids) else np.zeros(0, dtype=np.int64)
+        for field in ('start_tokens', 'paths', 'end_tokens')
+    ]
+    return _pad_batch(columns, lengths)
+
+def _pad_batch(columns: List[np.ndarray], lengths: np.ndarray) -> Dict[str, torch.Tensor]:
+    """Scatter flat per-context id columns into zero-padded [batch, longest] tensors"""
+    batch_size = len(lengths)
+    # Keep at least one (masked) slot so empty examples behave as before
+    width = max(int(lengths.max(initial=0)), 1)
+    rows = np.repeat(np.arange(batch_size), lengths)
+    cols = np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    tensors = []
+    for column in columns:
+        padded = np.zeros((batch_size, width), dtype=np.int64)
+        padded[rows, cols] = column
+        tensors.append(torch.from_numpy(padded))
 
-        # Plot similarity matrix
-        plt.figure(figsize=(8, 6))
-        sns.heatmap(similarity_matrix, 
-                   annot=True, 
-                   cmap='coolwarm',
-                   xticklabels=[f"Code {i+1}" for i in range(len(context_list))],
-                   yticklabels=[f"Code {i+1}" for i in range(len(context_list))])
-        plt.title("Cosine Similarity Matrix")
-        plt.show()
-    
     return {
-        'vectors': vectors,
-        'similarity_matrix': similarity_matrix
+        'start_tokens': tensors[0],
+        'paths': tensors[1],
+        'end_tokens': tensors[2],
+        'mask': torch.from_numpy(np.arange(width) < lengths[:, None])
     }
 
-# Example usage:
-# if __name__ == "__main__":
- 
-
-# path_contexts = [
-#     {'start_token': 'z', 'path': '(Name)^(Assign)_(BinOp)_(Name)', 'end_token': 'x'},
-#     {'start_token': 'z', 'path': '(Name)^(Assign)_(BinOp)_(Name)', 'end_token': 'y'},
-#     {'start_token': 'z', 'path': '(Name)^(Assign)^(FunctionDef)_(Return)_(BinOp)_(Name)', 'end_token': 'z'},
-#     {'start_token': 'z', 'path': '(Name)^(Assign)^(FunctionDef)_(Return)_(BinOp)_(Constant)', 'end_token': '2'},
-#     {'start_token': 'x', 'path': '(Name)^(BinOp)_(Name)', 'end_token': 'y'},
-#     {'start_token': 'x', 'path': '(Name)^(BinOp)^(Assign)^(FunctionDef)_(Return)_(BinOp)_(Name)', 'end_token': 'z'},
-#     {'start_token': 'x', 'path': '(Name)^(BinOp)^(Assign)^(FunctionDef)_(Return)_(BinOp)_(Constant)', 'end_token': '2'},
-#     {'start_token': 'y', 'path': '(Name)^(BinOp)^(Assign)^(FunctionDef)_(Return)_(BinOp)_(Name)', 'end_token': 'z'},
-#     {'start_token': 'y', 'path': '(Name)^(BinOp)^(Assign)^(FunctionDef)_(Return)_(BinOp)_(Constant)', 'end_token': '2'},
-#     {'start_token': 'z', 'path': '(Name)^(BinOp)_(Constant)', 'end_token': '2'}
-# ]
-
-# # Create vocabulary
-# vocab_builder = VocabularyBuilder()
-# vocab_builder.build_vocab(path_contexts)
-
-# # Initialize model
-# model = CodeEmbedding(
-#     token_vocab_size=len(vocab_builder.token_to_idx),
-#     path_vocab_size=len(vocab_builder.path_to_idx),
-#     embedding_dim=128
-# )
-
-# # Prepare batch
-# batch_data = collate_path_contexts([path_contexts], vocab_builder)
-
-# # Get code vectors
-# code_vectors, attention_weights = model(
-#     batch_data['start_tokens'],
-#     batch_data['paths'],
-#     batch_data['end_tokens'],
-#     batch_data['mask']
-# )
-
-# # # Convert code vectors to numpy array for visualization
-# code_vectors_np = code_vectors.detach().numpy()
+def bucket_by_length(lengths: List[int], bucket_size: int) -> List[List[int]]:
+    """Group example indices into batches of similar length to minimise padding"""
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    return [order[i:i + bucket_size] for i in range(0, len(order), bucket_size)]
 
-# # Plot the code vectors
-# plt.figure(figsize=(10, 6))
-# plt.imshow(code_vectors_np, aspect='auto', cmap='viridis')
-# plt.colorbar()
-# plt.title("Code Vectors")
-# plt.xlabel("Embedding Dimension")
-# plt.ylabel("Code Snippets")
-# plt.show()
 
-# # Function to visualize attention weights
-# def visualize_attention(attention_weights, context_count):
-#     print("Attention Weights Shape:", attention_weights.shape)
-#     print("Context Count:", context_count)
-#     plt.figure(figsize=(10, 4))
-#     plt.bar(range(context_count), attention_weights.cpu().detach().numpy()[:context_count])
-#     plt.title("Attention Weights")
-#     plt.xlabel("Context Index")
-#     plt.ylabel("Weight")
-#     plt.show()
+def compare_code_vectors(*args, **kwargs) -> Dict:
+    """Compare code snippets by their vectors, see Analysis.compare_code_vectors.
 
-# # Visualize attention weights for the first example in the batch
-# attention_weights_example = attention_weights[0]
-# context_count_example = batch_data['mask'][0].sum().item()
-# visualize_attention(attention_weights_example, context_count_example)
-# from sklearn.metrics.pairwise import cosine_similarity
-# import seaborn as sns
-
-# # Calculate cosine similarity
-# cos_sim = cosine_similarity(code_vectors_np)
-
-# # Plot cosine similarity matrix
-# plt.figure(figsize=(10, 8))
-# sns.heatmap(cos_sim, annot=True, cmap='coolwarm', xticklabels=False, yticklabels=False)
-# plt.title("Cosine Similarity Between Code Vectors")
-# plt.show()
-
-
-
-
-
-# Example diverse path contexts from different pieces of code
-# path_contexts_1 = [
-#     {'start_token': 'a', 'path': '(Name)^(Assign)_(BinOp)_(Name)', 'end_token': 'b'},
-#     {'start_token': 'a', 'path': '(Name)^(Assign)_(BinOp)_(Name)', 'end_token': 'c'}
-# ]
-
-# path_contexts_2 = [
-#     {'start_token': 'a', 'path': '(Name)^(Assign)_(BinOp)_(Name)', 'end_token': 'b'},
-#     {'start_token': 'a', 'path': '(Name)^(Assign)_(BinOp)_(Name)', 'end_token': 'c'}
-# ]
-
-# # Combine path contexts from different pieces of code
-# combined_path_contexts = [path_contexts_1, path_contexts_2]
-
-# # Create vocabulary
-# vocab_builder = VocabularyBuilder()
-# for contexts in combined_path_contexts:
-#     vocab_builder.build_vocab(contexts)
-
-# # Initialize model
-# model = CodeEmbedding(
-#     token_vocab_size=len(vocab_builder.token_to_idx),
-#     path_vocab_size=len(vocab_builder.path_to_idx),
-#     embedding_dim=128
-# )
-
-# # Prepare batch
-# batch_data = collate_path_contexts(combined_path_contexts, vocab_builder)
-
-# # Get code vectors
-# code_vectors, attention_weights = model(
-#     batch_data['start_tokens'],
-#     batch_data['paths'],
-#     batch_data['end_tokens'],
-#     batch_data['mask']
-# )
-
-# # Convert code vectors to numpy array for visualization
-# code_vectors_np = code_vectors.detach().numpy()
-
-# # Calculate cosine similarity
-# cos_sim = cosine_similarity(code_vectors_np)
-
-# # Plot cosine similarity matrix
-# plt.figure(figsize=(10, 8))
-# sns.heatmap(cos_sim, annot=True, cmap='coolwarm', xticklabels=False, yticklabels=False)
-# plt.title("Cosine Similarity Between Code Vectors")
-# plt.show()
+    The analysis and plotting code lives in Analysis.py so that inference never
+    pays for importing matplotlib, seaborn or sklearn.
+    """
+    from Analysis import compare_code_vectors as _compare_code_vectors
+    return _compare_code_vectors(*args, **kwargs)
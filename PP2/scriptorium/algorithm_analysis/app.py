@@ -1,12 +1,63 @@
-from flask import Flask, request, jsonify
-from predict import CodePredictor
+import atexit
+import os
+import time
+from flask import Flask, Response, g, request, jsonify
+import metrics
+from scheduler import QueueFull
+from serving import (
+    INDEX_TOKEN_HEADER, env_int, index_auth_error, index_from_env, index_predictions, index_request, index_token_from_env,
+    line_weights_json, predictor_from_env, profiler_from_env, register_queue_metrics, scheduler_from_env, searchable_vector,
+    sessions_from_env, similar_params
+)
 from flask_cors import CORS
 
 
 app = Flask(__name__)
-predictor = CodePredictor()
+predictor = predictor_from_env()
 CORS(app)  # This enables CORS for all routes and origins
 
+scheduler = scheduler_from_env(predictor)
+# Templates registered once, so selections are analysed without reparsing
+sessions = sessions_from_env(predictor)
+# Code vectors of saved templates, for "similar templates" queries
+template_index = index_from_env()
+# Index updates are saved in the background, save what is pending on exit
+atexit.register(template_index.close)
+# The server allows every origin, so changes to the index need a shared secret
+index_token = index_token_from_env()
+SELECTION_FIELDS = ('start_line', 'start_column', 'end_line', 'end_column')
+# Large /predict/batch requests run as length-sorted sub-batches of this size (0 disables)
+batch_bucket_size = env_int('PREDICT_BUCKET_SIZE', 64)
+max_batch_inputs = env_int('PREDICT_MAX_BATCH_INPUTS', 1024)
+register_queue_metrics(predictor, scheduler)
+# Dumps stacks of requests slower than PREDICT_PROFILE_SLOW_MS, off by default
+profiler = profiler_from_env()
+
+
+def route_label():
+    return request.url_rule.rule if request.url_rule is not None else 'other'
+
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+    g.profile = profiler.start() if profiler is not None else None
+
+
+@app.after_request
+def record_request(response):
+    route = route_label()
+    metrics.HTTP_REQUESTS.inc(route=route, status=str(response.status_code))
+    metrics.HTTP_SECONDS.observe(time.perf_counter() - g.started, route=route)
+    if g.profile is not None:
+        profiler.finish(g.profile, route)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 
 @app.route('/predict', methods=['POST'])
 def predict():
@@ -20,13 +71,235 @@ def predict():
             return jsonify({'error': 'Missing input field'}), 400
 
         # Extract contexts and predict
-        predicted_label, confidence, weight = predictor.predict(data['input'])
+        result = scheduler.submit(data['input']).result()
+        if result.error is not None:
+            raise ValueError(result.error)
 
         
-        return jsonify({'prediction': predicted_label, 'confidence': confidence})
+        return jsonify({'prediction': result.label, 'confidence': result.confidence, 'lines': line_weights_json(result)})
     
+    except QueueFull:
+        return jsonify({'error': 'Server is busy, try again later'}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/embed', methods=['POST'])
+def embed():
+    try:
+        # Validate input
+        if not request.is_json:
+            return jsonify({'error': 'Content-Type must be application/json'}), 400
+
+        data = request.get_json()
+        if 'input' not in data:
+            return jsonify({'error': 'Missing input field'}), 400
+
+        top_k = data.get('top_k', 0)
+        if not isinstance(top_k, int) or top_k < 0:
+            return jsonify({'error': 'top_k must be a non-negative integer'}), 400
+
+        # The code vector comes from the same forward pass as the prediction
+        result = scheduler.submit(data['input']).result()
+        if result.error is not None:
+            raise ValueError(result.error)
+
+        response = {
+            'code_vector': result.code_vector.tolist(),
+            'prediction': result.label,
+            'confidence': result.confidence
+        }
+        if top_k:
+            response['top_k'] = predictor.top_k(result, top_k)
+        return jsonify(response)
+
+    except QueueFull:
+        return jsonify({'error': 'Server is busy, try again later'}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    try:
+        # Validate input
+        if not request.is_json:
+            return jsonify({'error': 'Content-Type must be application/json'}), 400
+
+        data = request.get_json()
+        if not isinstance(data.get('inputs'), list):
+            return jsonify({'error': 'inputs must be a list of code snippets'}), 400
+        if len(data['inputs']) > max_batch_inputs:
+            return jsonify({'error': f'At most {max_batch_inputs} inputs per batch'}), 413
+
+        # Classify every valid snippet in one forward pass, keeping input order
+        inputs = data['inputs']
+        codes = [code for code in inputs if isinstance(code, str)]
+        predictions = iter(predictor.predict_batch(codes, bucket_size=batch_bucket_size))
+
+        results = []
+        for code in inputs:
+            if not isinstance(code, str):
+                results.append({'error': 'Input must be a string'})
+                continue
+            result = next(predictions)
+            if result.error is not None:
+                results.append({'error': result.error})
+            else:
+                results.append({'prediction': result.label, 'confidence': result.confidence})
+
+        return jsonify({'results': results})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def function_result(unit, result):
+    span = {
+        'name': unit.name,
+        'start_line': unit.start_line,
+        'start_column': unit.start_column,
+        'end_line': unit.end_line,
+        'end_column': unit.end_column
+    }
+    if result.error is not None:
+        return {**span, 'error': result.error}
+    return {**span, 'prediction': result.label, 'confidence': result.confidence, 'lines': line_weights_json(result)}
+
+
+@app.route('/predict/functions', methods=['POST'])
+def predict_functions():
+    try:
+        # Validate input
+        if not request.is_json:
+            return jsonify({'error': 'Content-Type must be application/json'}), 400
+
+        data = request.get_json()
+        if not isinstance(data.get('input'), str):
+            return jsonify({'error': 'input must be the source of a file'}), 400
+
+        # One parse and one forward pass for all functions of the file
+        try:
+            functions = predictor.predict_functions(data['input'], bucket_size=batch_bucket_size)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        return jsonify({'functions': [function_result(unit, result) for unit, result in functions]})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/session', methods=['POST'])
+def create_session():
+    try:
+        # Validate input
+        if not request.is_json:
+            return jsonify({'error': 'Content-Type must be application/json'}), 400
+
+        data = request.get_json()
+        if not isinstance(data.get('input'), str):
+            return jsonify({'error': 'input must be the template source'}), 400
+
+        try:
+            session_id = sessions.register(data['input'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'session_id': session_id})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/session/predict', methods=['POST'])
+def predict_selection():
+    try:
+        # Validate input
+        if not request.is_json:
+            return jsonify({'error': 'Content-Type must be application/json'}), 400
+
+        data = request.get_json()
+        if not isinstance(data.get('session_id'), str):
+            return jsonify({'error': 'Missing session_id field'}), 400
+        if not all(isinstance(data.get(field), int) for field in SELECTION_FIELDS):
+            return jsonify({'error': f'{", ".join(SELECTION_FIELDS)} must be integers'}), 400
+
+        try:
+            session = sessions.get(data['session_id'])
+        except KeyError:
+            return jsonify({'error': 'Unknown session, register the template again'}), 404
+
+        try:
+            selection = session.select(*(data[field] for field in SELECTION_FIELDS))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        result = scheduler.submit(selection).result()
+        if result.error is not None:
+            raise ValueError(result.error)
+
+        return jsonify({'prediction': result.label, 'confidence': result.confidence, 'lines': line_weights_json(result)})
+
+    except QueueFull:
+        return jsonify({'error': 'Server is busy, try again later'}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/similar', methods=['POST'])
+def similar():
+    try:
+        # Validate input
+        if not request.is_json:
+            return jsonify({'error': 'Content-Type must be application/json'}), 400
+
+        data = request.get_json()
+        if not isinstance(data.get('input'), str):
+            return jsonify({'error': 'Missing input field'}), 400
+        try:
+            params = similar_params(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        vector, error = searchable_vector(scheduler.submit(data['input']).result())
+        if error is not None:
+            return jsonify({'error': error}), 400
+
+        matches = template_index.search(vector, **params)
+        return jsonify({'results': [{'id': id, 'score': score} for id, score in matches]})
+
+    except QueueFull:
+        return jsonify({'error': 'Server is busy, try again later'}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/similar/index', methods=['POST'])
+def index_templates():
+    try:
+        refused = index_auth_error(index_token, request.headers.get(INDEX_TOKEN_HEADER))
+        if refused is not None:
+            status, message = refused
+            return jsonify({'error': message}), status
+
+        # Validate input
+        if not request.is_json:
+            return jsonify({'error': 'Content-Type must be application/json'}), 400
+
+        try:
+            ids, codes, remove = index_request(request.get_json())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Templates are embedded through the scheduler, batched with live traffic
+        futures = [scheduler.submit(code) for code in codes]
+        predictions = [future.result() for future in futures]
+        return jsonify(index_predictions(template_index, ids, predictions, remove))
+
+    except QueueFull:
+        return jsonify({'error': 'Server is busy, try again later'}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # The Werkzeug debugger runs arbitrary code, so it is opt-in and only served locally
+    debug = os.environ.get('PREDICT_DEBUG', '0') == '1'
+    app.run(debug=debug, host='127.0.0.1' if debug else '0.0.0.0', port=5000)
@@ -0,0 +1,460 @@
+import asyncio
+import json
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
+from AST import CompactAST, FunctionUnit, split_functions
+import metrics
+from metrics import SlowRequestProfiler
+from predict import CodePredictor, Prediction
+from scheduler import QueueFull
+from serving import (
+    INDEX_TOKEN_HEADER, env_float, env_int, index_auth_error, index_from_env, index_predictions, index_request,
+    index_token_from_env, line_weights_json, predictor_from_env, profiler_from_env, register_queue_metrics,
+    scheduler_from_env, searchable_vector, sessions_from_env, similar_params
+)
+from sessions import SessionStore
+from vector_index import TemplateIndex
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class PredictionApp:
+    """ASGI application serving the same routes as app.py, for production use.
+
+    Run it with any ASGI server, e.g. `python3 algorithm_analysis/asgi.py` from
+    the scriptorium directory, which needs `pip install uvicorn` (it is not a
+    dependency of the Flask app). Requests are guarded so one heavy
+    request can't degrade everyone else's:
+
+    - bodies over `max_body_bytes` and /predict/batch requests of more than
+      `max_batch_inputs` snippets are rejected with 413, and snippets over the
+      predictor's `max_nodes` fail extraction
+    - extraction plus inference must finish within `timeout` seconds, else 504.
+      The timeout only frees the request: work already running in the
+      scheduler is not interrupted. It is bounded instead by `max_nodes` and
+      the extraction budgets of the predictor's ContextSampling, and other
+      scheduler threads keep serving in the meantime
+    - more than `max_concurrency` requests in flight get 429, and 503 is
+      returned while the extraction or inference queues are full
+    - whole-request work (/predict/batch, splitting files into functions,
+      registering templates) runs in a pool of `blocking_workers` threads
+      and gets 503 while all of them are busy. A request that times out
+      keeps its concurrency slot until its work has actually finished
+    - on lifespan shutdown new requests get 503, in-flight ones are given up
+      to `shutdown_grace` seconds to finish, then the scheduler is closed
+      and pending index updates are saved
+
+    GET /metrics serves the Prometheus metrics, and with a `profiler` requests
+    slower than its threshold have their sampled stacks dumped. /similar/index
+    changes the index, so it needs `index_token` in the X-Index-Token header.
+    """
+
+    def __init__(
+        self,
+        predictor: CodePredictor,
+        scheduler,
+        sessions: SessionStore,
+        index: TemplateIndex,
+        max_body_bytes: int = 256 * 1024,
+        timeout: float = 5.0,
+        max_concurrency: int = 64,
+        shutdown_grace: float = 10.0,
+        bucket_size: Optional[int] = 64,
+        max_batch_inputs: int = 1024,
+        blocking_workers: int = 4,
+        index_token: Optional[str] = None,
+        profiler: Optional[SlowRequestProfiler] = None
+    ):
+        self.predictor = predictor
+        self.scheduler = scheduler
+        self.sessions = sessions
+        self.index = index
+        self.max_body_bytes = max_body_bytes
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.shutdown_grace = shutdown_grace
+        self.bucket_size = bucket_size
+        self.max_batch_inputs = max_batch_inputs
+        self.blocking_workers = blocking_workers
+        self.index_token = index_token
+        self.profiler = profiler
+        self._blocking = ThreadPoolExecutor(max_workers=blocking_workers, thread_name_prefix='asgi-blocking')
+        self._blocking_jobs = 0
+
+        self.in_flight = 0
+        self.draining = False
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.routes = {
+            '/predict': self.predict,
+            '/embed': self.embed,
+            '/predict/batch': self.predict_batch,
+            '/predict/functions': self.predict_functions,
+            '/session': self.create_session,
+            '/session/predict': self.predict_selection,
+            '/similar': self.similar,
+            '/similar/index': self.index_templates,
+        }
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.draining = True
+                try:
+                    await asyncio.wait_for(self._idle.wait(), self.shutdown_grace)
+                except asyncio.TimeoutError:
+                    pass
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, self.scheduler.close)
+                await loop.run_in_executor(None, self._blocking.shutdown)
+                await loop.run_in_executor(None, self.index.close)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send) -> None:
+        route = metrics.route_label(scope['path'], self.routes)
+        status = 500
+        start = time.perf_counter()
+        token = self.profiler.start() if self.profiler is not None else None
+
+        async def send_with_status(message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self._dispatch(scope, receive, send_with_status)
+        finally:
+            metrics.HTTP_REQUESTS.inc(route=route, status=str(status))
+            metrics.HTTP_SECONDS.observe(time.perf_counter() - start, route=route)
+            if token is not None:
+                self.profiler.finish(token, route)
+
+    async def _dispatch(self, scope, receive, send) -> None:
+        if scope['path'] == '/metrics' and scope['method'] == 'GET':
+            body = metrics.REGISTRY.render().encode()
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', metrics.CONTENT_TYPE.encode()), (b'content-length', str(len(body)).encode())],
+            })
+            await send({'type': 'http.response.body', 'body': body})
+            return
+        handler = self.routes.get(scope['path'])
+        if scope['method'] == 'OPTIONS' and handler is not None:
+            await self._send_preflight(scope, send)
+            return
+        if handler is None:
+            await self._send_json(send, 404, {'error': 'Not found'})
+            return
+        if scope['method'] != 'POST':
+            await self._send_json(send, 405, {'error': 'Method not allowed'})
+            return
+        if self.draining:
+            await self._send_json(send, 503, {'error': 'Server is shutting down'})
+            return
+        if self.in_flight >= self.max_concurrency:
+            await self._send_json(send, 429, {'error': 'Too many requests, try again later'})
+            return
+
+        self._enter()
+        try:
+            try:
+                if handler == self.index_templates:
+                    self._authorize_index(scope)
+                data = await self._read_json(scope, receive)
+                status, payload = await handler(data)
+            except ClientDisconnected:
+                return
+            except HTTPError as e:
+                status, payload = e.status, {'error': e.message}
+            except QueueFull:
+                status, payload = 503, {'error': 'Server is busy, try again later'}
+            except Exception as e:
+                status, payload = 500, {'error': str(e)}
+            await self._send_json(send, status, payload)
+        finally:
+            self._leave()
+
+    def _enter(self) -> None:
+        self.in_flight += 1
+        self._idle.clear()
+
+    def _leave(self, _future=None) -> None:
+        self.in_flight -= 1
+        if not self.in_flight:
+            self._idle.set()
+
+    def _authorize_index(self, scope) -> None:
+        sent = dict(scope['headers']).get(INDEX_TOKEN_HEADER.lower().encode())
+        refused = index_auth_error(self.index_token, sent.decode('latin-1') if sent is not None else None)
+        if refused is not None:
+            raise HTTPError(*refused)
+
+    async def _read_json(self, scope, receive) -> Dict[str, Any]:
+        headers = dict(scope['headers'])
+        content_type = headers.get(b'content-type', b'').split(b';')[0].strip()
+        if content_type != b'application/json' and not content_type.endswith(b'+json'):
+            raise HTTPError(400, 'Content-Type must be application/json')
+        try:
+            declared = int(headers.get(b'content-length', 0))
+        except ValueError:
+            raise HTTPError(400, 'Invalid Content-Length')
+        if declared > self.max_body_bytes:
+            raise HTTPError(413, f'Request body is larger than {self.max_body_bytes} bytes')
+
+        body = bytearray()
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+            body += message.get('body', b'')
+            if len(body) > self.max_body_bytes:
+                raise HTTPError(413, f'Request body is larger than {self.max_body_bytes} bytes')
+            more_body = message.get('more_body', False)
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise HTTPError(400, 'Request body is not valid JSON')
+        if not isinstance(data, dict):
+            raise HTTPError(400, 'Request body must be a JSON object')
+        return data
+
+    async def _classify(self, codes: List[Union[str, CompactAST]], timeout: float = None) -> List[Prediction]:
+        """Classify snippets through the scheduler, giving up at the request deadline"""
+        futures: List[Future] = []
+        try:
+            for code in codes:
+                futures.append(self.scheduler.submit(code))
+            waiting = asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+            return await asyncio.wait_for(waiting, self.timeout if timeout is None else max(timeout, 0))
+        except asyncio.TimeoutError:
+            raise HTTPError(504, f'Request did not finish within {self.timeout:g}s')
+        finally:
+            # Drop queued work nobody is waiting for anymore; a batch that already started runs to completion
+            for future in futures:
+                future.cancel()
+
+    async def _run_blocking(self, function, *args):
+        """Run CPU-bound work in the bounded thread pool, giving up at the request deadline"""
+        if self._blocking_jobs >= self.blocking_workers:
+            raise QueueFull(f'{self._blocking_jobs} requests already running')
+        self._blocking_jobs += 1
+        work = asyncio.wrap_future(self._blocking.submit(metrics.run_serving, metrics.profiled_requests(), function, *args))
+        work.add_done_callback(self._blocking_done)
+        try:
+            # Shielded, so a timeout doesn't mark the work done while it is still running
+            return await asyncio.wait_for(asyncio.shield(work), self.timeout)
+        except asyncio.TimeoutError:
+            # The work can't be interrupted; it holds a concurrency slot until it finishes
+            self._enter()
+            work.add_done_callback(self._leave)
+            raise HTTPError(504, f'Request did not finish within {self.timeout:g}s')
+
+    def _blocking_done(self, _work) -> None:
+        self._blocking_jobs -= 1
+
+    async def _classify_one(self, data: Dict[str, Any]) -> Prediction:
+        if 'input' not in data:
+            raise HTTPError(400, 'Missing input field')
+        if not isinstance(data['input'], str):
+            raise HTTPError(400, 'Input must be a string')
+        result = (await self._classify([data['input']]))[0]
+        if result.error is not None:
+            raise HTTPError(400, result.error)
+        return result
+
+    async def predict(self, data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        result = await self._classify_one(data)
+        return 200, {'prediction': result.label, 'confidence': result.confidence, 'lines': line_weights_json(result)}
+
+    async def embed(self, data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        top_k = data.get('top_k', 0)
+        if not isinstance(top_k, int) or top_k < 0:
+            raise HTTPError(400, 'top_k must be a non-negative integer')
+
+        result = await self._classify_one(data)
+        response = {
+            'code_vector': result.code_vector.tolist(),
+            'prediction': result.label,
+            'confidence': result.confidence
+        }
+        if top_k:
+            response['top_k'] = self.predictor.top_k(result, top_k)
+        return 200, response
+
+    async def predict_batch(self, data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        inputs = data.get('inputs')
+        if not isinstance(inputs, list):
+            raise HTTPError(400, 'inputs must be a list of code snippets')
+        if len(inputs) > self.max_batch_inputs:
+            raise HTTPError(413, f'At most {self.max_batch_inputs} inputs per batch')
+
+        # The whole request is one predict_batch call with length-sorted forward passes
+        codes = [code for code in inputs if isinstance(code, str)]
+        predictions = iter(await self._run_blocking(self.predictor.predict_batch, codes, self.bucket_size))
+        results = []
+        for code in inputs:
+            if not isinstance(code, str):
+                results.append({'error': 'Input must be a string'})
+                continue
+            result = next(predictions)
+            if result.error is not None:
+                results.append({'error': result.error})
+            else:
+                results.append({'prediction': result.label, 'confidence': result.confidence})
+        return 200, {'results': results}
+
+    async def predict_functions(self, data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        if not isinstance(data.get('input'), str):
+            raise HTTPError(400, 'input must be the source of a file')
+        # Split off the event loop, then classify every function through the scheduler
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            units: List[FunctionUnit] = await self._run_blocking(split_functions, data['input'], self.predictor.max_nodes)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+
+        results = []
+        for unit, result in zip(units, await self._classify([unit.tree for unit in units], self.timeout - (loop.time() - started))):
+            span = {
+                'name': unit.name,
+                'start_line': unit.start_line,
+                'start_column': unit.start_column,
+                'end_line': unit.end_line,
+                'end_column': unit.end_column
+            }
+            if result.error is not None:
+                results.append({**span, 'error': result.error})
+            else:
+                results.append({**span, 'prediction': result.label, 'confidence': result.confidence, 'lines': line_weights_json(result)})
+        return 200, {'functions': results}
+
+    async def create_session(self, data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        if not isinstance(data.get('input'), str):
+            raise HTTPError(400, 'input must be the template source')
+        # Parsing a whole template is CPU-bound, keep it off the event loop
+        try:
+            session_id = await self._run_blocking(self.sessions.register, data['input'])
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        return 200, {'session_id': session_id}
+
+    async def predict_selection(self, data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        fields = ('start_line', 'start_column', 'end_line', 'end_column')
+        if not isinstance(data.get('session_id'), str):
+            raise HTTPError(400, 'Missing session_id field')
+        if not all(isinstance(data.get(field), int) for field in fields):
+            raise HTTPError(400, f'{", ".join(fields)} must be integers')
+        try:
+            session = self.sessions.get(data['session_id'])
+        except KeyError:
+            raise HTTPError(404, 'Unknown session, register the template again')
+        try:
+            selection = session.select(*(data[field] for field in fields))
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+
+        result = (await self._classify([selection]))[0]
+        if result.error is not None:
+            raise HTTPError(400, result.error)
+        return 200, {'prediction': result.label, 'confidence': result.confidence, 'lines': line_weights_json(result)}
+
+    async def similar(self, data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        try:
+            params = similar_params(data)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        result = await self._classify_one(data)
+        vector, error = searchable_vector(result)
+        if error is not None:
+            raise HTTPError(400, error)
+        matches = self.index.search(vector, **params)
+        return 200, {'results': [{'id': id, 'score': score} for id, score in matches]}
+
+    async def index_templates(self, data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        try:
+            ids, codes, remove = index_request(data)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        predictions = await self._classify(codes)
+        # Upserts can retrain the inverted lists, keep them off the event loop
+        loop = asyncio.get_running_loop()
+        return 200, await loop.run_in_executor(None, index_predictions, self.index, ids, predictions, remove)
+
+    async def _send_json(self, send, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                (b'access-control-allow-origin', b'*'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _send_preflight(self, scope, send) -> None:
+        requested = dict(scope['headers']).get(b'access-control-request-headers', b'content-type')
+        await send({
+            'type': 'http.response.start',
+            'status': 204,
+            'headers': [
+                (b'access-control-allow-origin', b'*'),
+                (b'access-control-allow-methods', b'POST, OPTIONS'),
+                (b'access-control-allow-headers', requested),
+                (b'access-control-max-age', b'600'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+predictor = predictor_from_env()
+scheduler = scheduler_from_env(predictor)
+register_queue_metrics(predictor, scheduler)
+app = PredictionApp(
+    predictor,
+    scheduler,
+    sessions_from_env(predictor),
+    index_from_env(),
+    max_body_bytes=env_int('PREDICT_MAX_BODY_BYTES', 256 * 1024),
+    timeout=env_float('PREDICT_TIMEOUT_MS', 5000) / 1000.0,
+    max_concurrency=env_int('PREDICT_MAX_CONCURRENCY', 64),
+    shutdown_grace=env_float('PREDICT_SHUTDOWN_GRACE_S', 10),
+    bucket_size=env_int('PREDICT_BUCKET_SIZE', 64) or None,
+    max_batch_inputs=env_int('PREDICT_MAX_BATCH_INPUTS', 1024),
+    blocking_workers=env_int('PREDICT_BLOCKING_WORKERS', 4),
+    index_token=index_token_from_env(),
+    profiler=profiler_from_env()
+)
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit('Serving asgi.py directly needs uvicorn (pip install uvicorn), or run asgi:app under another ASGI server')
+    uvicorn.run(app, host='0.0.0.0', port=5000, timeout_graceful_shutdown=int(app.shutdown_grace))
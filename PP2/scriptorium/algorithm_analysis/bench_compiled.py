@@ -0,0 +1,69 @@
+import argparse
+import json
+import os
+import statistics
+import time
+
+import torch
+
+from predict import CodePredictor
+from Classifier import make_probe_batch
+
+# CodePredictor loads its files relative to the scriptorium directory
+SCRIPTORIUM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_model(model, batch, repeats: int) -> float:
+    """Median latency of one classify call in milliseconds"""
+    args = (batch['start_tokens'], batch['paths'], batch['end_tokens'], batch['mask'])
+    timings = []
+    with torch.inference_mode():
+        for _ in range(3):
+            model.classify(*args)  # warm up, TorchScript profiles its first runs
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model.classify(*args)
+            timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare eager and TorchScript inference latency on CPU")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 64])
+    parser.add_argument("--contexts", type=int, default=200, help="contexts per example")
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--threads", type=int, help="torch intra-op threads")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    os.chdir(SCRIPTORIUM_DIR)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    models = {
+        "eager": CodePredictor(cache_size=0).model,
+        "compiled": CodePredictor(cache_size=0, compile_model=True).model,
+    }
+    vocab = CodePredictor(cache_size=0, optimize=False).vocab_builder
+
+    results = []
+    for batch_size in args.batch_sizes:
+        batch = make_probe_batch(
+            len(vocab.token_to_idx), len(vocab.path_to_idx),
+            batch_size=batch_size, max_contexts=args.contexts
+        )
+        row = {"batch_size": batch_size}
+        for name, model in models.items():
+            row[f"{name}_ms"] = time_model(model, batch, args.repeats)
+        row["speedup"] = row["eager_ms"] / row["compiled_ms"]
+        results.append(row)
+        print(f"batch {batch_size:>3}: eager {row['eager_ms']:.2f} ms  compiled {row['compiled_ms']:.2f} ms  speedup {row['speedup']:.2f}x")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump({"torch": torch.__version__, "threads": torch.get_num_threads(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
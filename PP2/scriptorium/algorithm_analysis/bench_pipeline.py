@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import torch
+
+ALGORITHM_DIR = os.path.dirname(os.path.abspath(__file__))
+# CodePredictor loads its files relative to the scriptorium directory
+PROJECT_DIR = os.path.dirname(ALGORITHM_DIR)
+
+from AST import CompactAST, PathContextExtractor
+from Embedding import collate_context_ids, collate_path_contexts
+from serving import predictor_from_env
+from synthetic_corpus import SIZES, generate_corpus
+
+STAGES = ("parse", "nodes", "pairs", "pairs_strings", "collate", "collate_strings", "forward")
+
+# Serves app.py on a given port without the debug reloader
+SERVER_SCRIPT = """
+import sys
+sys.path.insert(0, {algorithm_dir!r})
+import app
+app.app.run(host="127.0.0.1", port={port}, threaded=True, use_reloader=False)
+"""
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def summarize(timings: List[float]) -> Dict[str, float]:
+    return {"median_ms": statistics.median(timings), "p95_ms": percentile(timings, 95)}
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def bench_stages(predictor, corpus: List[dict], batch_size: int, repeats: int) -> Dict[str, Dict[str, dict]]:
+    """Per-snippet timings of each extraction stage and per-batch timings of collation and the forward pass, by size class.
+
+    pairs is the served id extraction, pairs_strings and collate_strings the
+    string path contexts used for training data.
+    """
+    extractor = PathContextExtractor(predictor.sampling)
+    results = {}
+    for size in sorted({record["size"] for record in corpus}):
+        codes = [record["code"] for record in corpus if record["size"] == size]
+        timings = {stage: [] for stage in STAGES}
+        for _ in range(repeats):
+            context_ids, string_contexts = [], []
+            for code in codes:
+                (tree, _), elapsed = timed(extractor.parse_snippet, code)
+                timings["parse"].append(elapsed)
+                nodes, elapsed = timed(lambda: CompactAST.from_ast(tree, predictor.max_nodes, positions=True))
+                timings["nodes"].append(elapsed)
+                ids, elapsed = timed(extractor.extract_context_ids, nodes, predictor.vocab)
+                timings["pairs"].append(elapsed)
+                context_ids.append(ids)
+                contexts, elapsed = timed(extractor.extract_path_contexts_from_tree, nodes)
+                timings["pairs_strings"].append(elapsed)
+                string_contexts.append(contexts)
+
+            for start in range(0, len(codes), batch_size):
+                batch, elapsed = timed(collate_context_ids, context_ids[start:start + batch_size])
+                timings["collate"].append(elapsed)
+                _, elapsed = timed(collate_path_contexts, string_contexts[start:start + batch_size], predictor.vocab_builder)
+                timings["collate_strings"].append(elapsed)
+                args = [batch[key].to(predictor.device) for key in ("start_tokens", "paths", "end_tokens", "mask")]
+                with torch.inference_mode():
+                    _, elapsed = timed(predictor.model.classify, *args)
+                timings["forward"].append(elapsed)
+
+        results[str(size)] = {stage: summarize(values) for stage, values in timings.items()}
+        print(f"{size:>5} lines: " + "  ".join(f"{stage} {results[str(size)][stage]['median_ms']:.2f}" for stage in STAGES) + " (median ms)")
+    return results
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def post(url: str, payload: dict, timeout: float = 60.0) -> int:
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def start_server(port: int) -> subprocess.Popen:
+    """Run app.py in a child process, with the prediction cache off so every request does the work"""
+    env = dict(os.environ, PREDICT_CACHE_SIZE="0", PREDICT_INDEX_PATH="")
+    server = subprocess.Popen(
+        [sys.executable, "-c", SERVER_SCRIPT.format(algorithm_dir=ALGORITHM_DIR, port=port)],
+        cwd=PROJECT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("app.py exited during startup")
+        try:
+            post(f"http://127.0.0.1:{port}/predict", {"input": "x = 1"}, timeout=5)
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("app.py did not start within 120s")
+
+
+def bench_http(url: str, codes: List[str], requests: int, concurrency: int) -> Dict[str, float]:
+    """End-to-end /predict latency percentiles under `concurrency` clients"""
+    for code in codes[:concurrency]:
+        post(f"{url}/predict", {"input": code})  # warm up
+
+    def one(i: int):
+        return timed(post, f"{url}/predict", {"input": codes[i % len(codes)]})
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [ms for status, ms in results if status == 200]
+    summary = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": sum(status != 200 for status, _ in results),
+        "throughput_rps": requests / elapsed,
+    }
+    if latencies:
+        summary.update({f"p{q}_ms": percentile(latencies, q) for q in (50, 95, 99)})
+    print(f"http: {summary['throughput_rps']:.1f} req/s, p50 {summary.get('p50_ms', 0):.1f} ms, "
+          f"p95 {summary.get('p95_ms', 0):.1f} ms, p99 {summary.get('p99_ms', 0):.1f} ms, {summary['errors']} errors")
+    return summary
+
+
+def metrics(results: dict) -> Dict[str, float]:
+    """Flatten results into the millisecond metrics compared against a baseline"""
+    flat = {}
+    for size, stages in results.get("stages", {}).items():
+        for stage, stats in stages.items():
+            flat[f"stages.{size}.{stage}"] = stats["median_ms"]
+    for key in ("p50_ms", "p95_ms", "p99_ms"):
+        if key in results.get("http", {}):
+            flat[f"http.{key}"] = results["http"][key]
+    return flat
+
+
+def find_regressions(current: dict, baseline: dict, threshold: float, stage_thresholds: Dict[str, float],
+                     min_delta_ms: float) -> List[str]:
+    """Metrics slower than the baseline by more than their threshold (a fraction, 0.2 is 20%)"""
+    regressions = []
+    base = metrics(baseline)
+    for name, value in metrics(current).items():
+        if name not in base:
+            continue
+        # stages.<size>.<stage> or http.<percentile>
+        stage = name.split(".")[-1] if name.startswith("stages.") else "http"
+        limit = stage_thresholds.get(stage, threshold)
+        if value > base[name] * (1 + limit) and value - base[name] > min_delta_ms:
+            regressions.append(f"{name}: {base[name]:.3f} ms -> {value:.3f} ms (+{value / base[name] - 1:.0%}, limit +{limit:.0%})")
+    return regressions
+
+
+def parse_thresholds(values: List[str]) -> Dict[str, float]:
+    thresholds = {}
+    for value in values:
+        stage, _, limit = value.partition("=")
+        if stage not in STAGES + ("http",) or not limit:
+            raise ValueError(f"Expected STAGE=FRACTION with a stage from {STAGES + ('http',)}, got {value!r}")
+        thresholds[stage] = float(limit)
+    return thresholds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark extraction stages, inference and HTTP latency on a synthetic corpus")
+    parser.add_argument("--per-size", type=int, default=10, help="snippets per size class")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), help="snippet line counts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=16, help="snippets per collate and forward batch")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threads", type=int, help="torch intra-op threads")
+    parser.add_argument("--skip-http", action="store_true")
+    parser.add_argument("--url", help="benchmark a running server instead of starting app.py")
+    parser.add_argument("--http-requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--http-max-lines", type=int, default=100, help="only send snippets up to this size over HTTP")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown as a fraction (0.2 is 20%%)")
+    parser.add_argument("--stage-threshold", action="append", default=[], metavar="STAGE=FRACTION",
+                        help="allowed slowdown of one stage (or http), overriding --threshold")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05, help="ignore slowdowns smaller than this")
+    args = parser.parse_args()
+    try:
+        stage_thresholds = parse_thresholds(args.stage_threshold)
+    except ValueError as e:
+        parser.error(str(e))
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    os.chdir(PROJECT_DIR)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    predictor = predictor_from_env()
+    corpus = list(generate_corpus(args.per_size, args.sizes, args.seed))
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "threads": torch.get_num_threads(),
+            "cpus": os.cpu_count(),
+        },
+        "config": {key: getattr(args, key) for key in ("per_size", "sizes", "seed", "batch_size", "repeats")},
+        "stages": bench_stages(predictor, corpus, args.batch_size, args.repeats),
+    }
+
+    if not args.skip_http:
+        codes = [record["code"] for record in corpus if record["size"] <= args.http_max_lines]
+        if args.url:
+            server, url = None, args.url.rstrip("/")
+        else:
+            port = free_port()
+            server, url = start_server(port), f"http://127.0.0.1:{port}"
+        try:
+            results["http"] = bench_http(url, codes, args.http_requests, args.concurrency)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if baseline_path:
+        with open(baseline_path, "r") as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.threshold, stage_thresholds, args.min_delta_ms)
+        if regressions:
+            print(f"{len(regressions)} regressions against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ALGORITHM_DIR = os.path.dirname(os.path.abspath(__file__))
+# CodePredictor loads its files relative to the scriptorium directory
+PROJECT_DIR = os.path.dirname(ALGORITHM_DIR)
+
+SAMPLE_CODE = "def binary_search(arr, target):\n    left = 0\n    right = len(arr) - 1\n    while left <= right:\n        mid = (left + right) // 2\n        if arr[mid] == target:\n            return mid\n        elif arr[mid] < target:\n            left = mid + 1\n        else:\n            right = mid - 1\n    return -1"
+
+# Runs in a fresh interpreter so every measurement is a true cold start
+CHILD_SCRIPT = """
+import json, resource, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {algorithm_dir!r})
+from predict import CodePredictor
+imported = time.perf_counter()
+predictor = CodePredictor()
+loaded = time.perf_counter()
+predictor.predict({sample!r})
+predicted = time.perf_counter()
+print(json.dumps({{
+    "import_s": imported - start,
+    "model_load_s": loaded - imported,
+    "first_prediction_s": predicted - loaded,
+    "modules_loaded": len(sys.modules),
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}}))
+"""
+
+
+def run_once() -> dict:
+    script = CHILD_SCRIPT.format(algorithm_dir=ALGORITHM_DIR, sample=SAMPLE_CODE)
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=PROJECT_DIR, check=True, capture_output=True, text=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    # Includes interpreter startup, which the child can't see
+    result["total_s"] = time.perf_counter() - started
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark for the algorithm analysis service")
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh processes to measure")
+    parser.add_argument("--output", help="write the summary as JSON to this file")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    summary = {
+        key: {
+            "median": statistics.median(run[key] for run in runs),
+            "min": min(run[key] for run in runs),
+            "max": max(run[key] for run in runs),
+        }
+        for key in runs[0]
+    }
+
+    for key, stats in summary.items():
+        print(f"{key:>20}: median {stats['median']:.3f}  min {stats['min']:.3f}  max {stats['max']:.3f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"runs": runs, "summary": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Dict, Hashable, Tuple
+
+
+class PredictionCache:
+    """Bounded LRU cache with single-flight deduplication.
+
+    Callers `claim` a key and get back a Future plus an ownership flag. Cached
+    keys return an already resolved Future. If another caller is computing the
+    key, its Future is shared so identical requests are only computed once.
+    Otherwise the caller owns the key and must call `resolve` or `fail`.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def claim(self, key: Hashable) -> Tuple[Future, bool]:
+        """Return a Future for key and whether the caller has to compute it"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                future = Future()
+                future.set_result(self._entries[key])
+                return future, False
+
+            if key in self._in_flight:
+                self.coalesced += 1
+                return self._in_flight[key], False
+
+            self.misses += 1
+            future = Future()
+            self._in_flight[key] = future
+            return future, True
+
+    def resolve(self, key: Hashable, value: Any) -> None:
+        """Store the computed value and wake up everyone waiting on it"""
+        with self._lock:
+            future = self._in_flight.pop(key)
+            if self.max_entries > 0:
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        future.set_result(value)
+
+    def fail(self, key: Hashable, error: BaseException) -> None:
+        """Propagate a failed computation to waiters without caching it"""
+        with self._lock:
+            future = self._in_flight.pop(key)
+        future.set_exception(error)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,248 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Iterator, Optional, Tuple
+
+import torch
+from AST import ContextSampling
+from extraction import ExtractionPool
+from predict import CodePredictor, QUANTIZE_MODES
+
+SCRIPTORIUM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def read_records(stream, id_field: str, code_field: str, skip: int = 0) -> Iterator[Tuple[int, object, Optional[str], Optional[str]]]:
+    """Yield (offset after the line, id, code, error) for each JSONL record, after skipping `skip` records"""
+    offset = stream.tell() if stream.seekable() else 0
+    for line in stream:
+        offset += len(line)
+        if not line.strip():
+            continue
+        if skip:
+            skip -= 1
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield offset, None, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield offset, None, None, "Record must be a JSON object"
+            continue
+        code = record.get(code_field)
+        if not isinstance(code, str):
+            yield offset, record.get(id_field), None, f"{code_field} must be a string"
+            continue
+        yield offset, record.get(id_field), code, None
+
+
+def load_checkpoint(path: str) -> dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_checkpoint(path: str, state: dict) -> None:
+    """Replace the checkpoint atomically, so a kill mid-write leaves the previous one"""
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class CorpusClassifier:
+    """Classifies a JSONL stream in input order with bounded memory.
+
+    Up to two batches of records are extracted in the worker pool at once;
+    once the window is full the oldest `batch_size` go through one forward
+    pass and are written out, while the next batch keeps extracting.
+    """
+
+    def __init__(self, predictor: CodePredictor, pool: ExtractionPool, batch_size: int, bucket_size: int, top_k: int):
+        self.predictor = predictor
+        self.pool = pool
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size
+        self.top_k = top_k
+        self.window = deque()  # (offset, id, future)
+
+        self.records = 0
+        self.errors = 0
+        self.offset = 0
+
+    def submit(self, offset: int, record_id, code: Optional[str], error: Optional[str]) -> None:
+        if error is None:
+            future = self.pool.submit(code)
+        else:
+            future = Future()
+            future.set_exception(ValueError(error))
+        self.window.append((offset, record_id, future))
+
+    def flush(self, out, full: bool = False) -> int:
+        """Classify and write the oldest batch (or everything with full=True); return records written"""
+        written = 0
+        while self.window and (full or len(self.window) >= 2 * self.batch_size):
+            batch = [self.window.popleft() for _ in range(min(self.batch_size, len(self.window)))]
+            results = [None] * len(batch)
+            owned = []
+            for i, (_, record_id, future) in enumerate(batch):
+                try:
+                    _, contexts, _ = future.result()
+                    owned.append((i, contexts))
+                except Exception as e:
+                    results[i] = {'id': record_id, 'error': str(e)}
+
+            if owned:
+                predictions = self.predictor.predict_contexts([contexts for _, contexts in owned], self.bucket_size)
+                for (i, _), prediction in zip(owned, predictions):
+                    if prediction.error is not None:
+                        results[i] = {'id': batch[i][1], 'error': prediction.error}
+                        continue
+                    result = {'id': batch[i][1], 'label': prediction.label, 'confidence': prediction.confidence}
+                    if self.top_k:
+                        result['top_k'] = self.predictor.top_k(prediction, self.top_k)
+                    results[i] = result
+
+            for result in results:
+                out.write(json.dumps(result) + '\n')
+                self.errors += 'error' in result
+            self.records += len(batch)
+            self.offset = batch[-1][0]
+            written += len(batch)
+            if not full:
+                break
+        return written
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Classify a JSONL corpus of {id, code} records, streaming JSONL results in input order"
+    )
+    parser.add_argument("input", help="JSONL file, or - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="JSONL output file, or - for stdout (default)")
+    parser.add_argument("--resume", action="store_true", help="continue from the output's checkpoint")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: OUTPUT.checkpoint)")
+    parser.add_argument("--checkpoint-every", type=int, default=10000, help="records between checkpoints")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--code-field", default="code")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="extraction processes")
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads for inference (0: torch default)")
+    parser.add_argument("--batch-size", type=int, default=256, help="snippets per forward pass")
+    parser.add_argument("--bucket-size", type=int, default=64, help="length-sorted sub-batch size")
+    parser.add_argument("--top-k", type=int, default=0, help="also write the k most likely labels")
+    parser.add_argument("--max-nodes", type=int, default=50000, help="reject larger snippets (0 disables)")
+    parser.add_argument("--sampling", choices=ContextSampling.MODES, default="first")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compile", action="store_true", help="use the TorchScript model")
+    parser.add_argument("--quantize", choices=QUANTIZE_MODES, help="use an approved int8 model")
+    parser.add_argument("--progress-seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    # Checkpoints record and fsync the output's byte offset, which a pipe doesn't have
+    if args.resume or args.checkpoint:
+        option = "--resume" if args.resume else "--checkpoint"
+        if args.output == "-":
+            parser.error(f"{option} needs an output file")
+        if os.path.exists(args.output) and not os.path.isfile(args.output):
+            parser.error(f"{option} needs --output to be a regular file, not {args.output}")
+    # Resolve user paths first: CodePredictor loads its files relative to the scriptorium directory
+    input_path = None if args.input == "-" else os.path.abspath(args.input)
+    output_path = None if args.output == "-" else os.path.abspath(args.output)
+    checkpoint_path = os.path.abspath(args.checkpoint) if args.checkpoint else (output_path and output_path + ".checkpoint")
+    os.chdir(SCRIPTORIUM_DIR)
+
+    state = {'input_offset': 0, 'records': 0, 'errors': 0, 'output_bytes': 0}
+    if args.resume and os.path.exists(checkpoint_path):
+        state = load_checkpoint(checkpoint_path)
+    elif output_path and os.path.exists(output_path) and os.path.getsize(output_path) and not args.resume:
+        parser.error(f"{args.output} already exists, pass --resume to continue it or remove it")
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    sampling = ContextSampling(mode=args.sampling, seed=args.seed)
+    predictor = CodePredictor(
+        cache_size=0, compile_model=args.compile, quantize=args.quantize,
+        max_nodes=args.max_nodes or None, sampling=sampling
+    )
+    vocab = predictor.vocab_builder
+    pool = ExtractionPool(
+        vocab.token_to_idx, vocab.path_to_idx, vocab.unk_token,
+        workers=args.workers, max_pending=2 * args.batch_size,
+        max_nodes=predictor.max_nodes, sampling=sampling
+    )
+    classifier = CorpusClassifier(predictor, pool, args.batch_size, args.bucket_size, args.top_k)
+    classifier.records, classifier.errors, classifier.offset = state['records'], state['errors'], state['input_offset']
+
+    if input_path:
+        stream = open(input_path, 'rb')
+        total_bytes = os.path.getsize(input_path)
+        stream.seek(state['input_offset'])
+        skip = 0
+    else:
+        # stdin can't seek, skip the records already done instead
+        stream = sys.stdin.buffer
+        total_bytes = None
+        skip = state['records']
+
+    if output_path:
+        out = open(output_path, 'a+', encoding='utf-8')
+        # Drop anything written after the last checkpoint, it will be written again
+        out.truncate(state['output_bytes'])
+        out.seek(state['output_bytes'])
+    else:
+        out = sys.stdout
+
+    started = time.monotonic()
+    resumed_at = classifier.records
+    last_checkpoint_records = classifier.records
+    last_report_time = started
+
+    def checkpoint():
+        out.flush()
+        os.fsync(out.fileno())
+        write_checkpoint(checkpoint_path, {
+            'input_offset': classifier.offset if input_path else 0,
+            'records': classifier.records,
+            'errors': classifier.errors,
+            'output_bytes': out.tell(),
+        })
+
+    def report(final=False):
+        elapsed = time.monotonic() - started
+        rate = (classifier.records - resumed_at) / elapsed if elapsed > 0 else 0.0
+        progress = f" ({100.0 * classifier.offset / total_bytes:.1f}%)" if total_bytes and input_path else ""
+        prefix = "Done: " if final else ""
+        print(f"{prefix}{classifier.records} records{progress}, {classifier.errors} errors, "
+              f"{rate:.1f} records/s, {elapsed:.0f}s elapsed", file=sys.stderr)
+
+    try:
+        for offset, record_id, code, error in read_records(stream, args.id_field, args.code_field, skip):
+            classifier.submit(offset, record_id, code, error)
+            if not classifier.flush(out):
+                continue
+            if checkpoint_path and classifier.records - last_checkpoint_records >= args.checkpoint_every:
+                checkpoint()
+                last_checkpoint_records = classifier.records
+            if time.monotonic() - last_report_time >= args.progress_seconds:
+                report()
+                last_report_time = time.monotonic()
+        classifier.flush(out, full=True)
+        if checkpoint_path:
+            checkpoint()
+        out.flush()
+        report(final=True)
+    finally:
+        pool.close()
+        if input_path:
+            stream.close()
+        if output_path:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+from typing import Any, Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+from Embedding import _pad_batch, bucket_by_length
+
+FORMAT_VERSION = 1
+HEADER = "header.json"
+# Column files: one int64 offset per example plus the end offset, then int32 ids
+OFFSETS = "offsets.i64"
+LABELS = "labels.i32"
+COLUMNS = ("start_tokens", "paths", "end_tokens")
+
+
+def vocabulary_hash(token_to_idx: Dict[str, int], path_to_idx: Dict[str, int]) -> str:
+    """Digest of both vocabularies; stores built with a different vocabulary hold meaningless ids"""
+    digest = hashlib.blake2b(digest_size=16)
+    for vocab in (token_to_idx, path_to_idx):
+        digest.update(json.dumps(sorted(vocab.items(), key=lambda item: item[1]), ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def write_context_store(
+    output_dir: str,
+    examples: Iterable[Tuple[Sequence, Any]],
+    token_to_idx: Dict[str, int],
+    path_to_idx: Dict[str, int],
+    label_to_idx: Dict[str, int],
+    unk_token: str = "<UNK>"
+) -> Dict[str, Any]:
+    """Write (contexts, label) examples as a binary context store and return its header.
+
+    Contexts are [start_token, path, end_token] lists or the dicts of
+    transform_to_training_data. Examples are streamed straight to the column
+    files; the header is written last, so a store without one is incomplete.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    unk_token_id, unk_path_id = token_to_idx[unk_token], path_to_idx[unk_token]
+    files = {name: open(os.path.join(output_dir, f"{name}.i32"), 'wb') for name in COLUMNS}
+    offsets = open(os.path.join(output_dir, OFFSETS), 'wb')
+    labels = open(os.path.join(output_dir, LABELS), 'wb')
+
+    count = total = 0
+    try:
+        offsets.write(np.zeros(1, dtype=np.int64).tobytes())
+        for contexts, label in examples:
+            if label not in label_to_idx:
+                raise ValueError(f"Label {label!r} is not in the label map")
+            triples = [
+                (c["start_token"], c["path"], c["end_token"]) if isinstance(c, dict) else c
+                for c in contexts
+            ]
+            columns = (
+                [token_to_idx.get(start, unk_token_id) for start, _, _ in triples],
+                [path_to_idx.get(path, unk_path_id) for _, path, _ in triples],
+                [token_to_idx.get(end, unk_token_id) for _, _, end in triples],
+            )
+            for name, ids in zip(COLUMNS, columns):
+                files[name].write(np.asarray(ids, dtype=np.int32).tobytes())
+            total += len(triples)
+            count += 1
+            offsets.write(np.int64(total).tobytes())
+            labels.write(np.int32(label_to_idx[label]).tobytes())
+    finally:
+        for f in (*files.values(), offsets, labels):
+            f.close()
+
+    header = {
+        'version': FORMAT_VERSION,
+        'examples': count,
+        'contexts': total,
+        'vocab_hash': vocabulary_hash(token_to_idx, path_to_idx),
+        'label_to_idx': label_to_idx,
+    }
+    tmp = os.path.join(output_dir, HEADER + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(header, f, indent=4)
+    os.replace(tmp, os.path.join(output_dir, HEADER))
+    return header
+
+
+class ContextStore:
+    """Read-only view of a binary context store through memory maps.
+
+    Examples are slices of the mapped id columns, so nothing is copied until
+    a batch is collated, and every process reading the same store shares the
+    OS page cache. Maps are opened lazily per process; pickling a store (e.g.
+    into DataLoader workers) only sends its path.
+    """
+
+    def __init__(self, path: str, vocab_hash: Optional[str] = None):
+        self.path = path
+        with open(os.path.join(path, HEADER), 'r') as f:
+            self.header = json.load(f)
+        if self.header.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported context store version {self.header.get('version')}")
+        if vocab_hash is not None and self.header['vocab_hash'] != vocab_hash:
+            raise ValueError("Context store was built with a different vocabulary")
+        self.label_to_idx: Dict[str, int] = self.header['label_to_idx']
+        self._maps: Optional[Dict[str, np.ndarray]] = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_maps'] = None
+        return state
+
+    @property
+    def maps(self) -> Dict[str, np.ndarray]:
+        if self._maps is None:
+            maps = {
+                'offsets': self._map(OFFSETS, np.int64, self.header['examples'] + 1),
+                'labels': self._map(LABELS, np.int32, self.header['examples']),
+            }
+            for name in COLUMNS:
+                maps[name] = self._map(f"{name}.i32", np.int32, self.header['contexts'])
+            self._maps = maps
+        return self._maps
+
+    def _map(self, name: str, dtype, length: int) -> np.ndarray:
+        path = os.path.join(self.path, name)
+        if os.path.getsize(path) != length * np.dtype(dtype).itemsize:
+            raise ValueError(f"{name} does not match the context store header")
+        if not length:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', shape=(length,))
+
+    def __len__(self) -> int:
+        return self.header['examples']
+
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.maps['offsets'])
+
+    def labels(self) -> np.ndarray:
+        return self.maps['labels']
+
+    def __getitem__(self, index: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+        """(start_tokens, paths, end_tokens, label) of one example, as views into the maps"""
+        maps = self.maps
+        start, stop = maps['offsets'][index], maps['offsets'][index + 1]
+        return (*(maps[name][start:stop] for name in COLUMNS), int(maps['labels'][index]))
+
+    def collate(self, indices: Sequence[int], max_contexts: int = 200) -> Dict[str, torch.Tensor]:
+        """Padded id tensors plus a 'labels' tensor, in the layout of collate_context_ids"""
+        maps = self.maps
+        offsets = maps['offsets']
+        starts = offsets[indices]
+        lengths = np.minimum(offsets[np.asarray(indices) + 1] - starts, max_contexts)
+        columns = [
+            np.concatenate([maps[name][start:start + n] for start, n in zip(starts, lengths)]).astype(np.int64)
+            if len(indices) else np.zeros(0, dtype=np.int64)
+            for name in COLUMNS
+        ]
+        batch = _pad_batch(columns, lengths)
+        batch['labels'] = torch.from_numpy(maps['labels'][indices].astype(np.int64))
+        return batch
+
+
+class ContextBatches(Dataset):
+    """Dataset of ready-to-use batches from a ContextStore.
+
+    Item i is the collated batch i: id tensors, mask and labels. With
+    `bucket=True` examples are grouped by length to minimise padding; batches
+    are shuffled with `seed` (call `set_epoch` to reshuffle). Use it with
+    `DataLoader(batches, batch_size=None)`.
+    """
+
+    def __init__(
+        self,
+        store: ContextStore,
+        batch_size: int = 64,
+        max_contexts: int = 200,
+        shuffle: bool = True,
+        bucket: bool = True,
+        seed: int = 0,
+        indices: Optional[Sequence[int]] = None
+    ):
+        self.store = store
+        self.batch_size = batch_size
+        self.max_contexts = max_contexts
+        self.shuffle = shuffle
+        self.bucket = bucket
+        self.seed = seed
+        self.indices = list(range(len(store))) if indices is None else list(indices)
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch: int) -> None:
+        rng = random.Random(self.seed + epoch)
+        indices = list(self.indices)
+        if self.shuffle:
+            rng.shuffle(indices)
+        if self.bucket:
+            lengths = np.minimum(self.store.lengths()[indices], self.max_contexts).tolist()
+            self.batches = [[indices[i] for i in batch] for batch in bucket_by_length(lengths, self.batch_size)]
+        else:
+            self.batches = [indices[i:i + self.batch_size] for i in range(0, len(indices), self.batch_size)]
+        if self.shuffle:
+            rng.shuffle(self.batches)
+
+    def __len__(self) -> int:
+        return len(self.batches)
+
+    def __getitem__(self, index: int) -> Dict[str, torch.Tensor]:
+        return self.store.collate(self.batches[index], self.max_contexts)
+
+    def __iter__(self) -> Iterator[Dict[str, torch.Tensor]]:
+        for index in range(len(self)):
+            yield self[index]
+
+
+def main():
+    from training_data import iter_training_data
+
+    parser = argparse.ArgumentParser(description="Convert sharded training data (see training_data.py) into a binary context store")
+    parser.add_argument("training_data", help="directory written by training_data.py")
+    parser.add_argument("output_dir")
+    parser.add_argument("--seed", type=int, default=0, help="seeds the example order")
+    parser.add_argument("--buffer-size", type=int, default=10000, help="shuffle buffer size, 1 keeps the order within shards")
+    args = parser.parse_args()
+
+    # Resolve user paths first: the vocabulary and label map live next to the model
+    training_dir, output_dir = os.path.abspath(args.training_data), os.path.abspath(args.output_dir)
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    vocab_data = torch.load('./algorithm_analysis/vocab_data.pt', weights_only=True)
+    with open('./algorithm_analysis/label_map.json', 'r') as f:
+        label_to_idx = json.load(f)
+
+    examples = (
+        (example['contexts'], example['label'])
+        for example in iter_training_data(training_dir, args.seed, args.buffer_size)
+    )
+    header = write_context_store(output_dir, examples, vocab_data['token_to_idx'], vocab_data['path_to_idx'], label_to_idx)
+    print(f"Context store written to {output_dir}: {header['examples']} examples, {header['contexts']} contexts")
+
+
+if __name__ == "__main__":
+    main()
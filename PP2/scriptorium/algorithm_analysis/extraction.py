@@ -0,0 +1,155 @@
+import multiprocessing
+import threading
+import time
+from array import array
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Tuple, Union
+from AST import PathContextExtractor, CompactAST, CompiledVocabulary, ContextIds, ContextSampling, ExtractionStats, canonical_key
+from scheduler import QueueFull
+
+# Spawned extraction workers import this module, so it must not pull in torch
+
+# Set up once per worker process by _init_worker
+_extractor: Optional[PathContextExtractor] = None
+_vocab: Optional[CompiledVocabulary] = None
+_max_nodes: Optional[int] = None
+
+
+def _init_worker(token_to_idx: Dict[str, int], path_to_idx: Dict[str, int], unk_token: str,
+                 max_nodes: Optional[int], sampling: ContextSampling) -> None:
+    global _extractor, _vocab, _max_nodes
+    _extractor = PathContextExtractor(sampling)
+    _vocab = CompiledVocabulary(token_to_idx, path_to_idx, unk_token)
+    _max_nodes = max_nodes
+
+
+def with_parse_stats(contexts: ContextIds, parse_stats: ExtractionStats) -> ContextIds:
+    """Copy the parse timing and fallback flag of a separately parsed snippet into its ContextIds stats"""
+    contexts.stats.parse_seconds = parse_stats.parse_seconds
+    contexts.stats.fallback = parse_stats.fallback
+    return contexts
+
+
+def _parse(code: Union[str, CompactAST]) -> Tuple[str, CompactAST, Optional[array], ExtractionStats]:
+    """Cache key, tree and source line per node of a snippet, with its parse stats"""
+    if isinstance(code, CompactAST):
+        node_lines = code.node_lines() if code.has_positions else None
+        return canonical_key(code), code, node_lines, ExtractionStats()
+    started = time.perf_counter()
+    parsed, line_offset = _extractor.parse_snippet(code)
+    tree = CompactAST.from_ast(parsed, _max_nodes, positions=True)
+    stats = ExtractionStats(parse_seconds=time.perf_counter() - started, fallback=line_offset > 0)
+    return canonical_key(tree), tree, tree.node_lines(line_offset), stats
+
+
+def _extract_tree(tree: CompactAST) -> ContextIds:
+    started = time.perf_counter()
+    contexts = _extractor.extract_context_ids(tree, _vocab)
+    # Timings travel back with the result, the serving process records them
+    contexts.stats.extract_seconds = time.perf_counter() - started
+    return contexts
+
+
+def _extract(code: Union[str, CompactAST]) -> Tuple[str, ContextIds, Optional[array]]:
+    key, tree, node_lines, parse_stats = _parse(code)
+    return key, with_parse_stats(_extract_tree(tree), parse_stats), node_lines
+
+
+class ExtractionPool:
+    """Parses snippets and extracts their context ids in worker processes.
+
+    Extraction is pure Python and holds the GIL, so running it in processes
+    keeps it from serializing request threads. Each submitted snippet resolves
+    to its cache key, ContextIds and source line per node, or fails with ValueError if it doesn't
+    parse or has more than `max_nodes` syntax tree nodes. `parse` and `extract` split the same
+    work in two jobs, so a caller can check its cache between them. At most `max_pending` jobs
+    are queued or running at once; past that submitting raises QueueFull.
+    """
+
+    def __init__(
+        self,
+        token_to_idx: Dict[str, int],
+        path_to_idx: Dict[str, int],
+        unk_token: str = "<UNK>",
+        workers: Optional[int] = None,
+        max_pending: int = 256,
+        max_nodes: Optional[int] = None,
+        sampling: ContextSampling = ContextSampling(),
+        mp_context: Optional[str] = None
+    ):
+        if max_pending < 1:
+            raise ValueError("max_pending must be at least 1")
+        self.max_pending = max_pending
+        self._initargs = (token_to_idx, path_to_idx, unk_token, max_nodes, sampling)
+        self._workers = workers
+        if mp_context is None:
+            mp_context = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        self._context = multiprocessing.get_context(mp_context)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._executor = self._new_executor()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        executor = ProcessPoolExecutor(
+            max_workers=self._workers,
+            mp_context=self._context,
+            initializer=_init_worker,
+            initargs=self._initargs
+        )
+        # Start the workers now rather than on the first request. Forked workers
+        # only run extraction, never torch, and are created before any request
+        # thread could be holding a lock they would inherit.
+        executor.submit(int).result()
+        return executor
+
+    def submit(self, code: Union[str, CompactAST]) -> Future:
+        """Queue a snippet (source or parsed CompactAST) and return a Future of (cache key, ContextIds, node lines)"""
+        return self._queue(_extract, code)
+
+    def parse(self, code: Union[str, CompactAST]) -> Future:
+        """Queue a snippet and return a Future of (cache key, CompactAST, node lines, parse ExtractionStats)"""
+        return self._queue(_parse, code)
+
+    def extract(self, tree: CompactAST) -> Future:
+        """Queue a parsed snippet and return a Future of its ContextIds"""
+        return self._queue(_extract_tree, tree)
+
+    def _queue(self, job, code) -> Future:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull(f"{self._pending} snippets already being extracted")
+            self._pending += 1
+
+        try:
+            future = self._submit(job, code)
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _submit(self, job, code) -> Future:
+        executor = self._executor
+        try:
+            return executor.submit(job, code)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool once
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = self._new_executor()
+                executor = self._executor
+            return executor.submit(job, code)
+
+    def _release(self, _future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def pending(self) -> int:
+        """Number of snippets queued or being extracted"""
+        with self._lock:
+            return self._pending
+
+    def close(self) -> None:
+        """Cancel queued snippets and stop the workers"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,353 @@
+import json
+import math
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as _Tally
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Prometheus text exposition without a client library dependency
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a cached small snippet up to a huge file
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Registry:
+    """Metrics exposed together in one /metrics response"""
+
+    def __init__(self):
+        self._metrics: List["_Metric"] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: "_Metric") -> None:
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        return "".join(metric.render() for metric in metrics)
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...], extra: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def _samples(self) -> Iterator[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self._samples())
+        return "\n".join(lines) + "\n"
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, self._labels(key), value
+
+
+class Gauge(_Metric):
+    """A value that is set, or read from a callback at scrape time"""
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function: Callable[[], float], **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, function in functions.items():
+            try:
+                values[key] = function()
+            except Exception:
+                continue
+        for key, value in sorted(values.items()):
+            yield self.name, self._labels(key), value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS,
+                 registry: Optional[Registry] = REGISTRY):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Per label set: a count per bucket (not cumulative), the sum and the count
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted((key, ([*state[0]], state[1], state[2])) for key, state in self._values.items())
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", self._labels(key, [("le", _format_value(bound))]), cumulative
+            yield f"{self.name}_sum", self._labels(key), total
+            yield f"{self.name}_count", self._labels(key), count
+
+
+# Predictor and extractor instrumentation, recorded in the serving process
+STAGE_SECONDS = Histogram(
+    "analysis_stage_seconds", "Time spent per snippet (parse, extract) or per batch (collate, forward)", ["stage"]
+)
+BATCH_SIZE = Histogram("analysis_batch_size", "Snippets per forward pass", buckets=SIZE_BUCKETS)
+TERMINALS = Counter("analysis_terminals_total", "Terminal nodes considered as context starts")
+PAIRS = Counter("analysis_pairs_examined_total", "Valid terminal pairs examined during extraction")
+CONTEXTS = Counter("analysis_contexts_kept_total", "Path contexts kept for classification")
+NODE_VISITS = Counter("analysis_node_visits_total", "Syntax tree nodes visited during extraction")
+CACHE_HITS = Counter(
+    "analysis_cache_hits_total", "Snippets answered by the prediction cache, which skip the extract, collate and forward stages"
+)
+PARSE_FALLBACKS = Counter("analysis_parse_fallbacks_total", "Snippets that only parsed wrapped in a function")
+EXTRACTION_FAILURES = Counter("analysis_extraction_failures_total", "Snippets that failed to parse or extract")
+QUEUE_DEPTH = Gauge("analysis_queue_depth", "Snippets waiting in a serving queue", ["queue"])
+CACHE = Gauge("analysis_cache", "Prediction cache statistics", ["stat"])
+
+# HTTP instrumentation, recorded by app.py and asgi.py
+HTTP_REQUESTS = Counter("analysis_http_requests_total", "HTTP requests by route and status", ["route", "status"])
+HTTP_SECONDS = Histogram("analysis_http_request_seconds", "HTTP request latency by route", ["route"])
+SLOW_REQUESTS = Counter("analysis_slow_requests_total", "Requests profiled for exceeding the slow request threshold", ["route"])
+
+
+def record_extraction(stats) -> None:
+    """Record the ExtractionStats of one snippet, wherever it was extracted"""
+    if stats is None:
+        return
+    if stats.parse_seconds is not None:
+        STAGE_SECONDS.observe(stats.parse_seconds, stage="parse")
+    STAGE_SECONDS.observe(stats.extract_seconds, stage="extract")
+    TERMINALS.inc(stats.terminals)
+    PAIRS.inc(stats.pairs)
+    CONTEXTS.inc(stats.contexts)
+    NODE_VISITS.inc(stats.visits)
+    if stats.fallback:
+        PARSE_FALLBACKS.inc()
+
+
+def route_label(path: str, routes) -> str:
+    """Known routes keep their path, anything else is grouped so labels stay bounded"""
+    return path if path in routes or path == "/metrics" else "other"
+
+
+# (profiler, request id) of the tracked requests the current code is doing work for
+_PROFILED: ContextVar[Tuple[Tuple["SlowRequestProfiler", int], ...]] = ContextVar("profiled_requests", default=())
+
+
+def profiled_requests() -> Tuple[Tuple["SlowRequestProfiler", int], ...]:
+    """The tracked requests the current code works for, to hand over with work submitted elsewhere"""
+    return _PROFILED.get()
+
+
+@contextmanager
+def serving(requests: Sequence[Tuple["SlowRequestProfiler", int]]):
+    """Sample the calling thread into each of `requests` while it does their work, e.g. runs their batch"""
+    requests = tuple(dict.fromkeys(requests))
+    ident = threading.get_ident()
+    for profiler, request_id in requests:
+        profiler._attach(request_id, ident)
+    reset = _PROFILED.set(requests)
+    try:
+        yield
+    finally:
+        _PROFILED.reset(reset)
+        for profiler, request_id in requests:
+            profiler._detach(request_id, ident)
+
+
+def run_serving(requests: Sequence[Tuple["SlowRequestProfiler", int]], function: Callable, *args):
+    """Call `function` in `serving(requests)`, for work handed to an executor"""
+    with serving(requests):
+        return function(*args)
+
+
+class SlowRequestProfiler:
+    """Opt-in sampling profiler that dumps stacks of requests slower than a threshold.
+
+    While any tracked request is in flight, a background thread samples the
+    stacks of the threads working for it every `interval` seconds, so
+    concurrent requests don't show up in each other's dumps. That is the
+    request's own thread (the one that called `start`), plus any thread in
+    `serving` it, which is how the scheduler, pipeline and executor threads
+    report the batches they run to every request in them; extraction in
+    worker processes is not sampled. Requests that take at least `threshold`
+    seconds are appended to `output` as a JSON line with their route,
+    duration and sampled stacks in collapsed form, most frequent first.
+    """
+
+    def __init__(self, threshold: float, output: str, interval: float = 0.005, max_stacks: int = 50):
+        self.threshold = threshold
+        self.output = output
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self._active: Dict[int, Tuple[_Tally, _Tally]] = {}  # request id -> (thread ids, stack samples)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+        self._thread.start()
+
+    def start(self) -> Tuple[int, float]:
+        """Begin sampling the calling thread for a request; pass the returned token to `finish`"""
+        with self._lock:
+            request_id = self._next_id
+            self._next_id += 1
+            self._active[request_id] = (_Tally([threading.get_ident()]), _Tally())
+        _PROFILED.set(((self, request_id),))
+        self._wake.set()
+        return request_id, time.perf_counter()
+
+    def finish(self, token: Tuple[int, float], route: str) -> None:
+        request_id, start = token
+        elapsed = time.perf_counter() - start
+        if (self, request_id) in _PROFILED.get():
+            _PROFILED.set(())
+        with self._lock:
+            _, samples = self._active.pop(request_id)
+            if not self._active:
+                self._wake.clear()
+        if elapsed >= self.threshold:
+            SLOW_REQUESTS.inc(route=route)
+            self._dump(route, elapsed, samples)
+
+    @contextmanager
+    def track(self, route: str):
+        token = self.start()
+        try:
+            yield
+        finally:
+            self.finish(token, route)
+
+    def _attach(self, request_id: int, ident: int) -> None:
+        with self._lock:
+            if request_id in self._active:
+                self._active[request_id][0][ident] += 1
+
+    def _detach(self, request_id: int, ident: int) -> None:
+        with self._lock:
+            if request_id in self._active:
+                idents = self._active[request_id][0]
+                idents[ident] -= 1
+                if idents[ident] <= 0:
+                    del idents[ident]
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks: Dict[int, str] = {}
+            with self._lock:
+                for idents, samples in self._active.values():
+                    for ident in idents:
+                        if ident not in stacks and ident in frames:
+                            stacks[ident] = f"{names.get(ident, ident)};" + ";".join(
+                                f"{os.path.basename(frame.filename)}:{frame.name}:{frame.lineno}"
+                                for frame in traceback.extract_stack(frames[ident])
+                            )
+                        if ident in stacks:
+                            samples[stacks[ident]] += 1
+
+    def _dump(self, route: str, elapsed: float, samples: _Tally) -> None:
+        record = {
+            "time": time.time(),
+            "route": route,
+            "seconds": round(elapsed, 4),
+            "interval_seconds": self.interval,
+            "samples": sum(samples.values()),
+            "stacks": [{"stack": stack, "count": count} for stack, count in samples.most_common(self.max_stacks)],
+        }
+        with self._write_lock, open(self.output, "a") as f:
+            f.write(json.dumps(record) + "\n")
@@ -0,0 +1,147 @@
+import torch
+from array import array
+from concurrent.futures import Future
+from dataclasses import replace
+from typing import Dict, Optional, Union
+from AST import CompactAST, ExtractionStats, canonical_key
+from extraction import ExtractionPool, with_parse_stats
+import metrics
+from predict import CodePredictor, Prediction, with_line_weights
+from scheduler import MicroBatchScheduler
+
+
+class InferencePipeline:
+    """Serves single-snippet predictions through two bounded stages.
+
+    Extraction runs in an ExtractionPool of worker processes, inference runs
+    in a MicroBatchScheduler thread that coalesces extracted snippets into
+    forward passes. A huge submission only occupies one extraction worker
+    while inference keeps serving everyone else. Results are shared through
+    the predictor's cache, which is checked once a snippet is parsed, so
+    repeats skip extraction as well as inference. Both stages are bounded:
+    `submit` raises QueueFull when parsing is at capacity, and the returned
+    Future fails with QueueFull when extraction or inference is.
+
+    `inference_threads` sets torch's intra-op thread count for this process,
+    which the extraction workers don't share. The submitter's profiled
+    requests follow the snippet from stage to stage.
+    """
+
+    def __init__(
+        self,
+        predictor: CodePredictor,
+        extract_workers: Optional[int] = None,
+        max_pending_extractions: int = 256,
+        inference_threads: Optional[int] = None,
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+        max_pending_inference: int = 256
+    ):
+        if inference_threads:
+            torch.set_num_threads(inference_threads)
+        self.predictor = predictor
+        vocab = predictor.vocab_builder
+        self.extraction = ExtractionPool(
+            vocab.token_to_idx, vocab.path_to_idx, vocab.unk_token,
+            workers=extract_workers,
+            max_pending=max_pending_extractions,
+            max_nodes=predictor.max_nodes,
+            sampling=predictor.sampling
+        )
+        self.inference = MicroBatchScheduler(
+            predictor.predict_contexts,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            max_queue_size=max_pending_inference,
+            name="inference"
+        )
+
+    def submit(self, code: Union[str, CompactAST]) -> Future:
+        """Queue a snippet (source or parsed CompactAST) and return a Future resolved with its Prediction"""
+        result = Future()
+        if isinstance(code, CompactAST):
+            # Already parsed, hashing it here is cheaper than a round trip to a worker
+            node_lines = code.node_lines() if code.has_positions else None
+            self._claim(canonical_key(code), code, node_lines, ExtractionStats(), result)
+        else:
+            requests = metrics.profiled_requests()
+            self.extraction.parse(code).add_done_callback(lambda parsing: self._parsed(parsing, result, requests))
+        return result
+
+    def _parsed(self, parsing: Future, result: Future, requests) -> None:
+        try:
+            key, tree, node_lines, parse_stats = parsing.result()
+        except Exception as e:
+            metrics.EXTRACTION_FAILURES.inc()
+            _settle(result, Prediction(error=str(e)))
+            return
+        # Runs in the pool's result thread; the work queued from here still belongs to the submitter's requests
+        with metrics.serving(requests):
+            self._claim(key, tree, node_lines, parse_stats, result)
+
+    def _claim(self, key: str, tree: CompactAST, node_lines: Optional[array], parse_stats: ExtractionStats,
+               result: Future) -> None:
+        cached, is_owner = self.predictor.cache.claim(key)
+        if is_owner:
+            try:
+                extraction = self.extraction.extract(tree)
+            except Exception as e:
+                self.predictor.cache.fail(key, e)
+            else:
+                requests = metrics.profiled_requests()
+                extraction.add_done_callback(lambda done: self._extracted(done, key, parse_stats, requests))
+        else:
+            if parse_stats.parse_seconds is not None:
+                metrics.STAGE_SECONDS.observe(parse_stats.parse_seconds, stage='parse')
+            metrics.CACHE_HITS.inc()
+        cached.add_done_callback(lambda done: self._resolved(done, result, node_lines))
+
+    def _extracted(self, extraction: Future, key: str, parse_stats: ExtractionStats, requests) -> None:
+        try:
+            contexts = with_parse_stats(extraction.result(), parse_stats)
+        except Exception as e:
+            metrics.EXTRACTION_FAILURES.inc()
+            self.predictor.cache.fail(key, e)
+            return
+        metrics.record_extraction(contexts.stats)
+        try:
+            with metrics.serving(requests):
+                inference = self.inference.submit(contexts)
+        except Exception as e:
+            self.predictor.cache.fail(key, e)
+        else:
+            inference.add_done_callback(lambda done: self._inferred(done, key))
+
+    def _inferred(self, inference: Future, key: str) -> None:
+        try:
+            prediction = inference.result()
+        except Exception as e:
+            self.predictor.cache.fail(key, e)
+            return
+        self.predictor.cache.resolve(key, prediction)
+
+    def _resolved(self, cached: Future, result: Future, node_lines: Optional[array]) -> None:
+        try:
+            _settle(result, with_line_weights(replace(cached.result()), node_lines))
+        except Exception as e:
+            _settle(result, error=e)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "extraction_pending": self.extraction.pending(),
+            "inference_pending": self.inference.pending(),
+        }
+
+    def close(self) -> None:
+        self.extraction.close()
+        self.inference.close()
+
+
+def _settle(future: Future, value=None, error: Optional[BaseException] = None) -> None:
+    # The caller may have cancelled while the snippet was in flight
+    if not future.set_running_or_notify_cancel():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(value)
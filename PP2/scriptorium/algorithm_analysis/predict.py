@@ -1,14 +1,88 @@
 import torch
 import json
-from Embedding import VocabularyBuilder, collate_path_contexts
-from Classifier import ImprovedCodeClassifier
-from AST import PathContextExtractor
+import os
+import hashlib
+import time
+import warnings
+from array import array
+from collections import defaultdict
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional, Tuple, Union
+from Embedding import VocabularyBuilder, bucket_by_length, collate_context_ids
+from Classifier import ImprovedCodeClassifier, make_probe_batch, max_output_difference
+from AST import PathContextExtractor, CompactAST, CompiledVocabulary, ContextIds, ContextSampling, FunctionUnit, canonical_key, split_functions
+from cache import PredictionCache
+import metrics
 
+MODEL_PATH = './algorithm_analysis/code_classifier.pt'
+# TorchScript artifact cached next to the trained weights
+COMPILED_MODEL_PATH = './algorithm_analysis/code_classifier.jit.pt'
+# Written by quantization_gate.py; a quantized variant is only served if approved here
+QUANTIZATION_REPORT_PATH = './algorithm_analysis/quantization_report.json'
+QUANTIZE_MODES = ('int8', 'int8-embeddings')
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Error of snippets without any terminal pair, such as `pass` or `def f(): pass`
+NO_CONTEXTS_ERROR = 'No path contexts'
+
+
+@dataclass
+class Prediction:
+    """Result of classifying a single snippet within a batch"""
+    label: Optional[str] = None
+    confidence: float = 0.0
+    attention_weights: Optional[torch.Tensor] = None
+    code_vector: Optional[torch.Tensor] = None
+    probabilities: Optional[torch.Tensor] = None
+    error: Optional[str] = None
+    # CompactAST indices of each context's start and end terminals
+    context_nodes: Optional[Tuple[array, array]] = None
+    # (line, share of attention) for the lines of this snippet's source, in line order
+    line_weights: Optional[List[Tuple[int, float]]] = None
+
+
+def line_heatmap(attention_weights: torch.Tensor, context_nodes: Tuple[array, array], node_lines: array) -> List[Tuple[int, float]]:
+    """Aggregate per-context attention into per-line weights that sum to 1.
+
+    Each context's weight is split evenly between the lines of its two terminals.
+    """
+    weights: Dict[int, float] = defaultdict(float)
+    start_nodes, end_nodes = context_nodes
+    for weight, start, end in zip(attention_weights.tolist(), start_nodes, end_nodes):
+        weights[node_lines[start]] += weight / 2
+        weights[node_lines[end]] += weight / 2
+    weights = {line: weight for line, weight in weights.items() if line > 0}
+    total = sum(weights.values())
+    if not total > 0:
+        return []
+    return [(line, weights[line] / total) for line in sorted(weights)]
+
+
+def with_line_weights(prediction: Prediction, node_lines: Optional[array]) -> Prediction:
+    """Attach the line heat map of a (possibly cached) prediction for this snippet's positions"""
+    if node_lines is not None and prediction.context_nodes is not None:
+        prediction.line_weights = line_heatmap(prediction.attention_weights, prediction.context_nodes, node_lines)
+    return prediction
 
 
 class CodePredictor:
-    def __init__(self, model_dir='.'):
-        """Initialize CodePredictor with model and vocabularies."""
+    def __init__(self, model_dir='.', cache_size=1024, optimize=True, compile_model=False, parity_tolerance=1e-4,
+                 quantize=None, quantization_report=QUANTIZATION_REPORT_PATH, max_nodes=None,
+                 sampling=ContextSampling()):
+        """Initialize CodePredictor with model and vocabularies.
+
+        Snippets whose syntax tree has more than max_nodes nodes are rejected.
+        `sampling` picks the contexts of large snippets and bounds extraction work.
+        """
         with open('./algorithm_analysis/label_map.json', 'r') as f:
             self.label_to_idx = json.load(f)
         self.idx_to_label = {v: k for k, v in self.label_to_idx.items()}
@@ -18,6 +92,7 @@ class CodePredictor:
         self.vocab_builder = VocabularyBuilder()
         self.vocab_builder.token_to_idx = vocab_data['token_to_idx']
         self.vocab_builder.path_to_idx = vocab_data['path_to_idx']
+        self.vocab = CompiledVocabulary.from_vocab(self.vocab_builder)
         
         # Initialize improved model
         self.model = ImprovedCodeClassifier(
@@ -30,36 +105,262 @@ class CodePredictor:
         )
         
         # Load trained weights
-        self.model.load_state_dict(torch.load('./algorithm_analysis/code_classifier.pt', weights_only=True))
+        self.model.load_state_dict(torch.load(MODEL_PATH, weights_only=True))
         self.model.eval()
+        self.device = next(self.model.parameters()).device
+        if quantize is not None and self._quantization_approved(quantize, quantization_report):
+            self.model = self.model.quantized_for_inference(quantize_embeddings=quantize == 'int8-embeddings')
+        elif optimize:
+            self._optimize_model(parity_tolerance)
+        if compile_model:
+            self._compile_model(parity_tolerance)
+
+        self.max_nodes = max_nodes
+        self.sampling = sampling
+        # Identical snippets (up to formatting and comments) share one result
+        self.cache = PredictionCache(max_entries=cache_size)
+
+    def _optimize_model(self, tolerance):
+        """Swap in the inference-optimized model if it matches the trained one."""
+        optimized = self.model.optimized_for_inference()
+        probe = make_probe_batch(len(self.vocab_builder.token_to_idx), len(self.vocab_builder.path_to_idx))
+        difference = max_output_difference(self.model, optimized, probe)
+        if difference > tolerance:
+            warnings.warn(f"Optimized model differs from the trained model by {difference:.2e}, keeping the eager model")
+            return
+        self.model = optimized
+
+    def _quantization_approved(self, mode, report_path):
+        """Check that quantization_gate.py approved this int8 mode for these weights.
+
+        Pass report_path=None to skip the check (the gate itself does, to evaluate it).
+        """
+        if mode not in QUANTIZE_MODES:
+            raise ValueError(f"Unknown quantize mode {mode!r}, expected one of {QUANTIZE_MODES}")
+        if report_path is None:
+            return True
+
+        try:
+            with open(report_path, 'r') as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            report = {}
+        approved = (
+            report.get('approved') is True
+            and report.get('mode') == mode
+            and report.get('model_sha256') == file_digest(MODEL_PATH)
+        )
+        if not approved:
+            warnings.warn(f"Quantized mode {mode!r} is not approved for this model in {report_path}, keeping the fp32 model")
+        return approved
+
+    def _compile_model(self, tolerance):
+        """Swap in a frozen TorchScript model, cached on disk, falling back to eager on any failure."""
+        try:
+            # FutureWarnings here only announce the TorchScript deprecation
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', FutureWarning)
+                compiled = self._load_or_trace_model()
+            probe = make_probe_batch(len(self.vocab_builder.token_to_idx), len(self.vocab_builder.path_to_idx))
+            difference = max_output_difference(self.model, compiled, probe)
+        except Exception as e:
+            warnings.warn(f"Could not compile the model, keeping the eager model: {e}")
+            return
+        if difference > tolerance:
+            warnings.warn(f"Compiled model differs from the eager model by {difference:.2e}, keeping the eager model")
+            return
+        self.model = compiled
+
+    def _load_or_trace_model(self):
+        # The artifact is only reused if it was traced from these exact weights and settings
+        digest = hashlib.sha256(file_digest(MODEL_PATH).encode())
+        digest.update(torch.__version__.encode())
+        digest.update(repr(self.model).encode())
+        fingerprint = digest.hexdigest()
+
+        if os.path.exists(COMPILED_MODEL_PATH):
+            extra_files = {'fingerprint': ''}
+            try:
+                compiled = torch.jit.load(COMPILED_MODEL_PATH, map_location=self.device, _extra_files=extra_files)
+                if extra_files['fingerprint'] == fingerprint.encode():
+                    return compiled
+            except RuntimeError as e:
+                warnings.warn(f"Ignoring unreadable compiled model, tracing again: {e}")
+
+        example = make_probe_batch(
+            len(self.vocab_builder.token_to_idx), len(self.vocab_builder.path_to_idx),
+            batch_size=4, max_contexts=32
+        )
+        inputs = tuple(example[key].to(self.device) for key in ('start_tokens', 'paths', 'end_tokens', 'mask'))
+        with torch.no_grad():
+            traced = torch.jit.trace_module(self.model, {'classify': inputs})
+        compiled = torch.jit.freeze(traced.eval(), preserved_attrs=['classify'])
+
+        try:
+            torch.jit.save(compiled, COMPILED_MODEL_PATH, _extra_files={'fingerprint': fingerprint})
+        except OSError as e:
+            warnings.warn(f"Could not cache the compiled model: {e}")
+        return compiled
 
     def predict(self, code):
-        """Predict the algorithm for a given list of contexts."""
+        """Predict the algorithm for a given code snippet."""
+        result = self.predict_batch([code])[0]
+        if result.error is not None:
+            raise ValueError(result.error)
+        return result.label, result.confidence, result.attention_weights
+
+    def predict_batch(self, codes: List[Union[str, CompactAST]], bucket_size: Optional[int] = None) -> List[Prediction]:
+        """Predict the algorithm for several snippets with a single forward pass.
+
+        Snippets are source strings or already parsed CompactASTs (such as a
+        template session's selection). Results are returned in input order,
+        with line_weights set when positions are known. A snippet that fails extraction
+        gets a Prediction with `error` set instead of failing the whole batch.
+        Snippets already cached, or being computed by another caller, are not
+        recomputed. With bucket_size set, large batches are split into
+        length-sorted forward passes of at most that many snippets.
+        """
+        results: List[Optional[Prediction]] = [None] * len(codes)
+
         # Prepare input data
-        extractor = PathContextExtractor()
-        contexts = extractor.extract_path_contexts_for_classification(code)
-        batch_data = collate_path_contexts([contexts], self.vocab_builder)
+        extractor = PathContextExtractor(self.sampling)
+        owned = []    # (index, key, context ids) computed by this call
+        waiting = []  # (index, future) served by the cache or another caller
+        node_lines: List[Optional[array]] = [None] * len(codes)
+        # Keys this call claimed and still has to resolve or fail; on any unexpected
+        # error they are all failed, or later identical snippets would wait forever
+        unsettled = set()
+        try:
+            for i, code in enumerate(codes):
+                parse_seconds, line_offset = None, 0
+                try:
+                    if isinstance(code, CompactAST):
+                        tree = code
+                        if tree.has_positions:
+                            node_lines[i] = tree.node_lines()
+                    else:
+                        started = time.perf_counter()
+                        parsed, line_offset = extractor.parse_snippet(code)
+                        tree = CompactAST.from_ast(parsed, self.max_nodes, positions=True)
+                        parse_seconds = time.perf_counter() - started
+                        node_lines[i] = tree.node_lines(line_offset)
+                except Exception as e:
+                    metrics.EXTRACTION_FAILURES.inc()
+                    results[i] = Prediction(error=str(e))
+                    continue
+
+                key = canonical_key(tree)
+                future, is_owner = self.cache.claim(key)
+                if not is_owner:
+                    # Parsed to compute the key, but never extracted or run
+                    if parse_seconds is not None:
+                        metrics.STAGE_SECONDS.observe(parse_seconds, stage='parse')
+                    metrics.CACHE_HITS.inc()
+                    waiting.append((i, future))
+                    continue
+                unsettled.add(key)
+
+                try:
+                    started = time.perf_counter()
+                    contexts = extractor.extract_context_ids(tree, self.vocab)
+                except Exception as e:
+                    metrics.EXTRACTION_FAILURES.inc()
+                    unsettled.discard(key)
+                    self.cache.fail(key, e)
+                    results[i] = Prediction(error=str(e))
+                    continue
+                contexts.stats.extract_seconds = time.perf_counter() - started
+                contexts.stats.parse_seconds = parse_seconds
+                contexts.stats.fallback = line_offset > 0
+                metrics.record_extraction(contexts.stats)
+                owned.append((i, key, contexts))
+
+            if owned:
+                predictions = self.predict_contexts([contexts for _, _, contexts in owned], bucket_size)
+                for (i, key, _), prediction in zip(owned, predictions):
+                    unsettled.discard(key)
+                    self.cache.resolve(key, prediction)
+                    results[i] = with_line_weights(replace(prediction), node_lines[i])
+        except BaseException as e:
+            for key in unsettled:
+                self.cache.fail(key, e)
+            raise
+
+        for i, future in waiting:
+            try:
+                results[i] = with_line_weights(replace(future.result()), node_lines[i])
+            except Exception as e:
+                results[i] = Prediction(error=str(e))
+
+        return results
+
+    def predict_functions(self, code: str, bucket_size: Optional[int] = None) -> List[Tuple[FunctionUnit, Prediction]]:
+        """Classify every function and method of a file separately.
+
+        The file is parsed once and all functions share one forward pass.
+        Raises ValueError if the file doesn't parse.
+        """
+        units = split_functions(code, self.max_nodes)
+        predictions = self.predict_batch([unit.tree for unit in units], bucket_size)
+        return list(zip(units, predictions))
+
+    def predict_contexts(self, batch_contexts: List[ContextIds], bucket_size: Optional[int] = None) -> List[Prediction]:
+        """Run one forward pass over path contexts extracted elsewhere, such as by an ExtractionPool."""
+        if not all(len(contexts) for contexts in batch_contexts):
+            # Attention over zero contexts is NaN, so there is nothing to classify
+            rows = [row for row, contexts in enumerate(batch_contexts) if len(contexts)]
+            predictions = [Prediction(error=NO_CONTEXTS_ERROR) for _ in batch_contexts]
+            if rows:
+                for row, prediction in zip(rows, self.predict_contexts([batch_contexts[row] for row in rows], bucket_size)):
+                    predictions[row] = prediction
+            return predictions
+
+        if bucket_size and len(batch_contexts) > bucket_size:
+            # Snippets of similar length pad far less than one mixed batch
+            predictions: List[Optional[Prediction]] = [None] * len(batch_contexts)
+            for indices in bucket_by_length([len(contexts) for contexts in batch_contexts], bucket_size):
+                bucket = self.predict_contexts([batch_contexts[i] for i in indices])
+                for i, prediction in zip(indices, bucket):
+                    predictions[i] = prediction
+            return predictions
+
+        metrics.BATCH_SIZE.observe(len(batch_contexts))
+        with metrics.STAGE_SECONDS.time(stage='collate'):
+            batch_data = collate_context_ids(batch_contexts)
         
         # Move tensors to the same device as the model
-        device = next(self.model.parameters()).device
-        start_tokens = batch_data['start_tokens'].to(device)
-        paths = batch_data['paths'].to(device)
-        end_tokens = batch_data['end_tokens'].to(device)
-        mask = batch_data['mask'].to(device)
+        start_tokens = batch_data['start_tokens'].to(self.device)
+        paths = batch_data['paths'].to(self.device)
+        end_tokens = batch_data['end_tokens'].to(self.device)
+        mask = batch_data['mask'].to(self.device)
         
         # Make prediction
-        with torch.no_grad():
-            logits, attention_weights = self.model(start_tokens, paths, end_tokens, mask)
+        with torch.inference_mode(), metrics.STAGE_SECONDS.time(stage='forward'):
+            logits, attention_weights, code_vectors = self.model.classify(start_tokens, paths, end_tokens, mask)
             probabilities = torch.softmax(logits, dim=1)
-            predicted_idx = torch.argmax(logits, dim=1).item()
-            confidence = probabilities[0][predicted_idx].item()
-            
-            # Get embeddings for visualization/analysis
-            code_vector, _ = self.model.code_embedding(start_tokens, paths, end_tokens, mask)
-        
-        predicted_label = self.idx_to_label[predicted_idx]
-        
-        return predicted_label, confidence, attention_weights
+            confidences, predicted = probabilities.max(dim=1)
+
+        # Clone rows so cached results don't pin the whole batch tensors
+        return [
+            Prediction(
+                label=self.idx_to_label[predicted[row].item()],
+                confidence=confidences[row].item(),
+                attention_weights=attention_weights[row, :len(contexts)].clone(),
+                code_vector=code_vectors[row].clone(),
+                probabilities=probabilities[row].clone(),
+                context_nodes=(contexts.start_nodes, contexts.end_nodes)
+            )
+            for row, contexts in enumerate(batch_contexts)
+        ]
+
+    def top_k(self, prediction: Prediction, k: int) -> List[Dict[str, float]]:
+        """Return the k most likely labels of a prediction with their probabilities"""
+        k = max(0, min(k, len(self.idx_to_label)))
+        values, indices = prediction.probabilities.topk(k)
+        return [
+            {'label': self.idx_to_label[index.item()], 'probability': value.item()}
+            for value, index in zip(values, indices)
+        ]
 
 # Example usage
 if __name__ == "__main__":
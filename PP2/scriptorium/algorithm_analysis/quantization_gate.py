@@ -0,0 +1,117 @@
+import argparse
+import json
+import math
+import os
+import sys
+
+from predict import CodePredictor, MODEL_PATH, QUANTIZATION_REPORT_PATH, QUANTIZE_MODES, file_digest
+
+SCRIPTORIUM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_examples(path: str) -> list:
+    """Load labeled examples from a JSON list (like data.json) or a JSONL file"""
+    with open(path, 'r') as f:
+        text = f.read()
+    if text.lstrip().startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def evaluate(examples: list, fp32: CodePredictor, quantized: CodePredictor, batch_size: int) -> dict:
+    """Compare fp32 and quantized predictions and confidence on the examples"""
+    evaluated = agree = fp32_correct = quantized_correct = labeled = failed = 0
+    confidence_delta = 0.0
+    compared = 0
+    for start in range(0, len(examples), batch_size):
+        chunk = examples[start:start + batch_size]
+        codes = [example['code'] for example in chunk]
+        for example, reference, candidate in zip(chunk, fp32.predict_batch(codes), quantized.predict_batch(codes)):
+            if reference.error is not None or candidate.error is not None:
+                failed += 1
+                continue
+            evaluated += 1
+            agree += reference.label == candidate.label
+            # Snippets without any path contexts have no meaningful confidence
+            if math.isfinite(reference.confidence) and math.isfinite(candidate.confidence):
+                confidence_delta += abs(reference.confidence - candidate.confidence)
+                compared += 1
+
+            label = example.get('label')
+            if label is None:
+                continue
+            if isinstance(label, int):
+                label = fp32.idx_to_label[label]
+            labeled += 1
+            fp32_correct += reference.label == label
+            quantized_correct += candidate.label == label
+
+    return {
+        'examples': len(examples),
+        'evaluated': evaluated,
+        'failed': failed,
+        'agreement': agree / evaluated if evaluated else 0.0,
+        'mean_confidence_delta': confidence_delta / compared if compared else 0.0,
+        'fp32_accuracy': fp32_correct / labeled if labeled else None,
+        'quantized_accuracy': quantized_correct / labeled if labeled else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Evaluate an int8 variant against fp32 and approve it for serving only if it agrees closely enough"
+    )
+    parser.add_argument("eval_set", help="JSON list or JSONL of {code, label} examples")
+    parser.add_argument("--mode", choices=QUANTIZE_MODES, default="int8")
+    parser.add_argument("--min-agreement", type=float, default=0.99,
+                        help="minimum fraction of examples where both models predict the same label")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.01,
+                        help="maximum allowed drop in accuracy on labeled examples")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--report", default=None,
+                        help=f"where CodePredictor looks for the approval (default {QUANTIZATION_REPORT_PATH})")
+    args = parser.parse_args()
+
+    # Resolve user paths first: CodePredictor loads its files relative to the scriptorium directory
+    eval_set = os.path.abspath(args.eval_set)
+    report_path = os.path.abspath(args.report) if args.report else None
+    os.chdir(SCRIPTORIUM_DIR)
+    report_path = report_path or QUANTIZATION_REPORT_PATH
+
+    examples = load_examples(eval_set)
+    fp32 = CodePredictor(cache_size=0)
+    quantized = CodePredictor(cache_size=0, quantize=args.mode, quantization_report=None)
+    metrics = evaluate(examples, fp32, quantized, args.batch_size)
+
+    reasons = []
+    if metrics['evaluated'] == 0:
+        reasons.append("no examples could be evaluated")
+    if metrics['agreement'] < args.min_agreement:
+        reasons.append(f"agreement {metrics['agreement']:.4f} is below {args.min_agreement}")
+    if metrics['fp32_accuracy'] is not None:
+        drop = metrics['fp32_accuracy'] - metrics['quantized_accuracy']
+        if drop > args.max_accuracy_drop:
+            reasons.append(f"accuracy drops by {drop:.4f}, more than {args.max_accuracy_drop}")
+
+    report = {
+        'mode': args.mode,
+        'model_sha256': file_digest(MODEL_PATH),
+        'eval_set': eval_set,
+        'min_agreement': args.min_agreement,
+        'max_accuracy_drop': args.max_accuracy_drop,
+        **metrics,
+        'approved': not reasons,
+        'reasons': reasons,
+    }
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(json.dumps(report, indent=2))
+    if reasons:
+        print(f"Refusing to enable {args.mode}: " + "; ".join(reasons), file=sys.stderr)
+        sys.exit(1)
+    print(f"Approved {args.mode} for {MODEL_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, List
+import metrics
+
+
+class QueueFull(RuntimeError):
+    """Raised by `submit` when a bounded queue has no room left"""
+
+
+class MicroBatchScheduler:
+    """Coalesces concurrent single-item requests into batches.
+
+    Items are queued by `submit` and handed to `process_batch` in groups of at
+    most `max_batch_size`. A batch is flushed as soon as it is full, or once the
+    oldest queued item has waited `max_wait_ms`. `process_batch` must return
+    one result per item, in order; each caller gets its own result back through
+    the returned Future. With `max_queue_size` set, `submit` raises QueueFull
+    instead of queueing more than that many items.
+
+    `workers` threads take batches in turn, so one slow batch doesn't hold up
+    the items queued behind it. A batch that has started always runs to
+    completion; cancelling its futures only skips items still queued. Items
+    carry the profiled requests of their submitter, and a worker serves
+    all of them while it runs their batch.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+        max_queue_size: int = 0,
+        name: str = "micro-batch-scheduler",
+        workers: int = 1
+    ):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_size = max_queue_size
+
+        self._queue = deque()  # (item, future, enqueued_at, profiled requests)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._workers = [
+            threading.Thread(target=self._run, name=name if workers == 1 else f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, item: Any) -> Future:
+        """Queue an item and return a Future resolved with its result"""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Scheduler is closed")
+            if self.max_queue_size and len(self._queue) >= self.max_queue_size:
+                raise QueueFull(f"{len(self._queue)} items already queued")
+            self._queue.append((item, future, time.monotonic(), metrics.profiled_requests()))
+            self._cond.notify()
+        return future
+
+    def close(self, timeout: float = None) -> None:
+        """Stop accepting items, flush what is queued and stop the workers"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+
+    def pending(self) -> int:
+        """Number of items queued but not yet handed to process_batch"""
+        with self._cond:
+            return len(self._queue)
+
+    def _next_batch(self) -> List[tuple]:
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return []
+
+            # Wait for the batch to fill up, but never past the oldest item's deadline
+            deadline = self._queue[0][2] + self.max_wait
+            while len(self._queue) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = []
+            while self._queue and len(batch) < self.max_batch_size:
+                entry = self._queue.popleft()
+                # Skip callers that cancelled while queued
+                if entry[1].set_running_or_notify_cancel():
+                    batch.append(entry)
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                with self._cond:
+                    if self._closed and not self._queue:
+                        return
+                continue
+
+            items = [item for item, _, _, _ in batch]
+            try:
+                with metrics.serving([request for _, _, _, requests in batch for request in requests]):
+                    results = self.process_batch(items)
+            except Exception as e:
+                for _, future, _, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _, _), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,217 @@
+import hmac
+import os
+import metrics
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+from AST import ContextSampling
+from predict import CodePredictor, MODEL_PATH, Prediction, file_digest
+from pipeline import InferencePipeline
+from scheduler import MicroBatchScheduler
+from metrics import SlowRequestProfiler
+from sessions import SessionStore
+from vector_index import TemplateIndex
+
+
+def env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+def env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+def line_weights_json(prediction: Prediction) -> List[list]:
+    """The prediction's line heat map as [line, weight] pairs, rounded to keep responses small"""
+    return [[line, round(weight, 4)] for line, weight in prediction.line_weights or []]
+
+
+def predictor_from_env() -> CodePredictor:
+    """Build the CodePredictor configured by PREDICT_* environment variables"""
+    return CodePredictor(
+        cache_size=env_int('PREDICT_CACHE_SIZE', 1024),
+        compile_model=os.environ.get('PREDICT_COMPILE', '0') == '1',
+        quantize=os.environ.get('PREDICT_QUANTIZE') or None,
+        # Bounds extraction time of huge submissions (0 disables)
+        max_nodes=env_int('PREDICT_MAX_NODES', 50000) or None,
+        sampling=sampling_from_env()
+    )
+
+
+def sampling_from_env() -> ContextSampling:
+    """Context sampling configured by PREDICT_CONTEXT_* and work budgets (0 disables a budget)"""
+    return ContextSampling(
+        mode=os.environ.get('PREDICT_CONTEXT_SAMPLING', 'first'),
+        seed=env_int('PREDICT_CONTEXT_SEED', 0),
+        max_pairs=env_int('PREDICT_MAX_PAIRS', 20000) or None,
+        max_visits=env_int('PREDICT_MAX_VISITS', 200000) or None
+    )
+
+
+def scheduler_from_env(predictor: CodePredictor):
+    """Build the stage that serves single snippets; `submit(code)` returns a Future of a Prediction.
+
+    Concurrent snippets are coalesced into a single forward pass. With
+    PREDICT_EXTRACT_WORKERS set, extraction runs in that many worker processes
+    and only inference runs here. Otherwise both run in PREDICT_SCHEDULER_WORKERS
+    scheduler threads, so one heavy snippet doesn't stall every request queued
+    behind it.
+    """
+    extract_workers = env_int('PREDICT_EXTRACT_WORKERS', 0)
+    max_pending = env_int('PREDICT_MAX_PENDING', 256)
+    if extract_workers > 0:
+        return InferencePipeline(
+            predictor,
+            extract_workers=extract_workers,
+            max_pending_extractions=max_pending,
+            inference_threads=env_int('PREDICT_INFERENCE_THREADS', 0) or None,
+            max_batch_size=env_int('PREDICT_MAX_BATCH_SIZE', 16),
+            max_wait_ms=env_float('PREDICT_MAX_WAIT_MS', 5),
+            max_pending_inference=max_pending
+        )
+    return MicroBatchScheduler(
+        predictor.predict_batch,
+        max_batch_size=env_int('PREDICT_MAX_BATCH_SIZE', 16),
+        max_wait_ms=env_float('PREDICT_MAX_WAIT_MS', 5),
+        max_queue_size=max_pending,
+        workers=env_int('PREDICT_SCHEDULER_WORKERS', 2)
+    )
+
+
+def sessions_from_env(predictor: CodePredictor) -> SessionStore:
+    """Build the template session store, capped at PREDICT_MAX_SESSIONS templates"""
+    return SessionStore(max_sessions=env_int('PREDICT_MAX_SESSIONS', 256), max_nodes=predictor.max_nodes)
+
+
+def index_from_env() -> TemplateIndex:
+    """Build the similar-templates index, persisted at PREDICT_INDEX_PATH (empty to keep it in memory)
+
+    Updates are saved at most every PREDICT_INDEX_FLUSH_SECONDS, and on close.
+    """
+    return TemplateIndex(
+        os.environ.get('PREDICT_INDEX_PATH', './algorithm_analysis/template_index.npz') or None,
+        model_digest=file_digest(MODEL_PATH),
+        flush_seconds=env_float('PREDICT_INDEX_FLUSH_SECONDS', 5.0),
+        nprobe=env_int('PREDICT_INDEX_NPROBE', 8)
+    )
+
+
+# Header carrying the shared secret that authorizes /similar/index updates
+INDEX_TOKEN_HEADER = 'X-Index-Token'
+
+
+def index_token_from_env() -> Optional[str]:
+    """Shared secret required by /similar/index, from PREDICT_INDEX_TOKEN; without one the route is disabled"""
+    return os.environ.get('PREDICT_INDEX_TOKEN') or None
+
+
+def index_auth_error(token: Optional[str], sent: Optional[str]) -> Optional[Tuple[int, str]]:
+    """(status, message) refusing an index update, or None if `sent` matches the configured token"""
+    if token is None:
+        return 403, 'Index updates are disabled, set PREDICT_INDEX_TOKEN to enable them'
+    if sent is None or not hmac.compare_digest(sent.encode(), token.encode()):
+        return 401, f'Missing or invalid {INDEX_TOKEN_HEADER} header'
+    return None
+
+
+def template_id(value) -> Optional[str]:
+    """Template ids arrive as database integers or strings, the index keys them as strings"""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        return None
+    return str(value)
+
+
+def similar_params(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Validated search options of a /similar request; raises ValueError with a client-facing message"""
+    k = data.get('k', 10)
+    if isinstance(k, bool) or not isinstance(k, int) or not 1 <= k <= 100:
+        raise ValueError('k must be an integer between 1 and 100')
+    exact = data.get('exact', False)
+    if not isinstance(exact, bool):
+        raise ValueError('exact must be a boolean')
+    exclude = data.get('exclude')
+    if exclude is not None and template_id(exclude) is None:
+        raise ValueError('exclude must be a template id')
+    min_score = data.get('min_score')
+    if min_score is not None and (isinstance(min_score, bool) or not isinstance(min_score, (int, float))):
+        raise ValueError('min_score must be a number')
+    return {
+        'k': k,
+        'exact': exact,
+        'exclude': [template_id(exclude)] if exclude is not None else [],
+        'min_score': min_score
+    }
+
+
+def index_request(data: Dict[str, Any]) -> Tuple[List[str], List[str], List[str]]:
+    """(ids, sources, ids to remove) of a /similar/index request; raises ValueError if malformed"""
+    items = data.get('items', [])
+    remove = data.get('remove', [])
+    if not isinstance(items, list) or not isinstance(remove, list):
+        raise ValueError('items and remove must be lists')
+    ids, codes = [], []
+    for item in items:
+        if not isinstance(item, dict) or template_id(item.get('id')) is None or not isinstance(item.get('input'), str):
+            raise ValueError('Each item must have an id and an input string')
+        ids.append(template_id(item['id']))
+        codes.append(item['input'])
+    removals = [template_id(value) for value in remove]
+    if None in removals:
+        raise ValueError('remove must be a list of template ids')
+    return ids, codes, removals
+
+
+def searchable_vector(prediction: Prediction) -> Tuple[Optional[np.ndarray], Optional[str]]:
+    """(code vector, None) of a prediction usable in the index, else (None, why not)"""
+    if prediction.error is not None:
+        return None, prediction.error
+    vector = prediction.code_vector.numpy()
+    if not np.isfinite(vector).all():
+        return None, 'Code vector is not finite'
+    return vector, None
+
+
+def index_predictions(index: TemplateIndex, ids: List[str], predictions: List[Prediction], remove: List[str]) -> Dict[str, Any]:
+    """Store the code vectors of classified templates, dropping ones that failed and removed ids"""
+    indexed, vectors, errors = [], [], []
+    for id, prediction in zip(ids, predictions):
+        vector, error = searchable_vector(prediction)
+        if error is not None:
+            errors.append({'id': id, 'error': error})
+        else:
+            indexed.append(id)
+            vectors.append(vector)
+    removed = index.update(
+        indexed,
+        vectors,
+        # A template that no longer parses shouldn't keep matching on its old vector
+        remove=remove + [error['id'] for error in errors]
+    )
+    return {
+        'indexed': indexed,
+        'errors': errors,
+        'removed': removed,
+        'size': len(index)
+    }
+
+
+def register_queue_metrics(predictor: CodePredictor, scheduler) -> None:
+    """Report queue depths and cache statistics at scrape time"""
+    if isinstance(scheduler, InferencePipeline):
+        metrics.QUEUE_DEPTH.set_function(scheduler.extraction.pending, queue='extraction')
+        metrics.QUEUE_DEPTH.set_function(scheduler.inference.pending, queue='inference')
+    else:
+        metrics.QUEUE_DEPTH.set_function(scheduler.pending, queue='scheduler')
+    for stat in ('entries', 'hits', 'misses', 'coalesced', 'evictions'):
+        metrics.CACHE.set_function(lambda stat=stat: predictor.cache.stats()[stat], stat=stat)
+
+
+def profiler_from_env() -> Optional[SlowRequestProfiler]:
+    """Slow request profiler if PREDICT_PROFILE_SLOW_MS is set, appending to PREDICT_PROFILE_OUTPUT"""
+    threshold_ms = env_float('PREDICT_PROFILE_SLOW_MS', 0)
+    if threshold_ms <= 0:
+        return None
+    return SlowRequestProfiler(
+        threshold_ms / 1000.0,
+        os.environ.get('PREDICT_PROFILE_OUTPUT', './algorithm_analysis/slow_requests.jsonl'),
+        interval=env_float('PREDICT_PROFILE_INTERVAL_MS', 5) / 1000.0
+    )
@@ -0,0 +1,75 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+from AST import CompactAST, parse_file, source_lines
+
+
+class TemplateSession:
+    """A whole template parsed once, from which selections are cut out by position.
+
+    A selection becomes the CompactAST of the outermost statements and
+    expressions it fully covers, under a new module root. Path contexts then
+    come only from those subtrees, and partial selections work even though
+    their text wouldn't parse on its own.
+    """
+
+    def __init__(self, source: str, max_nodes: Optional[int] = None):
+        tree = parse_file(source)
+        self.lines = source_lines(source)
+        self.tree = CompactAST.from_ast(tree, max_nodes, positions=True)
+
+    def _byte_column(self, line: int, column: int) -> int:
+        # ast columns count UTF-8 bytes, editors count characters
+        if not 1 <= line <= len(self.lines):
+            return column
+        return len(self.lines[line - 1][:column].encode("utf-8"))
+
+    def select(self, start_line: int, start_column: int, end_line: int, end_column: int) -> CompactAST:
+        """Subtrees covered by a selection; lines are 1-based and columns 0-based characters"""
+        start = (start_line, self._byte_column(start_line, start_column))
+        stop = (end_line, self._byte_column(end_line, end_column))
+        roots = self.tree.covered_roots(start, stop)
+        if not roots:
+            raise ValueError("Selection does not cover a complete statement or expression")
+        return self.tree.subtree(roots)
+
+
+class SessionStore:
+    """LRU of template sessions keyed by a digest of their source.
+
+    Registering the same template again returns the same session id, so
+    clients can re-register freely when a session has been evicted.
+    """
+
+    def __init__(self, max_sessions: int = 256, max_nodes: Optional[int] = None):
+        self.max_sessions = max_sessions
+        self.max_nodes = max_nodes
+        self._sessions: "OrderedDict[str, TemplateSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, source: str) -> str:
+        """Parse a template, unless already registered, and return its session id"""
+        session_id = hashlib.blake2b(source.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+        with self._lock:
+            if session_id in self._sessions:
+                self._sessions.move_to_end(session_id)
+                return session_id
+
+        session = TemplateSession(source, self.max_nodes)
+        with self._lock:
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session_id
+
+    def get(self, session_id: str) -> TemplateSession:
+        """Return a registered session; raises KeyError if unknown or evicted"""
+        with self._lock:
+            session = self._sessions[session_id]
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"sessions": len(self._sessions), "max_sessions": self.max_sessions}
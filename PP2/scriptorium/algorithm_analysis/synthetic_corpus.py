@@ -0,0 +1,125 @@
+import argparse
+import json
+import random
+import sys
+from typing import Iterator, List
+
+# Line counts of the generated size classes, from a short snippet to a large file
+SIZES = (5, 20, 100, 500, 2000)
+
+NAMES = ("arr", "left", "right", "mid", "target", "queue", "seen", "node", "count", "total", "window", "graph", "path", "result", "i", "j", "k")
+CALLS = ("len", "min", "max", "sorted", "abs", "sum", "range", "enumerate")
+
+
+class SnippetGenerator:
+    """Generates syntactically valid Python of a target length and nesting depth.
+
+    Output only depends on the seed, so benchmark runs compare like with like.
+    Snippets mix the constructs the classifier sees in templates: loops,
+    branches, comprehensions, calls, try blocks, nested functions and classes.
+    """
+
+    def __init__(self, seed: int = 0, max_depth: int = 4):
+        self.rng = random.Random(seed)
+        self.max_depth = max_depth
+
+    def name(self) -> str:
+        return self.rng.choice(NAMES)
+
+    def expression(self, depth: int = 0) -> str:
+        choice = self.rng.randrange(7 if depth < 2 else 3)
+        if choice == 0:
+            return self.name()
+        if choice == 1:
+            return str(self.rng.randrange(100))
+        if choice == 2:
+            return f"{self.name()}[{self.name()}]"
+        if choice == 3:
+            return f"({self.expression(depth + 1)} {self.rng.choice('+-*%')} {self.expression(depth + 1)})"
+        if choice == 4:
+            return f"{self.rng.choice(CALLS)}({self.expression(depth + 1)})"
+        if choice == 5:
+            return f"[{self.name()} * 2 for {self.name()} in {self.name()} if {self.name()}]"
+        return f"{self.name()}.get({self.expression(depth + 1)}, 0)"
+
+    def condition(self) -> str:
+        return f"{self.expression()} {self.rng.choice(['<', '<=', '==', '!=', '>'])} {self.expression()}"
+
+    def block(self, lines: int, depth: int, indent: str) -> List[str]:
+        """At least one statement, about `lines` lines long"""
+        out: List[str] = []
+        while len(out) < max(lines, 1):
+            out.extend(self.statement(lines - len(out), depth, indent))
+        return out
+
+    def statement(self, budget: int, depth: int, indent: str) -> List[str]:
+        inner = indent + "    "
+        # Compound statements need room for their body, and stop at max_depth
+        compound = depth < self.max_depth and budget >= 3 and self.rng.random() < 0.45
+        if not compound:
+            choice = self.rng.randrange(4)
+            if choice == 0:
+                return [f"{indent}{self.name()} = {self.expression()}"]
+            if choice == 1:
+                return [f"{indent}{self.name()} += {self.expression()}"]
+            if choice == 2:
+                return [f"{indent}{self.name()}.append({self.expression()})"]
+            return [f"{indent}{self.name()}, {self.name()} = {self.name()}, {self.expression()}"]
+
+        body = self.rng.randint(1, max(1, min(budget - 2, budget // 2)))
+        choice = self.rng.randrange(5)
+        if choice == 0:
+            return [f"{indent}for {self.name()} in range({self.expression()}):"] + self.block(body, depth + 1, inner)
+        if choice == 1:
+            return [f"{indent}while {self.condition()}:"] + self.block(body, depth + 1, inner)
+        if choice == 2:
+            lines = [f"{indent}if {self.condition()}:"] + self.block(body, depth + 1, inner)
+            if self.rng.random() < 0.5:
+                lines += [f"{indent}elif {self.condition()}:"] + self.block(1, depth + 1, inner)
+            return lines + [f"{indent}else:"] + self.block(1, depth + 1, inner)
+        if choice == 3:
+            return ([f"{indent}try:"] + self.block(body, depth + 1, inner)
+                    + [f"{indent}except (KeyError, IndexError):", f"{inner}{self.name()} = None"])
+        return [f"{indent}def helper_{self.rng.randrange(1000)}({self.name()}, {self.name()}):"] + \
+            self.block(body, depth + 1, inner) + [f"{inner}return {self.expression()}"]
+
+    def function(self, lines: int, indent: str = "") -> List[str]:
+        header = f"{indent}def solve_{self.rng.randrange(10000)}(arr, target):"
+        return [header] + self.block(max(lines - 2, 1), 1, indent + "    ") + [f"{indent}    return {self.expression()}"]
+
+    def snippet(self, lines: int) -> str:
+        """A module of roughly `lines` lines: one function, or several plus a class when long"""
+        if lines <= 40:
+            return "\n".join(self.function(lines)) + "\n"
+        out: List[str] = []
+        while len(out) < lines:
+            if self.rng.random() < 0.2:
+                out.append(f"class Solver{self.rng.randrange(1000)}:")
+                out.extend(self.function(min(40, lines - len(out)), indent="    "))
+            else:
+                out.extend(self.function(self.rng.randint(10, 60)))
+            out.append("")
+        return "\n".join(out) + "\n"
+
+
+def generate_corpus(per_size: int, sizes=SIZES, seed: int = 0) -> Iterator[dict]:
+    """Yield {id, size, code} records, `per_size` for each target line count"""
+    generator = SnippetGenerator(seed)
+    for size in sizes:
+        for i in range(per_size):
+            yield {"id": f"{size}-{i}", "size": size, "code": generator.snippet(size)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic corpus of Python snippets as JSONL {id, size, code}")
+    parser.add_argument("--per-size", type=int, default=20, help="snippets per size class")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), help="target line counts")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for record in generate_corpus(args.per_size, args.sizes, args.seed):
+        sys.stdout.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
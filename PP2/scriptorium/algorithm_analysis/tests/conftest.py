@@ -0,0 +1,49 @@
+import json
+import os
+import sys
+
+import pytest
+import torch
+
+# The analysis modules import each other by bare name, as when run from algorithm_analysis/
+ALGORITHM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ALGORITHM_DIR)
+
+import predict  # noqa: E402
+from cache import PredictionCache  # noqa: E402
+
+# CodePredictor loads its data relative to scriptorium/, like the servers
+SCRIPTORIUM_DIR = os.path.dirname(ALGORITHM_DIR)
+
+
+@pytest.fixture(scope="session")
+def predictor(tmp_path_factory):
+    """A CodePredictor over seeded random weights, the trained ones aren't checked in"""
+    weights = tmp_path_factory.mktemp("model") / "code_classifier.pt"
+    cwd = os.getcwd()
+    patch = pytest.MonkeyPatch()
+    os.chdir(SCRIPTORIUM_DIR)
+    try:
+        vocab_data = torch.load("./algorithm_analysis/vocab_data.pt", weights_only=True)
+        with open("./algorithm_analysis/label_map.json") as f:
+            label_map = json.load(f)
+        torch.manual_seed(0)
+        model = predict.ImprovedCodeClassifier(
+            token_vocab_size=len(vocab_data["token_to_idx"]),
+            path_vocab_size=len(vocab_data["path_to_idx"]),
+            num_classes=len(label_map),
+            embedding_dim=256,
+            num_heads=8,
+            num_layers=3
+        )
+        torch.save(model.state_dict(), weights)
+        patch.setattr(predict, "MODEL_PATH", str(weights))
+        yield predict.CodePredictor(cache_size=16)
+    finally:
+        patch.undo()
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def fresh_cache(predictor, monkeypatch):
+    monkeypatch.setattr(predictor, "cache", PredictionCache(max_entries=16))
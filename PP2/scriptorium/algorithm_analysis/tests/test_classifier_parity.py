@@ -0,0 +1,165 @@
+import json
+import os
+
+import pytest
+import torch
+
+from AST import CompiledVocabulary, PathContextExtractor
+from Classifier import ImprovedCodeClassifier
+from Embedding import collate_context_ids
+
+ALGORITHM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOLERANCE = 1e-4
+
+# One representative snippet per label of label_map.json
+SNIPPETS = {
+    "Backtracking": """
+def permutations(nums):
+    result, path, used = [], [], [False] * len(nums)
+    def backtrack():
+        if len(path) == len(nums):
+            result.append(path[:])
+            return
+        for i in range(len(nums)):
+            if used[i]:
+                continue
+            used[i] = True
+            path.append(nums[i])
+            backtrack()
+            path.pop()
+            used[i] = False
+    backtrack()
+    return result
+""",
+    "Binary Search": """
+def binary_search(arr, target):
+    left, right = 0, len(arr) - 1
+    while left <= right:
+        mid = (left + right) // 2
+        if arr[mid] == target:
+            return mid
+        elif arr[mid] < target:
+            left = mid + 1
+        else:
+            right = mid - 1
+    return -1
+""",
+    "Bubble Sort": """
+def bubble_sort(arr):
+    n = len(arr)
+    for i in range(n):
+        swapped = False
+        for j in range(0, n - i - 1):
+            if arr[j] > arr[j + 1]:
+                arr[j], arr[j + 1] = arr[j + 1], arr[j]
+                swapped = True
+        if not swapped:
+            break
+    return arr
+""",
+    "Sliding Window": """
+def max_window_sum(nums, k):
+    window = sum(nums[:k])
+    best = window
+    for i in range(k, len(nums)):
+        window += nums[i] - nums[i - k]
+        best = max(best, window)
+    return best
+""",
+    "BFS": """
+from collections import deque
+def bfs(graph, start):
+    seen = {start}
+    queue = deque([start])
+    order = []
+    while queue:
+        node = queue.popleft()
+        order.append(node)
+        for neighbour in graph[node]:
+            if neighbour not in seen:
+                seen.add(neighbour)
+                queue.append(neighbour)
+    return order
+""",
+    "Two Pointers": """
+def pair_with_sum(nums, target):
+    left, right = 0, len(nums) - 1
+    while left < right:
+        total = nums[left] + nums[right]
+        if total == target:
+            return left, right
+        if total < target:
+            left += 1
+        else:
+            right -= 1
+    return None
+""",
+    "DFS": """
+def dfs(graph, node, seen=None):
+    if seen is None:
+        seen = set()
+    seen.add(node)
+    for neighbour in graph[node]:
+        if neighbour not in seen:
+            dfs(graph, neighbour, seen)
+    return seen
+""",
+}
+
+
+@pytest.fixture(scope="module")
+def label_map():
+    with open(os.path.join(ALGORITHM_DIR, "label_map.json")) as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="module")
+def models(label_map):
+    """The trained model if present (it isn't checked in), else a seeded random one, and its folded copy"""
+    vocab_data = torch.load(os.path.join(ALGORITHM_DIR, "vocab_data.pt"), weights_only=True)
+    torch.manual_seed(0)
+    model = ImprovedCodeClassifier(
+        token_vocab_size=len(vocab_data["token_to_idx"]),
+        path_vocab_size=len(vocab_data["path_to_idx"]),
+        num_classes=len(label_map)
+    )
+    weights = os.path.join(ALGORITHM_DIR, "code_classifier.pt")
+    if os.path.exists(weights):
+        model.load_state_dict(torch.load(weights, weights_only=True))
+    model.eval()
+    return model, model.optimized_for_inference(), CompiledVocabulary(vocab_data["token_to_idx"], vocab_data["path_to_idx"])
+
+
+def classify(model, batch):
+    with torch.inference_mode():
+        return model.classify(batch["start_tokens"], batch["paths"], batch["end_tokens"], batch["mask"])
+
+
+def test_every_label_has_a_snippet(label_map):
+    assert set(SNIPPETS) == set(label_map)
+
+
+@pytest.mark.parametrize("label", SNIPPETS)
+def test_folded_model_matches_eager_model(models, label):
+    eager, folded, vocab = models
+    extractor = PathContextExtractor()
+    batch = collate_context_ids([extractor.extract_context_ids(extractor.parse(SNIPPETS[label]), vocab)])
+
+    expected_logits, expected_attention, expected_vector = classify(eager, batch)
+    logits, attention, vector = classify(folded, batch)
+    torch.testing.assert_close(logits, expected_logits, atol=TOLERANCE, rtol=0)
+    torch.testing.assert_close(attention, expected_attention, atol=TOLERANCE, rtol=0)
+    torch.testing.assert_close(vector, expected_vector, atol=TOLERANCE, rtol=0)
+    assert torch.equal(logits.argmax(dim=1), expected_logits.argmax(dim=1))
+
+
+def test_folded_model_matches_eager_model_batched(models):
+    """All seven snippets in one padded batch, as the server runs them"""
+    eager, folded, vocab = models
+    extractor = PathContextExtractor()
+    batch = collate_context_ids([extractor.extract_context_ids(extractor.parse(code), vocab) for code in SNIPPETS.values()])
+
+    expected_logits, _, _ = classify(eager, batch)
+    logits, _, _ = classify(folded, batch)
+    torch.testing.assert_close(logits, expected_logits, atol=TOLERANCE, rtol=0)
+    assert torch.equal(logits.argmax(dim=1), expected_logits.argmax(dim=1))
@@ -0,0 +1,101 @@
+import ast
+import bisect
+import heapq
+import inspect
+import json.decoder
+import shlex
+import textwrap
+
+import pytest
+
+from AST import CompactAST, CompiledVocabulary, PathContextExtractor
+
+# Real code with a spread of sizes, nesting and constructs
+CORPUS_MODULES = (bisect, heapq, json.decoder, textwrap, shlex)
+# The reference compares every terminal pair, keep its run time reasonable
+MAX_REFERENCE_NODES = 1500
+
+EDGE_CASES = {
+    "empty_module": "",
+    "empty_body": "def f():\n    pass\n",
+    "single_name": "x",
+    "single_terminal_pair": "def f(a):\n    return a\n",
+    "deep_nesting": "def f(x):\n" + "".join("    " * (depth + 1) + f"if x > {depth}:\n" for depth in range(40))
+                    + "    " * 41 + "return x\n",
+    "deep_expression": "y = " + "(" * 60 + "a" + "".join(f" + b{i})" for i in range(60)) + "\n",
+    "wide_call": "f(" + ", ".join(f"a{i}" for i in range(30)) + ")\n",
+    "many_contexts": "def f(a, b):\n" + "".join(f"    a{i} = b[{i}] + a * {i}\n" for i in range(80)),
+    "strings_and_constants": "def f():\n    return {'a': 1.5, 'b': None, 'c': b'x', 'd': ...}\n",
+}
+
+
+def corpus_functions():
+    functions = []
+    for module in CORPUS_MODULES:
+        tree = ast.parse(inspect.getsource(module))
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                functions.append(pytest.param(node, id=f"{module.__name__}.{node.name}:{node.lineno}"))
+    return functions
+
+
+def reference_vocabulary(contexts):
+    """Token and path ids covering every reference context, and their CompiledVocabulary"""
+    tokens = {"<UNK>": 0}
+    paths = {"<UNK>": 0}
+    for context in contexts:
+        tokens.setdefault(context.start_token, len(tokens))
+        tokens.setdefault(context.end_token, len(tokens))
+        paths.setdefault(context.path, len(paths))
+    return tokens, paths, CompiledVocabulary(tokens, paths)
+
+
+def assert_equivalent(tree: ast.AST):
+    extractor = PathContextExtractor()
+    expected = extractor._generate_path_contexts_reference(tree)
+    nodes = CompactAST.from_ast(tree)
+    assert extractor.generate_path_contexts(nodes) == expected
+
+    tokens, paths, vocab = reference_vocabulary(expected)
+    ids = extractor.extract_context_ids(nodes, vocab)
+    assert list(ids.start_tokens) == [tokens[context.start_token] for context in expected]
+    assert list(ids.paths) == [paths[context.path] for context in expected]
+    assert list(ids.end_tokens) == [tokens[context.end_token] for context in expected]
+
+
+@pytest.mark.parametrize("function", corpus_functions())
+def test_corpus_function_matches_reference(function):
+    if len(list(ast.walk(function))) > MAX_REFERENCE_NODES:
+        pytest.skip("too large for the all-pairs reference")
+    assert_equivalent(function)
+
+
+@pytest.mark.parametrize("code", EDGE_CASES.values(), ids=EDGE_CASES.keys())
+def test_edge_case_matches_reference(code):
+    assert_equivalent(ast.parse(code))
+
+
+def test_context_limit_matches_reference():
+    tree = ast.parse(EDGE_CASES["many_contexts"])
+    contexts = PathContextExtractor().generate_path_contexts(tree)
+    assert len(contexts) == PathContextExtractor.MAX_CONTEXTS
+    assert_equivalent(tree)
+
+
+def test_max_nodes_cap():
+    tree = ast.parse(EDGE_CASES["many_contexts"])
+    size = len(list(ast.walk(tree)))
+    with pytest.raises(ValueError, match="too large"):
+        CompactAST.from_ast(tree, max_nodes=size - 1)
+    # A cap the tree fits under changes nothing
+    extractor = PathContextExtractor()
+    capped = CompactAST.from_ast(tree, max_nodes=size)
+    assert extractor.generate_path_contexts(capped) == extractor._generate_path_contexts_reference(tree)
+
+
+def test_positions_do_not_change_contexts():
+    tree = ast.parse(inspect.getsource(textwrap.indent))
+    extractor = PathContextExtractor()
+    with_positions = CompactAST.from_ast(tree, positions=True)
+    assert extractor.generate_path_contexts(with_positions) == extractor._generate_path_contexts_reference(tree)
+    assert with_positions.has_positions
@@ -0,0 +1,45 @@
+import pytest
+
+import metrics
+from AST import CompactAST, PathContextExtractor, canonical_key
+
+CODE = """
+def linear_search(items, target):
+    for i, item in enumerate(items):
+        if item == target:
+            return i
+    return -1
+"""
+
+
+def key_of(code):
+    return canonical_key(CompactAST.from_ast(PathContextExtractor().parse_snippet(code)[0]))
+
+
+def test_identical_snippet_is_served_from_cache(predictor, fresh_cache):
+    first, = predictor.predict_batch([CODE])
+    hits = metrics.CACHE_HITS.value()
+    second, = predictor.predict_batch(["# reformatted\n" + CODE.replace("    ", "  ")])
+    assert metrics.CACHE_HITS.value() == hits + 1
+    assert second.label == first.label and second.confidence == first.confidence
+
+
+@pytest.mark.parametrize("stage", ["record_extraction", "predict_contexts"])
+def test_failed_batch_releases_its_claims(predictor, fresh_cache, monkeypatch, stage):
+    def broken(*args, **kwargs):
+        raise RuntimeError("broken " + stage)
+
+    with monkeypatch.context() as patch:
+        if stage == "record_extraction":
+            patch.setattr(metrics, "record_extraction", broken)
+        else:
+            patch.setattr(predictor, "predict_contexts", broken)
+        with pytest.raises(RuntimeError, match="broken"):
+            predictor.predict_batch([CODE, "x = 1\n"])
+
+    # Nothing is left in flight, so the next caller computes the snippet instead of waiting forever
+    future, is_owner = predictor.cache.claim(key_of(CODE))
+    assert is_owner
+    predictor.cache.fail(key_of(CODE), RuntimeError("released"))
+    result, = predictor.predict_batch([CODE])
+    assert result.error is None and result.label in predictor.label_to_idx
@@ -0,0 +1,62 @@
+import pytest
+import torch
+
+from Classifier import make_probe_batch
+from Embedding import CodeEmbedding, Int8ProjectedCodeEmbedding, ProjectedCodeEmbedding
+
+TOKEN_VOCAB_SIZE = 500
+PATH_VOCAB_SIZE = 800
+EMBEDDING_DIM = 64
+
+
+@pytest.fixture(scope="module")
+def embedding():
+    torch.manual_seed(0)
+    return CodeEmbedding(TOKEN_VOCAB_SIZE, PATH_VOCAB_SIZE, embedding_dim=EMBEDDING_DIM).eval()
+
+
+@pytest.fixture(scope="module")
+def batch():
+    """Random ids of ragged lengths; positions past each length are padding with arbitrary ids"""
+    return make_probe_batch(TOKEN_VOCAB_SIZE, PATH_VOCAB_SIZE, batch_size=8, max_contexts=50, seed=1)
+
+
+def embed(module, batch, mask=True):
+    with torch.no_grad():
+        return module(batch["start_tokens"], batch["paths"], batch["end_tokens"], batch["mask"] if mask else None)
+
+
+def test_batch_has_padding(batch):
+    assert not batch["mask"].all() and batch["mask"].any(dim=1).all()
+
+
+def test_projected_matches_training_forward(embedding, batch):
+    expected_vector, expected_attention = embed(embedding, batch)
+    vector, attention = embed(ProjectedCodeEmbedding(embedding), batch)
+    torch.testing.assert_close(vector, expected_vector, atol=1e-5, rtol=0)
+    torch.testing.assert_close(attention, expected_attention, atol=1e-6, rtol=0)
+    # Padding positions get no attention at all
+    assert torch.equal(attention[~batch["mask"]], torch.zeros_like(attention[~batch["mask"]]))
+
+
+def test_projected_matches_training_forward_without_mask(embedding, batch):
+    expected_vector, expected_attention = embed(embedding, batch, mask=False)
+    vector, attention = embed(ProjectedCodeEmbedding(embedding), batch, mask=False)
+    torch.testing.assert_close(vector, expected_vector, atol=1e-5, rtol=0)
+    torch.testing.assert_close(attention, expected_attention, atol=1e-6, rtol=0)
+
+
+def test_padding_ids_do_not_change_the_result(embedding, batch):
+    projected = ProjectedCodeEmbedding(embedding)
+    repadded = {key: value.clone() for key, value in batch.items()}
+    for key in ("start_tokens", "paths", "end_tokens"):
+        repadded[key][~batch["mask"]] = 0
+    torch.testing.assert_close(embed(projected, repadded), embed(projected, batch), atol=0, rtol=0)
+
+
+def test_int8_tables_stay_close_to_training_forward(embedding, batch):
+    # Per-row int8 tables are lossy, so this only bounds the quantization error
+    expected_vector, expected_attention = embed(embedding, batch)
+    vector, attention = embed(Int8ProjectedCodeEmbedding(embedding), batch)
+    torch.testing.assert_close(vector, expected_vector, atol=1e-2, rtol=0)
+    torch.testing.assert_close(attention, expected_attention, atol=1e-3, rtol=0)
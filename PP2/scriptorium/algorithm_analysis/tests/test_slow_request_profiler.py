@@ -0,0 +1,65 @@
+import json
+import threading
+
+import metrics
+from AST import ContextSampling
+from metrics import SlowRequestProfiler
+from scheduler import MicroBatchScheduler
+
+# Distinct snippets, so none is served from the cache, and together long enough to be
+# sampled many times in extraction and in the forward pass
+SNIPPETS = [
+    f"def f{n}(a, b):\n" + "".join(f"    a{i} = b[{i}] + a * {i} - b{n}\n" for i in range(100))
+    for n in range(20)
+]
+
+
+def slowest_stacks(output):
+    with open(output) as f:
+        record = json.loads(f.readlines()[-1])
+    return [entry["stack"] for entry in record["stacks"]]
+
+
+def test_dump_includes_the_scheduler_thread_serving_the_request(predictor, fresh_cache, tmp_path, monkeypatch):
+    # Reservoir sampling examines every pair instead of stopping at the first contexts
+    monkeypatch.setattr(predictor, "sampling", ContextSampling(mode="reservoir"))
+    output = str(tmp_path / "slow.jsonl")
+    profiler = SlowRequestProfiler(threshold=0, output=output, interval=0.001, max_stacks=10000)
+    scheduler = MicroBatchScheduler(predictor.predict_batch, name="inference")
+    try:
+        with profiler.track("/predict"):
+            for code in SNIPPETS:
+                assert scheduler.submit(code).result().error is None
+    finally:
+        scheduler.close()
+
+    stacks = slowest_stacks(output)
+    worker = [stack for stack in stacks if stack.startswith("inference;")]
+    assert any(":extract_context_ids:" in stack for stack in worker)
+    assert any(":forward:" in stack for stack in worker)
+
+
+def test_concurrent_request_does_not_get_others_batches(predictor, fresh_cache, tmp_path):
+    output = str(tmp_path / "slow.jsonl")
+    profiler = SlowRequestProfiler(threshold=0, output=output, interval=0.001, max_stacks=10000)
+    scheduler = MicroBatchScheduler(predictor.predict_batch, name="inference")
+    served = threading.Event()
+
+    def idle_request():
+        with profiler.track("/idle"):
+            served.wait()
+
+    idle = threading.Thread(target=idle_request, name="idle-request")
+    idle.start()
+    try:
+        with profiler.track("/predict"):
+            for code in SNIPPETS[:5]:
+                scheduler.submit(code).result()
+    finally:
+        served.set()
+        idle.join()
+        scheduler.close()
+
+    stacks = slowest_stacks(output)
+    assert stacks and all(stack.startswith("idle-request;") for stack in stacks)
+    assert metrics.profiled_requests() == ()
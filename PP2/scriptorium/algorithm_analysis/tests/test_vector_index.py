@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import pytest
+
+from vector_index import TemplateIndex, VectorIndex
+
+DIM = 8
+
+
+def test_min_score_applies_before_top_k():
+    index = VectorIndex(dim=DIM)
+    query = np.eye(DIM, dtype=np.float32)[0]
+    # Ten near duplicates of the query qualify, ten unrelated vectors don't
+    rng = np.random.default_rng(0)
+    near = query + 0.05 * rng.standard_normal((10, DIM)).astype(np.float32)
+    far = np.eye(DIM, dtype=np.float32)[1] + 0.05 * rng.standard_normal((10, DIM)).astype(np.float32)
+    index.upsert([f"near{i}" for i in range(10)], near)
+    index.upsert([f"far{i}" for i in range(10)], far)
+
+    matches = index.search(query, k=5, min_score=0.9)
+    assert len(matches) == 5 and all(id.startswith("near") for id, _ in matches)
+    assert all(score >= 0.9 for _, score in matches)
+    assert [score for _, score in matches] == sorted((score for _, score in matches), reverse=True)
+    assert len(index.search(query, k=50, min_score=0.9)) == 10
+    assert index.search(query, k=5, min_score=1.5) == []
+
+
+def test_updates_are_saved_on_close(tmp_path):
+    path = str(tmp_path / "index.npz")
+    index = TemplateIndex(path, model_digest="a", flush_seconds=60)
+    index.update(["one", "two"], np.eye(2, DIM, dtype=np.float32))
+    index.update(remove=["one"])
+    # The flush interval hasn't passed, nothing is written yet
+    assert not os.path.exists(path)
+    index.close()
+
+    reloaded = TemplateIndex(path, model_digest="a")
+    assert len(reloaded) == 1 and "two" in reloaded.index
+    reloaded.close()
+    assert len(TemplateIndex(path, model_digest="b")) == 0
+
+
+def test_burst_of_updates_is_saved_once(tmp_path, monkeypatch):
+    path = str(tmp_path / "index.npz")
+    index = TemplateIndex(path, model_digest="a", flush_seconds=0.5)
+    saves = []
+    save = index.index.save
+    monkeypatch.setattr(index.index, "save", lambda *args, **kwargs: (saves.append(1), save(*args, **kwargs)))
+    for i in range(20):
+        index.update([f"t{i}"], np.ones((1, DIM), dtype=np.float32))
+    index.close()
+    assert len(saves) == 1
+    assert len(VectorIndex.load(path)[0]) == 20
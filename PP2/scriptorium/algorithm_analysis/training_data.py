@@ -0,0 +1,284 @@
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import sys
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from AST import CompactAST, ContextSampling, PathContextExtractor
+
+# Worker processes import this module, so it must not pull in torch
+
+MANIFEST = "manifest.json"
+REJECTS = "rejects.jsonl"
+
+# Set up once per worker process by _init_worker
+_extractor: Optional[PathContextExtractor] = None
+_max_nodes: Optional[int] = None
+
+
+def _init_worker(sampling: ContextSampling, max_nodes: Optional[int]) -> None:
+    global _extractor, _max_nodes
+    _extractor = PathContextExtractor(sampling)
+    _max_nodes = max_nodes
+
+
+def _extract_chunk(chunk: List[Tuple[int, Any]]) -> List[Dict[str, Any]]:
+    """Extract a chunk of (index, item) examples; failures become reject records instead of raising"""
+    results = []
+    for index, item in chunk:
+        code_id = item.get('code_id', index) if isinstance(item, dict) else index
+        try:
+            if not isinstance(item, dict) or not isinstance(item.get('code'), str) or 'label' not in item:
+                raise ValueError("Example must be an object with code and label fields")
+            if not isinstance(item['label'], str) or not item['label']:
+                raise ValueError(f"Label must be a non-empty string, got {item['label']!r}")
+            tree = CompactAST.from_ast(_extractor.parse(item['code']), _max_nodes)
+            contexts = _extractor.generate_path_contexts(tree)
+        except (ValueError, RecursionError) as e:
+            results.append({'index': index, 'code_id': code_id, 'error': str(e) or type(e).__name__})
+            continue
+        results.append({
+            'code_id': code_id,
+            'label': item['label'],
+            'contexts': [[ctx.start_token, ctx.path, ctx.end_token] for ctx in contexts]
+        })
+    return results
+
+
+def iter_examples(path: str, chunk_size: int = 1 << 20) -> Iterator[Tuple[int, Any]]:
+    """Stream (index, example) from a JSON list (like data.json) or a JSONL file without loading it whole.
+
+    Malformed JSONL lines are yielded as their raw text, so they end up in the rejects file.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        head = f.read(chunk_size)
+        if not head.lstrip().startswith('['):
+            buffered = head + f.readline()
+            index = 0
+            for line in _chain_lines(buffered, f):
+                if not line.strip():
+                    continue
+                try:
+                    yield index, json.loads(line)
+                except ValueError:
+                    yield index, line.rstrip('\n')
+                index += 1
+            return
+
+        decoder = json.JSONDecoder()
+        buffer, pos, eof = head, head.index('[') + 1, False
+        index = 0
+        while True:
+            while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == ','):
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            # Decode only once the element is certainly complete, a number could be cut short
+            try:
+                item, end = decoder.raw_decode(buffer, pos) if pos < len(buffer) else (None, None)
+            except ValueError:
+                end = None
+            if end is not None and (end < len(buffer) or eof):
+                yield index, item
+                index += 1
+                pos = end
+                continue
+            if eof:
+                raise ValueError(f"{path} is not a valid JSON list")
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+
+
+def _chain_lines(buffered: str, f) -> Iterator[str]:
+    # Split on \n only, like iterating the file: str.splitlines also breaks on U+2028 and friends
+    yield from io.StringIO(buffered)
+    yield from f
+
+
+def shard_of(code_id: Any, seed: int, shards: int) -> int:
+    """Seeded, stable shard assignment, so the same example lands in the same shard on every run"""
+    digest = hashlib.blake2b(f"{seed}:{code_id}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % shards
+
+
+def shard_name(shard: int, shards: int, compress: bool) -> str:
+    return f"shard-{shard:05d}-of-{shards:05d}.jsonl" + (".gz" if compress else "")
+
+
+def _open_output(path: str, compress: bool):
+    if compress:
+        # mtime=0 keeps the output byte-identical across runs
+        return io.TextIOWrapper(gzip.GzipFile(path, 'wb', mtime=0), encoding='utf-8')
+    return open(path, 'w', encoding='utf-8')
+
+
+def _open_input(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def build_training_data(
+    input_path: str,
+    output_dir: str,
+    shards: int = 16,
+    seed: int = 0,
+    sampling: ContextSampling = ContextSampling(),
+    max_nodes: Optional[int] = None,
+    workers: Optional[int] = None,
+    chunk_size: int = 64,
+    compress: bool = False,
+    progress=None
+) -> Dict[str, Any]:
+    """Extract path contexts for every example of `input_path` into sharded JSONL files.
+
+    Examples are streamed in and extracted in chunks across worker processes,
+    with a bounded number of chunks in flight, so memory doesn't grow with the
+    dataset. Each example goes to the shard picked by shard_of, and shards
+    keep input order, so the output only depends on the input, seed and
+    sampling, not on the number of workers. Examples that fail to parse or
+    extract are written to rejects.jsonl. Returns the manifest, which is also
+    written to the output directory last.
+    """
+    if shards < 1:
+        raise ValueError("shards must be at least 1")
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    names = [shard_name(shard, shards, compress) for shard in range(shards)]
+    outputs = [_open_output(os.path.join(output_dir, name), compress) for name in names]
+    rejects = open(os.path.join(output_dir, REJECTS), 'w', encoding='utf-8')
+    counts = [0] * shards
+    labels: Counter = Counter()
+    rejected = 0
+
+    def write(results: List[Dict[str, Any]]) -> None:
+        nonlocal rejected
+        for result in results:
+            if 'error' in result:
+                rejects.write(json.dumps(result) + '\n')
+                rejected += 1
+                continue
+            shard = shard_of(result['code_id'], seed, shards)
+            outputs[shard].write(json.dumps(result, separators=(',', ':')) + '\n')
+            counts[shard] += 1
+            labels[result['label']] += 1
+
+    mp_context = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context(mp_context),
+            initializer=_init_worker,
+            initargs=(sampling, max_nodes)
+        ) as executor:
+            in_flight = deque()
+            chunk: List[Tuple[int, Any]] = []
+            for example in iter_examples(input_path):
+                chunk.append(example)
+                if len(chunk) < chunk_size:
+                    continue
+                in_flight.append(executor.submit(_extract_chunk, chunk))
+                chunk = []
+                # Write chunks back in input order, keeping a few per worker queued
+                if len(in_flight) >= 4 * workers:
+                    write(in_flight.popleft().result())
+                    if progress:
+                        progress(sum(counts), rejected)
+            if chunk:
+                in_flight.append(executor.submit(_extract_chunk, chunk))
+            while in_flight:
+                write(in_flight.popleft().result())
+    finally:
+        for output in outputs:
+            output.close()
+        rejects.close()
+
+    manifest = {
+        'examples': sum(counts),
+        'rejected': rejected,
+        'seed': seed,
+        'sampling': asdict(sampling),
+        'max_nodes': max_nodes,
+        'labels': dict(sorted(labels.items(), key=lambda item: str(item[0]))),
+        'shards': [{'path': name, 'examples': count} for name, count in zip(names, counts)],
+    }
+    tmp = os.path.join(output_dir, MANIFEST + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp, os.path.join(output_dir, MANIFEST))
+    return manifest
+
+
+def iter_training_data(output_dir: str, seed: int = 0, buffer_size: int = 10000) -> Iterator[Dict[str, Any]]:
+    """Stream the examples of a sharded dataset in a seeded shuffled order.
+
+    Shards are visited in a shuffled order and examples pass through a
+    shuffle buffer of `buffer_size`, so only that many are held in memory.
+    Use a different seed per epoch. Examples come back in the format of
+    transform_to_training_data: code_id, label and a list of context dicts.
+    """
+    with open(os.path.join(output_dir, MANIFEST), 'r') as f:
+        manifest = json.load(f)
+    rng = random.Random(seed)
+    shard_paths = [os.path.join(output_dir, shard['path']) for shard in manifest['shards']]
+    rng.shuffle(shard_paths)
+
+    buffer: List[Dict[str, Any]] = []
+    for shard_path in shard_paths:
+        with _open_input(shard_path) as f:
+            for line in f:
+                example = json.loads(line)
+                example['contexts'] = [
+                    {"start_token": start, "path": path, "end_token": end} for start, path, end in example['contexts']
+                ]
+                if len(buffer) < buffer_size:
+                    buffer.append(example)
+                    continue
+                slot = rng.randrange(buffer_size)
+                yield buffer[slot]
+                buffer[slot] = example
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract sharded training data from a JSON list or JSONL of {code_id, code, label}")
+    parser.add_argument("input", nargs="?", default="./data.json")
+    parser.add_argument("output_dir", nargs="?", default="./training_data")
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0, help="seeds shard assignment and context sampling")
+    parser.add_argument("--sampling", choices=ContextSampling.MODES, default="first")
+    parser.add_argument("--max-nodes", type=int, default=0, help="reject larger snippets (0 disables)")
+    parser.add_argument("--workers", type=int, help="extraction processes (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=64, help="examples per worker task")
+    parser.add_argument("--compress", action="store_true", help="gzip the shards")
+    args = parser.parse_args()
+
+    def progress(examples: int, rejected: int) -> None:
+        print(f"\r{examples} examples, {rejected} rejected", end="", file=sys.stderr)
+
+    manifest = build_training_data(
+        args.input, args.output_dir,
+        shards=args.shards,
+        seed=args.seed,
+        sampling=ContextSampling(mode=args.sampling, seed=args.seed),
+        max_nodes=args.max_nodes or None,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        compress=args.compress,
+        progress=progress
+    )
+    print(f"\rTraining data written to {args.output_dir}: {manifest['examples']} examples in "
+          f"{len(manifest['shards'])} shards, {manifest['rejected']} rejected", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+import os
+import threading
+import warnings
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class VectorIndex:
+    """Top-k cosine similarity index over code vectors, keyed by template id.
+
+    Vectors are stored L2-normalised in one float32 matrix, so every query is
+    a single matrix product. Once the index holds `train_threshold` vectors it
+    also builds an inverted file: vectors are clustered with k-means into
+    about sqrt(n) lists, and a query only scores the members of its `nprobe`
+    nearest lists. That is approximate; `exact=True` scores every vector.
+    Thread-safe, and persisted with `save`/`load`.
+    """
+
+    def __init__(self, dim: Optional[int] = None, nprobe: int = 8, train_threshold: int = 4096, seed: int = 0):
+        self.dim = dim
+        self.nprobe = nprobe
+        self.train_threshold = train_threshold
+        self.seed = seed
+        self._lock = threading.RLock()
+        self._vectors = np.zeros((0, dim or 0), dtype=np.float32)
+        self._ids: List[Optional[str]] = []
+        self._rows: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: List[set] = []
+        self._list_of = np.zeros(0, dtype=np.int32)
+        self._live = np.zeros(0, dtype=bool)
+        self._trained_size = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def __contains__(self, id: str) -> bool:
+        with self._lock:
+            return id in self._rows
+
+    def _normalize(self, vectors) -> np.ndarray:
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of dimension {self.dim}, got {vectors.shape[1]}")
+        if not np.isfinite(vectors).all():
+            raise ValueError("Vectors must be finite")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1)
+
+    def upsert(self, ids: Sequence[str], vectors) -> None:
+        """Insert or replace the vectors of a batch of ids"""
+        with self._lock:
+            vectors = self._normalize(vectors)
+            if len(ids) != len(vectors):
+                raise ValueError("ids and vectors must have the same length")
+            rows = np.array([self._row_for(id) for id in ids], dtype=np.int64)
+            self._vectors[rows] = vectors
+            if self._centroids is not None:
+                self._assign(rows)
+            if len(self._rows) >= self.train_threshold and len(self._rows) >= 4 * max(self._trained_size, 1):
+                self.train()
+
+    def _row_for(self, id: str) -> int:
+        row = self._rows.get(id)
+        if row is not None:
+            return row
+        if self._free:
+            row = self._free.pop()
+            self._ids[row] = id
+        else:
+            row = len(self._ids)
+            self._ids.append(id)
+            if row >= len(self._vectors):
+                # Grow geometrically so batched inserts stay amortised O(1)
+                capacity = max(64, 2 * len(self._vectors))
+                self._vectors = np.concatenate([self._vectors, np.zeros((capacity - len(self._vectors), self.dim), np.float32)])
+                self._list_of = np.concatenate([self._list_of, np.full(capacity - len(self._list_of), -1, np.int32)])
+                self._live = np.concatenate([self._live, np.zeros(capacity - len(self._live), bool)])
+        self._rows[id] = row
+        self._live[row] = True
+        return row
+
+    def remove(self, ids: Iterable[str]) -> int:
+        """Remove ids from the index, returning how many were present"""
+        removed = 0
+        with self._lock:
+            for id in ids:
+                row = self._rows.pop(id, None)
+                if row is None:
+                    continue
+                self._ids[row] = None
+                self._vectors[row] = 0
+                self._live[row] = False
+                if self._list_of[row] >= 0:
+                    self._lists[self._list_of[row]].discard(row)
+                    self._list_of[row] = -1
+                self._free.append(row)
+                removed += 1
+        return removed
+
+    def train(self, nlist: Optional[int] = None, iterations: int = 10) -> None:
+        """Cluster the current vectors into inverted lists with spherical k-means"""
+        with self._lock:
+            rows = np.array(sorted(self._rows.values()), dtype=np.int64)
+            if not len(rows):
+                return
+            nlist = nlist or max(1, int(np.sqrt(len(rows))))
+            data = self._vectors[rows]
+            rng = np.random.default_rng(self.seed)
+            centroids = data[rng.choice(len(rows), size=min(nlist, len(rows)), replace=False)]
+            for _ in range(iterations):
+                assignment = np.argmax(data @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, data)
+                norms = np.linalg.norm(sums, axis=1, keepdims=True)
+                # Keep the previous centroid of a list that lost all its members
+                centroids = np.where(norms > 0, sums / np.where(norms > 0, norms, 1), centroids)
+            self._centroids = centroids
+            self._lists = [set() for _ in range(len(centroids))]
+            self._list_of[:] = -1
+            self._assign(rows)
+            self._trained_size = len(rows)
+
+    def _assign(self, rows: np.ndarray) -> None:
+        nearest = np.argmax(self._vectors[rows] @ self._centroids.T, axis=1)
+        for row, list_id in zip(rows.tolist(), nearest.tolist()):
+            previous = self._list_of[row]
+            if previous >= 0:
+                self._lists[previous].discard(row)
+            self._lists[list_id].add(row)
+            self._list_of[row] = list_id
+
+    def search(
+        self,
+        vector,
+        k: int = 10,
+        exact: bool = False,
+        exclude: Iterable[str] = (),
+        min_score: Optional[float] = None
+    ) -> List[Tuple[str, float]]:
+        """The k most cosine-similar ids to a vector, as (id, score) in decreasing score"""
+        with self._lock:
+            if not self._rows or k <= 0:
+                return []
+            query = self._normalize(vector)[0]
+            if exact or self._centroids is None:
+                # One product over the whole matrix beats gathering the live rows first
+                used = len(self._ids)
+                candidates = np.flatnonzero(self._live[:used])
+                all_scores = self._vectors[:used] @ query
+            else:
+                all_scores = None
+                probed = np.argsort(-(self._centroids @ query))[:self.nprobe]
+                candidates = np.fromiter(
+                    (row for list_id in probed for row in self._lists[list_id]), dtype=np.int64
+                )
+            excluded = {self._rows[id] for id in exclude if id in self._rows}
+            if excluded:
+                candidates = candidates[~np.isin(candidates, list(excluded))]
+            if not len(candidates):
+                return []
+
+            scores = all_scores[candidates] if all_scores is not None else self._vectors[candidates] @ query
+            # Stored and query vectors are finite, but an overflowing product must not reach JSON
+            keep = np.isfinite(scores)
+            # Threshold before the top-k cut, so k results come back whenever k qualify
+            if min_score is not None:
+                keep &= scores >= min_score
+            if not keep.all():
+                candidates, scores = candidates[keep], scores[keep]
+                if not len(candidates):
+                    return []
+            top = min(k, len(candidates))
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best], kind='stable')]
+            return [(self._ids[candidates[i]], float(scores[i])) for i in best]
+
+    def save(self, path: str, **metadata: str) -> None:
+        """Write the index atomically; metadata strings are stored alongside and returned by `load`"""
+        with self._lock:
+            ids = list(self._rows)
+            vectors = self._vectors[[self._rows[id] for id in ids]] if ids else np.zeros((0, self.dim or 0), np.float32)
+            centroids = self._centroids if self._centroids is not None else np.zeros((0, self.dim or 0), np.float32)
+            trained_size = self._trained_size
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(
+                f, ids=np.array(ids, dtype=str), vectors=vectors, centroids=centroids,
+                trained_size=np.int64(trained_size), **{f"meta_{key}": np.array(value) for key, value in metadata.items()}
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> Tuple["VectorIndex", Dict[str, str]]:
+        """Read an index written by `save`, returning it with its metadata"""
+        with np.load(path, allow_pickle=False) as data:
+            vectors, centroids = data['vectors'], data['centroids']
+            index = cls(dim=vectors.shape[1] or None, **kwargs)
+            if len(centroids):
+                # Vectors are assigned to the saved lists as they are inserted
+                index._centroids = centroids
+                index._lists = [set() for _ in range(len(centroids))]
+                index._trained_size = int(data['trained_size'])
+            # Files written before vectors were validated may hold NaN rows
+            finite = np.isfinite(vectors).all(axis=1)
+            if finite.any():
+                index.upsert(data['ids'][finite].tolist(), vectors[finite])
+            metadata = {key[len("meta_"):]: str(data[key]) for key in data.files if key.startswith("meta_")}
+        return index, metadata
+
+
+class TemplateIndex:
+    """A VectorIndex persisted to `path`.
+
+    Every save rewrites the whole file, so updates only mark the index dirty
+    and a background thread saves it at most every `flush_seconds`; a burst
+    of updates costs one write. `close` saves pending changes and must be
+    called on shutdown, or up to `flush_seconds` of updates are lost.
+    Vectors only compare within one model, so the file records `model_digest`
+    and is ignored (then overwritten) when the model has changed since.
+    """
+
+    def __init__(self, path: Optional[str], model_digest: str, flush_seconds: float = 5.0, **kwargs):
+        self.path = path
+        self.model_digest = model_digest
+        self.flush_seconds = flush_seconds
+        self._save_lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._dirty = False
+        self._closed = False
+        self.index = VectorIndex(**kwargs)
+        if path and os.path.exists(path):
+            index, metadata = VectorIndex.load(path, **kwargs)
+            if metadata.get('model_digest') == model_digest:
+                self.index = index
+        self._thread = None
+        if path:
+            self._thread = threading.Thread(target=self._run, name="template-index-flush", daemon=True)
+            self._thread.start()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def update(self, ids: Sequence[str] = (), vectors=None, remove: Iterable[str] = ()) -> int:
+        """Upsert a batch of vectors and remove ids, saved on the next flush; returns how many ids were removed"""
+        removed = self.index.remove(remove)
+        if len(ids):
+            self.index.upsert(ids, vectors)
+        if self.path:
+            with self._changed:
+                self._dirty = True
+                self._changed.notify()
+        return removed
+
+    def search(self, vector, k: int = 10, **kwargs) -> List[Tuple[str, float]]:
+        return self.index.search(vector, k, **kwargs)
+
+    def flush(self) -> None:
+        """Save pending changes now"""
+        with self._save_lock:
+            with self._changed:
+                if not self._dirty:
+                    return
+                self._dirty = False
+            try:
+                self.index.save(self.path, model_digest=self.model_digest)
+            except BaseException:
+                with self._changed:
+                    self._dirty = True
+                raise
+
+    def close(self) -> None:
+        """Stop the background saves and save pending changes"""
+        with self._changed:
+            self._closed = True
+            self._changed.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self.flush()
+
+    def _run(self) -> None:
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._dirty or self._closed)
+                # Let a burst of updates accumulate into one write; close saves what is left
+                if self._changed.wait_for(lambda: self._closed, self.flush_seconds):
+                    return
+            try:
+                self.flush()
+            except OSError as e:
+                warnings.warn(f"Could not save the template index to {self.path}: {e}")
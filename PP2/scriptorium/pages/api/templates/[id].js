@@ -3,6 +3,7 @@
 
 import prisma from "@/utils/db";
 import { verifyUser } from "@/utils/middleware";
+import { indexTemplate, unindexTemplate } from "@/utils/analysis";
 
 async function handler(req, res) {
   const { id } = req.query;
@@ -44,6 +45,7 @@ async function handler(req, res) {
       });
 
       res.status(200).json(updatedTemplate);
+      indexTemplate(updatedTemplate);
     } catch (error) {
       console.error("Error updating code template:", error);
       res.status(500).json({ error: "Internal server error" });
@@ -64,6 +66,7 @@ async function handler(req, res) {
       });
 
       res.status(204).end();
+      unindexTemplate(existingTemplate.id);
     } catch (error) {
       console.error("Error deleting code template:", error);
       res.status(500).json({ error: "Internal server error" });
@@ -2,6 +2,7 @@
 
 import prisma from "@/utils/db";
 import { verifyUser } from "@/utils/middleware";
+import { indexTemplate } from "@/utils/analysis";
 
 async function handler(req, res) {
   if (req.method !== "POST") {
@@ -105,6 +106,7 @@ async function handler(req, res) {
     });
 
     res.status(201).json(codeTemplate);
+    indexTemplate(codeTemplate);
   } catch (error) {
     console.error("Error creating code template:", error);
     res.status(500).json({ error: "Internal server error" });
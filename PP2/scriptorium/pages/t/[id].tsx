@@ -1,8 +1,8 @@
 // # made by chatGPT
 
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { useRouter } from "next/router";
-import Editor from "@monaco-editor/react";
+import Editor, { OnMount } from "@monaco-editor/react";
 import Navbar from "@/components/NavBar";
 
 interface Tag {
@@ -25,6 +25,11 @@ interface Template {
   author: Author;
 }
 
+type CodeEditor = Parameters<OnMount>[0];
+type EditorSelection = NonNullable<ReturnType<CodeEditor['getSelection']>>;
+
+const ANALYSIS_URL = 'http://localhost:5000';
+
 const TemplateDetail = () => {
   const router = useRouter();
   const { id } = router.query;
@@ -36,6 +41,9 @@ const TemplateDetail = () => {
   const [error, setError] = useState<string | null>(null);
   const [userId, setUserId] = useState<number | null>(null);
   const [editableCode, setEditableCode] = useState('');
+  const editorRef = useRef<CodeEditor | null>(null);
+  // Analysis session of the code it was registered with
+  const sessionRef = useRef<{ id: string; code: string } | null>(null);
 
   useEffect(() => {
     const savedTheme = localStorage.getItem('theme') || 'light';
@@ -91,17 +99,71 @@ const TemplateDetail = () => {
   };
 
 
+  const registerTemplate = async (code: string): Promise<string | null> => {
+    const response = await fetch(`${ANALYSIS_URL}/session`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ input: code })
+    });
+    // The template may not parse as a whole while it is being edited
+    if (!response.ok) return null;
+    const { session_id } = await response.json();
+    sessionRef.current = { id: session_id, code };
+    return session_id;
+  };
+
+  // Analyze the selection as a range of the template, which the server has parsed
+  // once, so partial selections work and repeated ones skip reparsing
+  const predictSelection = async (range: EditorSelection): Promise<Response | null> => {
+    for (let attempt = 0; attempt < 2; attempt++) {
+      let sessionId = sessionRef.current?.code === editableCode ? sessionRef.current.id : null;
+      if (!sessionId) sessionId = await registerTemplate(editableCode);
+      if (!sessionId) return null;
+
+      const response = await fetch(`${ANALYSIS_URL}/session/predict`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+          session_id: sessionId,
+          // Monaco columns are 1-based, the analysis API's are 0-based
+          start_line: range.startLineNumber,
+          start_column: range.startColumn - 1,
+          end_line: range.endLineNumber,
+          end_column: range.endColumn - 1
+        })
+      });
+      if (response.status === 400) return null;
+      if (response.status !== 404) return response;
+      // Session expired on the server, register the template again
+      sessionRef.current = null;
+    }
+    return null;
+  };
+
   const handleAnalyzeCode = async () => {
     try {
       // Get editor instance and selected text
-      const selection = window.getSelection()?.toString();
+      const editor = editorRef.current;
+      const range = editor?.getSelection();
+      const hasRange = !!range && !range.isEmpty();
+      const selection = hasRange
+        ? editor?.getModel()?.getValueInRange(range)
+        : window.getSelection()?.toString();
       
       if (!selection) {
         alert('Please highlight some code to analyze');
         return;
       }
   
-      const response = await fetch('http://localhost:5000/predict', {
+      const sessionResponse = hasRange ? await predictSelection(range) : null;
+      // Session results count lines in the template, fallback results from the selection start
+      const lineOffset = !sessionResponse && hasRange ? range.startLineNumber - 1 : 0;
+      // Fall back to sending the selected text on its own
+      const response = sessionResponse ?? await fetch(`${ANALYSIS_URL}/predict`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -122,7 +184,14 @@ const TemplateDetail = () => {
         const data = await response.json();
         // Display the analysis results
         const { confidence, prediction } = data;
-        alert(`Analysis results:\nPrediction: ${prediction}\nConfidence: ${(confidence * 100).toFixed(2)}%`);
+        // The lines whose code drew the most attention
+        const lines: [number, number][] = data.lines || [];
+        const topLines = [...lines]
+          .sort((a, b) => b[1] - a[1])
+          .slice(0, 3)
+          .map(([line]) => line + lineOffset);
+        const why = topLines.length ? `\nMost influential lines: ${topLines.join(', ')}` : '';
+        alert(`Analysis results:\nPrediction: ${prediction}\nConfidence: ${(confidence * 100).toFixed(2)}%${why}`);
         console.log('Analysis results:', data);
       } else {
         const errorText = await response.text();
@@ -272,6 +341,7 @@ const TemplateDetail = () => {
                 defaultLanguage={template.language}
                 value={editableCode}
                 onChange={handleEditorChange}
+                onMount={(editor) => { editorRef.current = editor; }}
                 theme={theme === 'dark' ? 'vs-dark' : 'vs-light'}
                 options={{
                   fontSize: 14,
@@ -0,0 +1,36 @@
+// Keeps the analysis server's "similar templates" index in step with saved templates
+
+const ANALYSIS_URL = process.env.ANALYSIS_URL || "http://localhost:5000";
+// Shared secret the analysis server requires for index updates (its PREDICT_INDEX_TOKEN)
+const ANALYSIS_INDEX_TOKEN = process.env.ANALYSIS_INDEX_TOKEN;
+
+async function updateIndex(body) {
+  try {
+    const response = await fetch(`${ANALYSIS_URL}/similar/index`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        ...(ANALYSIS_INDEX_TOKEN && { "X-Index-Token": ANALYSIS_INDEX_TOKEN }),
+      },
+      body: JSON.stringify(body),
+    });
+    if (!response.ok) {
+      console.error("Error updating similar templates index:", await response.text());
+    }
+  } catch (error) {
+    // The analysis server is optional, saving a template must not depend on it
+    console.error("Error updating similar templates index:", error);
+  }
+}
+
+export function indexTemplate(template) {
+  // Only Python templates can be embedded
+  if (template.language?.toLowerCase() !== "python") {
+    return updateIndex({ remove: [template.id] });
+  }
+  return updateIndex({ items: [{ id: template.id, input: template.content }] });
+}
+
+export function unindexTemplate(id) {
+  return updateIndex({ remove: [id] });
+}